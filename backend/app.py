@@ -1,31 +1,53 @@
 import os
+import json
+import hashlib
 import secrets
+import itertools
 import re
-from flask import Flask, jsonify, request, send_from_directory, session
+from flask import Flask, Response, jsonify, request, send_file, session, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import logging
 from datetime import datetime, timedelta
+from collections import defaultdict
 from werkzeug.middleware.proxy_fix import ProxyFix
-from auth_utils import require_auth, get_azure_config, get_azure_user, require_admin, require_superadmin
-from cosmos_service import CosmosService
+from auth_utils import (
+    require_auth, get_azure_config, get_azure_user, require_admin, require_superadmin,
+    admin_decided, is_admin_user, role_cache
+)
+from storage import ConflictError, get_storage_service, VISIT_BATCH_LIMIT, visit_id_for_key
 from security import (
     init_security_headers, rate_limit, rate_limit_auth, rate_limiter,
-    validate_attendance_data, sanitize_string, validate_home_name
+    sanitize_string, validate_home_name
 )
+from audit_queue import audit_queue_from_env
+from static_assets import StaticAssets
+from compression import init_compression
+from log_setup import configure_logging, init_request_logging, log_sampled, restart_logging_after_fork
+from server_timing import init_server_timing, timed
+from request_profiler import PROFILE_MAX_MINUTES, init_profiling
+from visit_validation import VisitValidator, validate_visit
+from json_provider import init_json_provider
+from visit_io import VISIT_FORMATS, detect_format, iter_chunks, iter_csv, iter_import_rows, iter_ndjson
 from azure.cosmos.exceptions import CosmosHttpResponseError
 
-# Konfigurera loggning
-logging.basicConfig(level=logging.INFO)
+# Konfigurera loggning: JSON via kö och bakgrundstråd (se LOG_FORMAT, LOG_SAMPLING)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Ladda miljövariabler
 load_dotenv()
 
-# Initiera Flask. 'static_url_path' är satt till '' för att låta vår catch-all hantera alla routes.
-app = Flask(__name__, 
-            static_folder='static',
-            static_url_path='')
+# Initiera Flask utan inbyggd static-route – catch-all nedan serverar React-appen
+app = Flask(__name__, static_folder=None)
+# Request-id i loggposterna och i svarets X-Request-ID
+init_request_logging(app)
+# Snabb JSON-kodning (orjson) för request.get_json() och jsonify, se JSON_PROVIDER
+init_json_provider(app)
+# Server-Timing på API-svar, uppdelat per lager när requesten redan bedömts
+# som admin (se SERVER_TIMING). Registreras först så att total även omfattar
+# övriga after_request-krokar.
+init_server_timing(app, admin_decided)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
 
 # Konfiguration med förbättrad säkerhet (cookie‑baserade signerade sessioner)
@@ -51,59 +73,93 @@ if os.environ.get('FLASK_ENV') != 'production':
 CORS(app, 
      origins=allowed_origins,
      supports_credentials=True,
-     allow_headers=['Content-Type', 'Authorization'])
+     allow_headers=['Content-Type', 'Authorization', 'Idempotency-Key', 'X-Id-Token'])
+
+# Max antal rader per massimport
+MAX_IMPORT_ROWS = int(os.getenv('MAX_IMPORT_ROWS', '10000'))
+
+# Max antal utevistelser per batch-anrop och tillåtet format på klientens id/Idempotency-Key
+MAX_BATCH_VISITS = int(os.getenv('MAX_BATCH_VISITS', '50'))
+CLIENT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,100}$')
+
+# Sidstorlek för Cosmos-frågor vid strömmad export
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', '1000'))
+
+# Initiera lagringen enligt STORAGE_BACKEND (Cosmos DB som standard; skapar databas/containers om de saknas)
+db_service = get_storage_service()
+
+# Auditposter skrivs av en bakgrundstråd i stället för på request-tråden
+audit_queue = None
 
-# Initiera Cosmos DB (skapar databas/containers om de saknas)
-db_service = CosmosService()
+
+def init_worker(after_fork=False):
+    """Skapa resurser som inte överlever fork: Cosmos-anslutningar och bakgrundstrådar.
+
+    Körs vid import. När gunicorn förladdar appen (preload_app) körs den
+    i stället i varje worker från post_fork i gunicorn.conf.py.
+    """
+    global audit_queue
+    if after_fork:
+        restart_logging_after_fork()
+        db_service.connect(ensure=False)
+    audit_queue = audit_queue_from_env(db_service.write_audit_doc)
+    db_service.audit_sink = audit_queue.enqueue if audit_queue is not None else None
+    # Utgångna rate limit-nycklar rensas stegvis av en bakgrundstråd
+    rate_limiter.start_sweeper()
+
+
+if os.getenv('GUNICORN_PRELOAD') != '1':
+    init_worker()
 
 # Initiera säkerhetsheaders
 init_security_headers(app)
 
-# Rensa rate limiter periodiskt
-@app.before_request
-def cleanup_rate_limiter():
-    if not hasattr(app, 'last_cleanup'):
-        app.last_cleanup = datetime.now()
-    
-    if (datetime.now() - app.last_cleanup).seconds > 3600:
-        rate_limiter.cleanup()
-        app.last_cleanup = datetime.now()
+# Profilering av utvalda requests som superadmin slår på vid behov (registreras
+# före komprimeringen så att den ingår i profilen)
+profiler = init_profiling(app)
+
+# Komprimera större API-svar (gzip/brotli enligt Accept-Encoding)
+init_compression(app)
+
+# Manifest över den byggda frontenden (backend/static), med gzip/brotli-varianter
+static_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
 
 # Health check
 @app.route('/health')
-@rate_limit(max_requests=1000, window_seconds=60)
+@rate_limit('health_check')
 def health_check():
+    # Bara liveness: interna räknare finns under /api/admin/health (superadmin)
     return jsonify({'status': 'healthy'}), 200
 
 # Azure AD config endpoint
 @app.route('/api/azure-config')
-@rate_limit(max_requests=500, window_seconds=60)
+@rate_limit('azure_config')
 def azure_config():
     return get_azure_config()
 
 # Azure AD user endpoint
 @app.route('/api/azure-user', methods=['GET', 'POST'])
-@rate_limit(max_requests=500, window_seconds=60)  # Hög limit för många samtidiga inloggningar
+@rate_limit('azure_user')
 def azure_user():
     return get_azure_user()
 
 # Hämta alla äldreboenden
 @app.route('/api/aldreboenden')
 @require_auth
-@rate_limit(max_requests=1000, window_seconds=60)
+@rate_limit('get_homes')
 def get_homes():
     try:
         homes = db_service.get_all_homes()
         return jsonify(homes), 200
     except Exception as e:
-        logger.error(f"Error fetching äldreboenden: {str(e)}")
+        logger.error('Error fetching äldreboenden: %s', e)
         return jsonify({'error': 'Kunde inte hämta äldreboenden'}), 500
 
 # Lägg till ett nytt äldreboende
 @app.route('/api/aldreboenden', methods=['POST'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=100, window_seconds=60)
+@rate_limit('add_home')
 def add_home():
     user_oid = session.get('azure_user', {}).get('oid', 'unknown')
     
@@ -129,18 +185,18 @@ def add_home():
         if home_id is None:
             return jsonify({'error': f'Äldreboende med namnet "{name}" finns redan.'}), 409
 
-        logger.info(f"User OID {user_oid} added home with id '{home_id}'.")
+        logger.info("User OID %s added home with id '%s'.", user_oid, home_id)
         return jsonify({'success': True, 'id': home_id}), 201
         
     except Exception as e:
-        logger.error(f"Error adding home: {str(e)}")
+        logger.error('Error adding home: %s', e)
         return jsonify({'error': 'Ett fel uppstod vid skapande av äldreboende'}), 500
 
 
 @app.route('/api/aldreboenden/<home_id>/departments', methods=['POST'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=100, window_seconds=60)
+@rate_limit('add_department')
 def add_department(home_id):
     try:
         data = request.get_json() or {}
@@ -159,20 +215,20 @@ def add_department(home_id):
                 return jsonify({'error': 'Äldreboendet hittades inte'}), 404
             raise
         except CosmosHttpResponseError as exc:
-            logger.error(f"Cosmos error adding department for home {home_id}: {exc}")
+            logger.error('Cosmos error adding department for home %s: %s', home_id, exc)
             return jsonify({'error': 'Kunde inte lägga till avdelning', 'detail': str(exc)}), 500
         if dept is None:
             return jsonify({'error': 'Avdelningen finns redan'}), 409
         return jsonify(dept), 201
     except Exception as e:
-        logger.error(f"Error adding department: {e}")
+        logger.error('Error adding department: %s', e)
         return jsonify({'error': 'Kunde inte lägga till avdelning', 'detail': str(e)}), 500
 
 
 @app.route('/api/aldreboenden/<home_id>/departments/<department_id>', methods=['PUT'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=100, window_seconds=60)
+@rate_limit('update_department')
 def update_department(home_id, department_id):
     try:
         data = request.get_json() or {}
@@ -186,14 +242,14 @@ def update_department(home_id, department_id):
             return jsonify({'error': 'Avdelningen hittades inte'}), 404
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error updating department: {e}")
+        logger.error('Error updating department: %s', e)
         return jsonify({'error': 'Kunde inte uppdatera avdelning'}), 500
 
 
 @app.route('/api/aldreboenden/<home_id>/departments/<department_id>', methods=['DELETE'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('delete_department')
 def delete_department(home_id, department_id):
     try:
         ok = db_service.remove_department(home_id, department_id)
@@ -201,26 +257,26 @@ def delete_department(home_id, department_id):
             return jsonify({'error': 'Avdelningen hittades inte'}), 404
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error deleting department: {e}")
+        logger.error('Error deleting department: %s', e)
         return jsonify({'error': 'Kunde inte ta bort avdelning'}), 500
 
 # Hämta aktiviteter
 @app.route('/api/activities')
 @require_auth
-@rate_limit(max_requests=1000, window_seconds=60)
+@rate_limit('get_activities')
 def get_activities():
     try:
         activities = db_service.get_all_activities()
         return jsonify(activities), 200
     except Exception as e:
-        logger.error(f"Error fetching activities: {str(e)}")
+        logger.error('Error fetching activities: %s', e)
         return jsonify({'error': 'Kunde inte hämta aktiviteter'}), 500
 
 # Lägg till en ny aktivitet
 @app.route('/api/activities', methods=['POST'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=100, window_seconds=60)
+@rate_limit('add_activity')
 def add_activity():
     user_oid = session.get('azure_user', {}).get('oid', 'unknown')
     
@@ -249,18 +305,18 @@ def add_activity():
         if activity_id is None:
             return jsonify({'error': f'Aktivitet med namnet "{name}" finns redan.'}), 409
 
-        logger.info(f"User OID {user_oid} added activity with id '{activity_id}'.")
+        logger.info("User OID %s added activity with id '%s'.", user_oid, activity_id)
         return jsonify({'success': True, 'id': activity_id}), 201
         
     except Exception as e:
-        logger.error(f"Error adding activity: {str(e)}")
+        logger.error('Error adding activity: %s', e)
         return jsonify({'error': 'Ett fel uppstod vid skapande av aktivitet'}), 500
 
 # Uppdatera (byta namn på) en aktivitet
 @app.route('/api/activities/<activity_id>', methods=['PUT'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('rename_activity')
 def rename_activity(activity_id):
     try:
         body = request.get_json() or {}
@@ -291,14 +347,14 @@ def rename_activity(activity_id):
             return jsonify({'error': 'Kunde inte uppdatera aktivitet'}), 500
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error renaming activity {activity_id}: {e}")
+        logger.error('Error renaming activity %s: %s', activity_id, e)
         return jsonify({'error': 'Ett fel uppstod vid uppdatering av aktivitet'}), 500
 
 # Inaktivera (ta bort) en aktivitet
 @app.route('/api/activities/<activity_id>', methods=['DELETE'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('delete_activity')
 def delete_activity(activity_id):
     try:
         ok = db_service.deactivate_activity(activity_id)
@@ -306,26 +362,26 @@ def delete_activity(activity_id):
             return jsonify({'error': 'Aktiviteten hittades inte'}), 404
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error deactivating activity {activity_id}: {e}")
+        logger.error('Error deactivating activity %s: %s', activity_id, e)
         return jsonify({'error': 'Kunde inte ta bort aktiviteten'}), 500
 
 
 @app.route('/api/companions')
 @require_auth
-@rate_limit(max_requests=1000, window_seconds=60)
+@rate_limit('get_companions')
 def get_companions():
     try:
         companions = db_service.get_all_companions()
         return jsonify(companions), 200
     except Exception as e:
-        logger.error(f"Error fetching companions: {e}")
+        logger.error('Error fetching companions: %s', e)
         return jsonify({'error': 'Kunde inte hämta med vem-lista'}), 500
 
 
 @app.route('/api/companions', methods=['POST'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=100, window_seconds=60)
+@rate_limit('add_companion')
 def add_companion():
     try:
         body = request.get_json() or {}
@@ -337,14 +393,14 @@ def add_companion():
             return jsonify({'error': 'Med vem finns redan'}), 409
         return jsonify({'success': True, 'id': companion_id}), 201
     except Exception as e:
-        logger.error(f"Error adding companion: {e}")
+        logger.error('Error adding companion: %s', e)
         return jsonify({'error': 'Kunde inte lägga till'}), 500
 
 
 @app.route('/api/companions/<companion_id>', methods=['PUT'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('rename_companion')
 def rename_companion(companion_id):
     try:
         body = request.get_json() or {}
@@ -356,14 +412,14 @@ def rename_companion(companion_id):
             return jsonify({'error': 'Hittades inte'}), 404
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error renaming companion: {e}")
+        logger.error('Error renaming companion: %s', e)
         return jsonify({'error': 'Kunde inte uppdatera'}), 500
 
 
 @app.route('/api/companions/<companion_id>', methods=['DELETE'])
 @require_auth
 @require_admin
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('delete_companion')
 def delete_companion(companion_id):
     try:
         ok = db_service.deactivate_companion(companion_id)
@@ -371,13 +427,30 @@ def delete_companion(companion_id):
             return jsonify({'error': 'Hittades inte'}), 404
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error deleting companion: {e}")
+        logger.error('Error deleting companion: %s', e)
         return jsonify({'error': 'Kunde inte ta bort'}), 500
 
+
+def _home_validator(validators, home_id):
+    """Validator för äldreboendet, cachad per anrop (None om boendet saknas)."""
+    if home_id not in validators:
+        home_doc = db_service.get_home(home_id)
+        validators[home_id] = VisitValidator(home_doc) if home_doc else None
+    return validators[home_id]
+
+
+def _stamp_visit_metadata(data, user_email, user_oid):
+    data['registered_by'] = user_email
+    data['registered_by_oid'] = user_oid
+    data['registered_at'] = datetime.utcnow()
+    data['last_modified_at'] = data['registered_at']
+    data['edit_count'] = 0
+
+
 # Registrera utevistelse
 @app.route('/api/visits', methods=['POST'])
 @require_auth
-@rate_limit(max_requests=500, window_seconds=60)  # Många kan registrera samtidigt
+@rate_limit('register_visit')
 def register_visit():
     try:
         data = request.get_json()
@@ -387,147 +460,335 @@ def register_visit():
         user_email = session.get('azure_user', {}).get('email', '')
         user_oid = session.get('azure_user', {}).get('oid', 'unknown')
 
+        # Idempotens: samma nyckel ger samma dokument-id, så en omsändning krockar (ConflictError).
+        # client_id tas alltid bort så att den aldrig sparas i dokumentet.
+        client_id = data.pop('client_id', None)
+        idempotency_key = request.headers.get('Idempotency-Key') or client_id
+        data.pop('id', None)
+        if idempotency_key is not None:
+            if not isinstance(idempotency_key, str) or not CLIENT_ID_PATTERN.match(idempotency_key.strip()):
+                return jsonify({'error': 'Ogiltig Idempotency-Key'}), 400
+            idempotency_key = idempotency_key.strip()
+
         home_id = (data.get('home_id') or '').strip()
         home_doc = db_service.get_home(home_id)
         if not home_doc:
             return jsonify({'error': 'Äldreboendet hittades inte'}), 400
         data['home_id'] = home_id
-
-        # Validera all data
-        is_valid, errors = validate_attendance_data(data, home_doc)
-        if not is_valid:
+        if idempotency_key is not None:
+            # Äldreboendet ingår: Cosmos id:n är unika per partition (/home_id)
+            data['id'] = visit_id_for_key(user_oid, home_id, idempotency_key)
+
+        # Validera och normalisera all data i ett pass
+        with timed('validation'):
+            data, errors = validate_visit(data, home_doc)
+        if errors:
             return jsonify({'errors': errors}), 400
 
-        # Sanitera och normalisera fält
-        gender_counts = data.get('gender_counts') or {}
-        data['gender_counts'] = {
-            'men': int(gender_counts.get('men', 0)),
-            'women': int(gender_counts.get('women', 0))
-        }
-
-        total = data['gender_counts']['men'] + data['gender_counts']['women']
-        data['total_participants'] = total
-
-        offer_status = data.get('offer_status')
-        visit_type = data.get('visit_type')
-        activity_name = sanitize_string(data.get('activity_name', ''), max_length=100)
-        companion_name = sanitize_string(data.get('companion_name', ''), max_length=100)
-        data['activity'] = activity_name
-        data['activity_name'] = activity_name
-        data['companion'] = companion_name
-        data['companion_name'] = companion_name
-        data['activity_id'] = sanitize_string(data.get('activity_id', ''), max_length=120)
-        data['companion_id'] = sanitize_string(data.get('companion_id', ''), max_length=120)
-        department_raw = data.get('department_id', '')
-        department_id = department_raw if isinstance(department_raw, str) else ('' if department_raw is None else str(department_raw))
-        if len(department_id) > 160:
-            return jsonify({'error': 'Ogiltigt avdelnings-ID'}), 400
-        data['department_id'] = sanitize_string(department_id, max_length=200)
-
-        if offer_status == 'declined':
-            data['activity'] = ''
-            data['activity_name'] = ''
-            data['activity_id'] = ''
-            data['companion'] = ''
-            data['companion_name'] = ''
-            data['companion_id'] = ''
-            data['duration_minutes'] = None
-
-        duration_value = data.get('duration_minutes')
-        if duration_value is not None:
-            try:
-                data['duration_minutes'] = int(duration_value)
-            except (TypeError, ValueError):
-                data['duration_minutes'] = None
-
-        satisfaction_entries = []
-        for entry in data.get('satisfaction_entries') or []:
-            satisfaction_entries.append({
-                'gender': entry.get('gender'),
-                'rating': int(entry.get('rating'))
-            })
-        data['satisfaction_entries'] = satisfaction_entries
-
-        data['visit_type'] = visit_type
-        data['offer_status'] = offer_status
-
         # Lägg till metadata
-        data['registered_by'] = user_email
-        data['registered_by_oid'] = user_oid
-        data['registered_at'] = datetime.utcnow()
-        data['last_modified_at'] = data['registered_at']
-        data['edit_count'] = 0
+        _stamp_visit_metadata(data, user_email, user_oid)
 
         # Lägg till aktiviteten om den är ny
         if data.get('activity'):
             db_service.add_activity_if_not_exists(data.get('activity'))
 
-        # Spara i Cosmos DB
-        doc_id = db_service.add_visit(data)
+        # Spara besöket
+        try:
+            doc_id = db_service.add_visit(data)
+        except ConflictError:
+            if idempotency_key is None:
+                raise
+            # Omsändning av en redan sparad registrering – svara som första gången
+            response = jsonify({'success': True, 'id': data['id']})
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 201
         
-        logger.info(f"User OID {user_oid} registered visit for {data['home_id']}")
+        log_sampled(logger, 'visits', 'User OID %s registered visit for %s', user_oid, data['home_id'])
         return jsonify({'success': True, 'id': doc_id}), 201
         
     except Exception as e:
-        logger.error(f"Error registering visit: {str(e)}")
+        logger.error('Error registering visit: %s', e)
         return jsonify({'error': 'Kunde inte registrera utevistelse'}), 500
 
+
+# Massimport av utevistelser (CSV eller NDJSON)
+@app.route('/api/visits/import', methods=['POST'])
+@require_auth
+@rate_limit('import_visits')
+def import_visits():
+    fmt = detect_format(request.args.get('format'), request.content_type)
+    if not fmt:
+        return jsonify({'error': 'Ange format=csv eller format=ndjson'}), 400
+
+    user_email = session.get('azure_user', {}).get('email', '')
+    user_oid = session.get('azure_user', {}).get('oid', 'unknown')
+
+    results = []
+    validators = {}
+    known_activities = set()
+    pending = defaultdict(list)
+    # Kedjad hash över raderna hittills: samma fil ger samma dokument-id per rad,
+    # så en omuppladdning efter ett avbrott svarar 'exists' i stället för att dubblera
+    upload_digest = hashlib.sha256()
+    last_row = 0
+
+    def flush(home_id):
+        rows = pending.pop(home_id, [])
+        if not rows:
+            return
+        written = db_service.add_visits_batch(home_id, [doc for _, doc in rows])
+        for (row_no, _), (doc_id, status) in zip(rows, written):
+            if status == 'error':
+                results.append({'row': row_no, 'status': 'error', 'errors': ['Kunde inte spara raden']})
+            else:
+                results.append({'row': row_no, 'status': status, 'id': doc_id})
+
+    def import_response(error=None, status=200):
+        results.sort(key=lambda r: r['row'])
+        created = sum(1 for r in results if r['status'] == 'created')
+        failed = sum(1 for r in results if r['status'] == 'error')
+        body = {'created': created, 'failed': failed, 'results': results}
+        if error:
+            body['error'] = error
+        logger.info('User OID %s imported %s visits (%s failed)', user_oid, created, failed)
+        return jsonify(body), status
+
+    def abort_import(error, status):
+        # Redan sparade batchar finns kvar: flusha giltiga rader och rapportera avbrottet som en rad
+        try:
+            for home_id in list(pending.keys()):
+                flush(home_id)
+        except Exception as e:
+            logger.error('Error saving visits before aborted import: %s', e)
+            for rows in pending.values():
+                results.extend({'row': row_no, 'status': 'error', 'errors': ['Kunde inte spara raden']}
+                               for row_no, _ in rows)
+            pending.clear()
+        results.append({'row': last_row + 1, 'status': 'error', 'errors': [error]})
+        return import_response(error, status)
+
+    try:
+        for row_no, data, parse_error in iter_import_rows(request.stream, fmt):
+            last_row = row_no
+            upload_digest.update(json.dumps([row_no, data, parse_error], sort_keys=True, default=str).encode())
+            if row_no > MAX_IMPORT_ROWS:
+                results.append({'row': row_no, 'status': 'error', 'errors': [f'Max {MAX_IMPORT_ROWS} rader per import']})
+                break
+            if parse_error:
+                results.append({'row': row_no, 'status': 'error', 'errors': [parse_error]})
+                continue
+
+            home_id = str(data.get('home_id') or '').strip()
+            validator = _home_validator(validators, home_id)
+            if validator is None:
+                results.append({'row': row_no, 'status': 'error', 'errors': ['Äldreboendet hittades inte']})
+                continue
+            data['home_id'] = home_id
+
+            with timed('validation'):
+                data, errors = validator.validate(data)
+            if errors:
+                results.append({'row': row_no, 'status': 'error', 'errors': errors})
+                continue
+            _stamp_visit_metadata(data, user_email, user_oid)
+            data['id'] = visit_id_for_key(user_oid, home_id, f'import:{upload_digest.hexdigest()}:{row_no}')
+
+            activity = data.get('activity')
+            if activity and activity not in known_activities:
+                db_service.add_activity_if_not_exists(activity)
+                known_activities.add(activity)
+
+            pending[home_id].append((row_no, data))
+            if len(pending[home_id]) >= VISIT_BATCH_LIMIT:
+                flush(home_id)
+
+        for home_id in list(pending.keys()):
+            flush(home_id)
+    except UnicodeDecodeError:
+        return abort_import('Filen måste vara UTF-8-kodad', 400)
+    except Exception as e:
+        logger.error('Error importing visits: %s', e)
+        return abort_import('Kunde inte importera utevistelser', 500)
+
+    return import_response()
+
+
+# Registrera flera utevistelser i ett anrop (offline-kö från mobilen)
+@app.route('/api/visits/batch', methods=['POST'])
+@require_auth
+@rate_limit('register_visits_batch')
+def register_visits_batch():
+    try:
+        body = request.get_json(silent=True) or {}
+        visits = body.get('visits')
+        if not isinstance(visits, list) or not visits:
+            return jsonify({'error': 'Fältet "visits" måste vara en icke-tom lista'}), 400
+        if len(visits) > MAX_BATCH_VISITS:
+            return jsonify({'error': f'Max {MAX_BATCH_VISITS} utevistelser per anrop'}), 400
+
+        user_email = session.get('azure_user', {}).get('email', '')
+        user_oid = session.get('azure_user', {}).get('oid', 'unknown')
+
+        results = [None] * len(visits)
+        validators = {}
+        known_activities = set()
+        pending = defaultdict(list)
+
+        for index, data in enumerate(visits):
+            if not isinstance(data, dict):
+                results[index] = {'index': index, 'status': 'error', 'errors': ['Posten måste vara ett objekt']}
+                continue
+            client_id = data.pop('client_id', None)
+            if not isinstance(client_id, str) or not CLIENT_ID_PATTERN.match(client_id):
+                results[index] = {'index': index, 'status': 'error', 'errors': ['Ogiltigt eller saknat client_id']}
+                continue
+            item = {'index': index, 'client_id': client_id}
+
+            home_id = str(data.get('home_id') or '').strip()
+            validator = _home_validator(validators, home_id)
+            if validator is None:
+                results[index] = {**item, 'status': 'error', 'errors': ['Äldreboendet hittades inte']}
+                continue
+            data['home_id'] = home_id
+
+            with timed('validation'):
+                data, errors = validator.validate(data)
+            if errors:
+                results[index] = {**item, 'status': 'error', 'errors': errors}
+                continue
+            _stamp_visit_metadata(data, user_email, user_oid)
+            # Deterministiskt id gör att en omsändning efter tappad uppkoppling inte dubblerar posten
+            data['id'] = visit_id_for_key(user_oid, home_id, client_id)
+
+            activity = data.get('activity')
+            if activity and activity not in known_activities:
+                db_service.add_activity_if_not_exists(activity)
+                known_activities.add(activity)
+
+            pending[home_id].append((item, data))
+
+        for home_id, rows in pending.items():
+            written = db_service.add_visits_batch(home_id, [doc for _, doc in rows])
+            for (item, _), (doc_id, status) in zip(rows, written):
+                if status == 'error':
+                    results[item['index']] = {**item, 'status': 'error', 'errors': ['Kunde inte spara utevistelsen']}
+                else:
+                    results[item['index']] = {**item, 'status': status, 'id': doc_id}
+
+        created = sum(1 for r in results if r['status'] == 'created')
+        log_sampled(logger, 'visits', 'User OID %s batch-registered %s of %s visits', user_oid, created, len(visits))
+        return jsonify({'results': results}), 200
+
+    except Exception as e:
+        logger.error('Error registering visit batch: %s', e)
+        return jsonify({'error': 'Kunde inte registrera utevistelser'}), 500
+
+# Fält som aldrig lämnas ut via statistik eller export
+STATISTICS_REDACT_KEYS = {'registered_by', 'registered_by_oid', 'registered_at', 'last_modified_at', 'edit_count'}
+
+
+def _statistics_filters():
+    """Läs och validera statistikfilter. Returnerar (filter, felmeddelande)."""
+    filters = {
+        'home_id': (request.args.get('home') or '').strip() or None,
+        'date_from': request.args.get('from'),
+        'date_to': request.args.get('to'),
+        'department_id': (request.args.get('department') or '').strip() or None,
+        'activity_id': (request.args.get('activity') or '').strip() or None,
+        'companion_id': (request.args.get('companion') or '').strip() or None,
+        'offer_status': (request.args.get('offer_status') or '').strip() or None,
+        'visit_type': (request.args.get('visit_type') or '').strip() or None,
+    }
+
+    # Validera datum om de finns
+    if filters['date_from']:
+        try:
+            datetime.strptime(filters['date_from'], '%Y-%m-%d')
+        except ValueError:
+            return None, 'Ogiltigt from-datum format'
+
+    if filters['date_to']:
+        try:
+            datetime.strptime(filters['date_to'], '%Y-%m-%d')
+        except ValueError:
+            return None, 'Ogiltigt to-datum format'
+    return filters, None
+
+
+def _redact_statistics(item):
+    return {k: v for k, v in item.items() if k not in STATISTICS_REDACT_KEYS}
+
+
 # Hämta statistik
 @app.route('/api/statistics')
 @require_auth
-@rate_limit(max_requests=300, window_seconds=60)
+@rate_limit('get_statistics')
 def get_statistics():
     try:
         # Query parameters med validering
-        home_id = (request.args.get('home') or '').strip() or None
-        date_from = request.args.get('from')
-        date_to = request.args.get('to')
-        department_id = (request.args.get('department') or '').strip() or None
-        activity_id = (request.args.get('activity') or '').strip() or None
-        companion_id = (request.args.get('companion') or '').strip() or None
-        offer_status = (request.args.get('offer_status') or '').strip() or None
-        visit_type = (request.args.get('visit_type') or '').strip() or None
-
-        # Validera datum om de finns
-        if date_from:
-            try:
-                datetime.strptime(date_from, '%Y-%m-%d')
-            except ValueError:
-                return jsonify({'error': 'Ogiltigt from-datum format'}), 400
-                
-        if date_to:
-            try:
-                datetime.strptime(date_to, '%Y-%m-%d')
-            except ValueError:
-                return jsonify({'error': 'Ogiltigt to-datum format'}), 400
-        
-        stats = db_service.get_statistics(
-            home_id=home_id,
-            date_from=date_from,
-            date_to=date_to,
-            department_id=department_id,
-            activity_id=activity_id,
-            companion_id=companion_id,
-            offer_status=offer_status,
-            visit_type=visit_type
-        )
+        filters, error = _statistics_filters()
+        if error:
+            return jsonify({'error': error}), 400
+
+        stats = db_service.get_statistics(**filters)
 
         # Ta bort PII-relaterade fält men låt övriga statistikfält vara orörda
-        redact_keys = {'registered_by', 'registered_by_oid', 'registered_at', 'last_modified_at', 'edit_count'}
-        sanitized = []
-        for item in stats:
-            sanitized.append({k: v for k, v in item.items() if k not in redact_keys})
+        sanitized = [_redact_statistics(item) for item in stats]
 
         return jsonify(sanitized), 200
         
     except Exception as e:
-        logger.error(f"Error fetching statistics: {str(e)}")
+        logger.error('Error fetching statistics: %s', e)
         return jsonify({'error': 'Kunde inte hämta statistik'}), 500
 
+
+# Exportera statistik som CSV eller NDJSON, strömmat direkt från Cosmos
+@app.route('/api/statistics/export')
+@require_auth
+@rate_limit('export_statistics')
+def export_statistics():
+    fmt = (request.args.get('format') or 'csv').strip().lower()
+    if fmt not in VISIT_FORMATS:
+        return jsonify({'error': 'Ange format=csv eller format=ndjson'}), 400
+    filters, error = _statistics_filters()
+    if error:
+        return jsonify({'error': error}), 400
+    compress = (request.args.get('gzip') or '').strip().lower() in ('1', 'true', 'yes')
+
+    try:
+        # Hämta första sidan innan svaret påbörjas så att fel ger 500 i stället för en avklippt fil
+        items = iter(db_service.iter_statistics(page_size=EXPORT_PAGE_SIZE, **filters))
+        first = next(items, None)
+        if first is not None:
+            items = itertools.chain((first,), items)
+    except Exception as e:
+        logger.error('Error exporting statistics: %s', e)
+        return jsonify({'error': 'Kunde inte exportera statistik'}), 500
+
+    def generate():
+        redacted = (_redact_statistics(item) for item in items)
+        lines = iter_csv(redacted) if fmt == 'csv' else iter_ndjson(redacted, app.json.dumps)
+        try:
+            yield from iter_chunks(lines, compress=compress)
+        except Exception as e:
+            # Svaret är redan påbörjat – logga och avbryt strömmen
+            logger.error('Error while streaming statistics export: %s', e)
+            raise
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"statistik-{datetime.utcnow().strftime('%Y%m%d')}.{fmt}"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 # ---- Mina utevistelser ----
 @app.route('/api/my-visits')
 @require_auth
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('my_visits')
 def my_visits():
     try:
         azure_user = session.get('azure_user', {})
@@ -566,13 +827,13 @@ def my_visits():
             })
         return jsonify(summaries), 200
     except Exception as e:
-        logger.error(f"Error in /api/my-visits: {e}")
+        logger.error('Error in /api/my-visits: %s', e)
         return jsonify({'error': 'Kunde inte hämta registreringar'}), 500
 
 
 @app.route('/api/visits/<doc_id>')
 @require_auth
-@rate_limit(max_requests=120, window_seconds=60)
+@rate_limit('get_visit')
 def get_visit(doc_id):
     try:
         azure_user = session.get('azure_user', {})
@@ -586,13 +847,13 @@ def get_visit(doc_id):
             return jsonify({'error': 'Förbjudet'}), 403
         return jsonify(doc), 200
     except Exception as e:
-        logger.error(f"Error in GET /api/visits/{doc_id}: {e}")
+        logger.error('Error in GET /api/visits/%s: %s', doc_id, e)
         return jsonify({'error': 'Ett fel uppstod'}), 500
 
 
 @app.route('/api/visits/<doc_id>', methods=['PUT'])
 @require_auth
-@rate_limit(max_requests=30, window_seconds=60)
+@rate_limit('update_visit')
 def update_visit(doc_id):
     try:
         azure_user = session.get('azure_user', {})
@@ -620,50 +881,12 @@ def update_visit(doc_id):
             home_doc = db_service.get_home(existing.get('home_id'))
         # Legacy fallback: allow editing even if home is missing now
 
-        # Validate incoming data (require full object fields)
-        is_valid, errors = validate_attendance_data(body, home_doc, existing_department_id=existing.get('department_id'))
-        if not is_valid:
+        # Validera och normalisera (kräver alla fält)
+        with timed('validation'):
+            body, errors = validate_visit(body, home_doc, existing_department_id=existing.get('department_id'))
+        if errors:
             return jsonify({'errors': errors}), 400
 
-        gender_counts = body.get('gender_counts') or {}
-        body['gender_counts'] = {
-            'men': int(gender_counts.get('men', 0)),
-            'women': int(gender_counts.get('women', 0))
-        }
-        total = body['gender_counts']['men'] + body['gender_counts']['women']
-        body['total_participants'] = total
-
-        offer_status = body.get('offer_status')
-        body['activity'] = sanitize_string(body.get('activity_name', ''), max_length=100)
-        body['activity_name'] = body['activity']
-        body['activity_id'] = sanitize_string(body.get('activity_id', ''), max_length=120)
-        body['companion'] = sanitize_string(body.get('companion_name', ''), max_length=100)
-        body['companion_name'] = body['companion']
-        body['companion_id'] = sanitize_string(body.get('companion_id', ''), max_length=120)
-        body['department_id'] = sanitize_string(body.get('department_id', existing.get('department_id') or ''), max_length=120)
-
-        if offer_status == 'declined':
-            body['activity'] = ''
-            body['activity_name'] = ''
-            body['activity_id'] = ''
-            body['companion'] = ''
-            body['companion_name'] = ''
-            body['companion_id'] = ''
-            body['duration_minutes'] = None
-        else:
-            try:
-                body['duration_minutes'] = int(body.get('duration_minutes'))
-            except (TypeError, ValueError):
-                body['duration_minutes'] = None
-
-        satisfaction_entries = []
-        for entry in body.get('satisfaction_entries') or []:
-            satisfaction_entries.append({
-                'gender': entry.get('gender'),
-                'rating': int(entry.get('rating'))
-            })
-        body['satisfaction_entries'] = satisfaction_entries
-
         if body.get('activity'):
             db_service.add_activity_if_not_exists(body.get('activity'))
 
@@ -676,7 +899,7 @@ def update_visit(doc_id):
         try:
             updated = db_service.update_visit(doc_id, body)
         except CosmosHttpResponseError as exc:
-            logger.error(f"Cosmos error updating visit {doc_id}: {exc}")
+            logger.error('Cosmos error updating visit %s: %s', doc_id, exc)
             return jsonify({'error': 'Kunde inte uppdatera', 'detail': str(exc)}), 500
         if not updated:
             return jsonify({'error': 'Hittades inte'}), 404
@@ -686,17 +909,17 @@ def update_visit(doc_id):
             changed_fields = [k for k in body.keys() if existing.get(k) != body.get(k)]
             db_service.write_visit_audit('update', oid, email, doc_id, changed_fields)
         except Exception as e:
-            logger.error(f"Failed to write visit audit (update): {e}")
+            logger.error('Failed to write visit audit (update): %s', e)
 
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error in PUT /api/visits/{doc_id}: {e}")
+        logger.error('Error in PUT /api/visits/%s: %s', doc_id, e)
         return jsonify({'error': 'Kunde inte uppdatera'}), 500
 
 
 @app.route('/api/visits/<doc_id>', methods=['DELETE'])
 @require_auth
-@rate_limit(max_requests=30, window_seconds=60)
+@rate_limit('delete_visit')
 def delete_visit(doc_id):
     try:
         azure_user = session.get('azure_user', {})
@@ -714,16 +937,16 @@ def delete_visit(doc_id):
         try:
             db_service.write_visit_audit('delete', oid, email, doc_id)
         except Exception as e:
-            logger.error(f"Failed to write visit audit (delete): {e}")
+            logger.error('Failed to write visit audit (delete): %s', e)
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Error in DELETE /api/visits/{doc_id}: {e}")
+        logger.error('Error in DELETE /api/visits/%s: %s', doc_id, e)
         return jsonify({'error': 'Kunde inte ta bort'}), 500
 
 # Me endpoint with role flags
 @app.route('/api/me')
 @require_auth
-@rate_limit(max_requests=1000, window_seconds=60)
+@rate_limit('me')
 def me():
     try:
         azure_user = session.get('azure_user', {})
@@ -732,8 +955,7 @@ def me():
         oid = azure_user.get('oid')
         # Compute roles
         is_superadmin = email == (os.getenv('SUPERADMIN_EMAIL') or '').strip().lower()
-        user_doc = db_service.get_user(oid)
-        is_admin = bool((user_doc or {}).get('roles', {}).get('admin')) or is_superadmin
+        is_admin = is_superadmin or is_admin_user(oid)
         return jsonify({
             'email': email,
             'display_name': name,
@@ -741,14 +963,14 @@ def me():
             'is_admin': is_admin
         }), 200
     except Exception as e:
-        logger.error(f"Error in /api/me: {e}")
+        logger.error('Error in /api/me: %s', e)
         return jsonify({'error': 'Kunde inte hämta användarinformation'}), 500
 
 # Admin: list users (superadmin only)
 @app.route('/api/admin/users')
 @require_auth
 @require_superadmin
-@rate_limit(max_requests=60, window_seconds=60)
+@rate_limit('list_users')
 def list_users():
     try:
         q = request.args.get('q')
@@ -759,14 +981,14 @@ def list_users():
         users = db_service.list_users(q=q, limit=limit)
         return jsonify(users), 200
     except Exception as e:
-        logger.error(f"Error listing users: {e}")
+        logger.error('Error listing users: %s', e)
         return jsonify({'error': 'Kunde inte hämta användare'}), 500
 
 # Admin: set user role (superadmin only)
 @app.route('/api/admin/users/<user_id>/role', methods=['PUT'])
 @require_auth
 @require_superadmin
-@rate_limit(max_requests=30, window_seconds=60)
+@rate_limit('set_user_role')
 def set_user_role(user_id):
     try:
         body = request.get_json() or {}
@@ -780,18 +1002,91 @@ def set_user_role(user_id):
             result = db_service.set_admin_role(user_id, admin, actor_oid, actor_email)
         except KeyError:
             return jsonify({'error': 'Användare hittades inte'}), 404
+        finally:
+            role_cache.invalidate(user_id)
         return jsonify(result), 200
     except Exception as e:
-        logger.error(f"Error setting user role: {e}")
+        logger.error('Error setting user role: %s', e)
         return jsonify({'error': 'Kunde inte uppdatera roll'}), 500
 
+# Admin: workerns interna räknare, audit-kö och rate limiter (superadmin only)
+@app.route('/api/admin/health')
+@require_auth
+@require_superadmin
+@rate_limit('get_server_health')
+def get_server_health():
+    return jsonify({
+        'status': 'healthy',
+        'pid': os.getpid(),
+        'audit_pending': audit_queue.pending() if audit_queue is not None else 0,
+        'rate_limiter': rate_limiter.stats()
+    }), 200
+
+
+# Admin: profilering av requests (superadmin only)
+@app.route('/api/admin/profiling')
+@require_auth
+@require_superadmin
+@rate_limit('get_profiling')
+def get_profiling():
+    try:
+        return jsonify({'config': profiler.get_config(), 'profiles': profiler.list_profiles()}), 200
+    except Exception as e:
+        logger.error('Error reading profiling status: %s', e)
+        return jsonify({'error': 'Kunde inte hämta profileringen'}), 500
+
+
+@app.route('/api/admin/profiling', methods=['PUT'])
+@require_auth
+@require_superadmin
+@rate_limit('update_profiling')
+def update_profiling():
+    try:
+        body = request.get_json() or {}
+        enabled = body.get('enabled')
+        if type(enabled) is not bool:
+            return jsonify({'error': 'Fältet "enabled" måste vara boolean'}), 400
+        sample_rate = body.get('sample_rate', 0.1)
+        if type(sample_rate) not in (int, float) or not 0 < sample_rate <= 1:
+            return jsonify({'error': 'sample_rate måste vara ett tal större än 0 och högst 1'}), 400
+        threshold_ms = body.get('threshold_ms', 0)
+        if type(threshold_ms) not in (int, float) or threshold_ms < 0:
+            return jsonify({'error': 'threshold_ms måste vara ett tal större än eller lika med 0'}), 400
+        path_prefix = body.get('path_prefix', '/api/')
+        if not isinstance(path_prefix, str) or not path_prefix.startswith('/') or len(path_prefix) > 200:
+            return jsonify({'error': 'path_prefix måste börja med /'}), 400
+        minutes = body.get('minutes', 15)
+        if type(minutes) not in (int, float) or not 1 <= minutes <= PROFILE_MAX_MINUTES:
+            return jsonify({'error': f'minutes måste vara mellan 1 och {PROFILE_MAX_MINUTES}'}), 400
+
+        config = profiler.set_config(enabled, sample_rate, threshold_ms, path_prefix, minutes)
+        email = session.get('azure_user', {}).get('email')
+        logger.info('Profiling %s by %s: %s', 'enabled' if enabled else 'disabled', email, config)
+        return jsonify(config), 200
+    except Exception as e:
+        logger.error('Error updating profiling: %s', e)
+        return jsonify({'error': 'Kunde inte uppdatera profileringen'}), 500
+
+
+@app.route('/api/admin/profiling/<profile_id>')
+@require_auth
+@require_superadmin
+@rate_limit('download_profile')
+def download_profile(profile_id):
+    path = profiler.profile_path(profile_id)
+    if path is None:
+        return jsonify({'error': 'Profilen hittades inte'}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f'{profile_id}.folded')
+
+
 # Serve React App
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    # Om sökvägen pekar på en existerande fil i static-mappen (t.ex. manifest.json, logo.png)
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+    # Om sökvägen pekar på en fil i manifestet (t.ex. static/js/main.<hash>.js, logo.png)
+    asset = static_assets.get(path) if path else None
+    if asset is not None:
+        return static_assets.response(asset)
     
     # Om sökvägen börjar med 'api/', är det ett API-anrop som inte hittades
     if path.startswith('api/'):
@@ -799,7 +1094,13 @@ def serve(path):
         
     # För alla andra sökvägar (t.ex. /dashboard, /registration), servera React-appens huvudsida
     # React Router kommer sedan att hantera och visa rätt komponent
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_index()
+
+def serve_index():
+    index = static_assets.get('index.html')
+    if index is None:
+        return 'Frontend är inte byggd', 404
+    return static_assets.response(index)
 
 # Error handlers
 @app.errorhandler(429)
@@ -808,7 +1109,7 @@ def rate_limit_handler(e):
 
 @app.errorhandler(500)
 def internal_error_handler(e):
-    logger.error(f"Internal server error: {str(e)}")
+    logger.error('Internal server error: %s', e)
     return jsonify({'error': 'Ett serverfel uppstod'}), 500
 
 @app.errorhandler(404)
@@ -817,7 +1118,7 @@ def not_found_handler(e):
     if request.path.startswith('/api/'):
         return jsonify({'error': 'Endpoint hittades inte'}), 404
     # Annars returnera React-appen
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_index()
 
 if __name__ == '__main__':
     # ALDRIG debug=True i produktion!
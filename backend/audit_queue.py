@@ -0,0 +1,232 @@
+"""
+Asynkron skrivning av auditposter (besök och adminroller) från en bakgrundstråd
+"""
+import os
+import glob
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+try:
+    import fcntl
+except ImportError:  # Windows: ingen spoolfil
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Statuskoder från Cosmos som är värda att försöka igen
+RETRYABLE_STATUS = {408, 429, 449, 503}
+
+
+def _retry_after_seconds(exc: Exception, attempt: int) -> float:
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('x-ms-retry-after-ms')) / 1000.0
+    except (TypeError, ValueError):
+        return min(0.2 * (2 ** attempt), 5.0)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (ServiceRequestError, ServiceResponseError)):
+        return True
+    return isinstance(exc, CosmosHttpResponseError) and getattr(exc, 'status_code', None) in RETRYABLE_STATUS
+
+
+class AuditQueue:
+    """Kö med bakgrundstråd som skriver auditposter utanför request-tråden.
+
+    writer(kind, doc) skriver ett dokument synkront. Kön töms i grupper om
+    högst batch_size poster, men varje post skrivs för sig (auditposterna
+    hamnar i olika partitioner, så Cosmos transaktionella batch går inte att
+    använda).
+
+    Med spool_dir satt skrivs varje post först till en lokal fil per
+    process, så att poster som inte hunnit skrivas efter en krasch spelas
+    upp vid nästa start. Ägaren håller ett flock på sin fil så länge
+    processen lever; filer som går att låsa har alltså ingen levande ägare
+    och tas över.
+    """
+
+    def __init__(self, writer: Callable[[str, Dict], None], batch_size: int = 50,
+                 flush_interval: float = 1.0, max_attempts: int = 5,
+                 max_queue: int = 10000, spool_dir: Optional[str] = None):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.queue: 'queue.Queue[Tuple[str, Dict, int]]' = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.unflushed = 0
+        self.stopping = threading.Event()
+        self.spool_dir = spool_dir
+        self.spool_path = None
+        self.spool_file = None
+        if spool_dir and fcntl is None:
+            logger.warning('AUDIT_SPOOL_DIR requires fcntl – audit spool disabled')
+            spool_dir = self.spool_dir = None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            # Slumpdel i namnet: en återanvänd pid tar aldrig över en gammal fil
+            self.spool_path = os.path.join(spool_dir, f'audit-{os.getpid()}-{os.urandom(4).hex()}.spool')
+            self.spool_file = open(self.spool_path, 'a', encoding='utf-8')
+            fcntl.flock(self.spool_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        if spool_dir:
+            self._replay_spool()
+
+    def pending(self) -> int:
+        """Antal auditposter som ännu inte skrivits till Cosmos."""
+        return self.unflushed
+
+    def enqueue(self, kind: str, doc: Dict) -> None:
+        if self.stopping.is_set():
+            self._write_now(kind, doc)
+            return
+        with self.lock:
+            if self.spool_file:
+                self.spool_file.write(json.dumps({'kind': kind, 'doc': doc}, ensure_ascii=False) + '\n')
+                self.spool_file.flush()
+            self.unflushed += 1
+        try:
+            self.queue.put_nowait((kind, doc, 0))
+        except queue.Full:
+            # Mottryck: skriv direkt hellre än att tappa posten
+            logger.warning('Audit queue full – writing synchronously')
+            self._write_now(kind, doc)
+            self._mark_done(1)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Töm kön och stoppa bakgrundstråden (anropas vid graceful shutdown)."""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        self.thread.join(timeout)
+        if self.unflushed:
+            logger.warning('Audit queue closed with %d unwritten records', self.unflushed)
+        elif self.spool_file:
+            # Allt skrivet: filen behövs inte vid nästa start
+            with self.lock:
+                self.spool_file.close()
+                self.spool_file = None
+            try:
+                os.remove(self.spool_path)
+            except OSError:
+                pass
+
+    def _write_now(self, kind: str, doc: Dict) -> None:
+        try:
+            self.writer(kind, doc)
+        except Exception as e:
+            logger.error('Failed to write %s audit %s: %s', kind, doc.get('id'), e)
+
+    def _mark_done(self, count: int) -> None:
+        with self.lock:
+            self.unflushed -= count
+            if self.spool_file and self.unflushed == 0:
+                # Allt är skrivet – spoolfilen behövs inte längre
+                self.spool_file.seek(0)
+                self.spool_file.truncate()
+
+    def _drain(self, wait: bool) -> List[Tuple[str, Dict, int]]:
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval if wait else 0.01))
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            stopping = self.stopping.is_set()
+            batch = self._drain(wait=not stopping)
+            if not batch:
+                if stopping:
+                    return
+                continue
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[str, Dict, int]]) -> None:
+        done = 0
+        retry = []
+        delay = 0.0
+        for kind, doc, attempt in batch:
+            try:
+                self.writer(kind, doc)
+                done += 1
+            except Exception as e:
+                if _is_retryable(e) and attempt + 1 < self.max_attempts:
+                    retry.append((kind, doc, attempt + 1))
+                    delay = max(delay, _retry_after_seconds(e, attempt))
+                else:
+                    logger.error('Dropping %s audit %s after %d attempts: %s', kind, doc.get('id'), attempt + 1, e)
+                    done += 1
+        if done:
+            self._mark_done(done)
+        if retry:
+            # Throttling: vänta enligt Cosmos innan posterna läggs tillbaka
+            if not self.stopping.is_set():
+                time.sleep(delay)
+            for item in retry:
+                self.queue.put(item)
+
+    def _replay_spool(self) -> None:
+        """Spela upp poster från processer som avslutades innan kön tömdes."""
+        for path in glob.glob(os.path.join(self.spool_dir, 'audit-*.spool')):
+            if path == self.spool_path:
+                continue
+            try:
+                fh = open(path, encoding='utf-8')
+            except OSError:
+                continue
+            with fh:
+                try:
+                    # Låst av en levande worker (eller en annan som spelar upp den)
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                try:
+                    if os.stat(path).st_ino != os.fstat(fh.fileno()).st_ino:
+                        continue
+                except OSError:
+                    # Redan uppspelad och borttagen av en annan worker
+                    continue
+                replayed = 0
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    # Hamnar i den egna spoolfilen innan den gamla tas bort
+                    self.enqueue(record['kind'], record['doc'])
+                    replayed += 1
+                # Tas bort medan låset hålls, så att ingen annan spelar upp den igen
+                os.remove(path)
+            if replayed:
+                logger.info('Replayed %d audit records from %s', replayed, path)
+
+
+def audit_queue_from_env(writer: Callable[[str, Dict], None]) -> Optional[AuditQueue]:
+    """Skapa kön enligt miljövariabler, eller None för synkron skrivning."""
+    if os.getenv('AUDIT_ASYNC', '1').strip().lower() in ('0', 'false', 'no'):
+        return None
+    return AuditQueue(
+        writer,
+        batch_size=int(os.getenv('AUDIT_BATCH_SIZE', '50')),
+        flush_interval=float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0')),
+        max_attempts=int(os.getenv('AUDIT_MAX_ATTEMPTS', '5')),
+        spool_dir=(os.getenv('AUDIT_SPOOL_DIR') or '').strip() or None,
+    )
@@ -1,16 +1,59 @@
 import os
+import time
 import logging
 import base64
 import json
 from functools import wraps
-from flask import request, jsonify, session
+from flask import g, request, jsonify, session
+import hashlib
+import threading
 import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta, timezone
-from cosmos_service import CosmosService
+from concurrent.futures import Future, ThreadPoolExecutor
+from storage import get_storage_service
+from role_cache import RoleCache
+from jwks_validation import JwksKeyStore, verify_signature
+from server_timing import timed
+from log_setup import log_sampled
 
 logger = logging.getLogger(__name__)
 
+# last_login_at skrivs högst en gång per intervall (sekunder) om e-post/namn är oförändrade
+LOGIN_WRITE_GRANULARITY = int(os.getenv('LOGIN_WRITE_GRANULARITY', '900'))
+_login_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='login-bookkeeping')
+
+# Microsoft Graph: återanvänd TLS-anslutningar via en delad session.
+# GRAPH_ME_URL kan pekas mot en lokal HTTP-stand-in i tester.
+GRAPH_ME_URL = os.getenv('GRAPH_ME_URL', 'https://graph.microsoft.com/v1.0/me')
+GRAPH_TIMEOUT = float(os.getenv('GRAPH_TIMEOUT', '5'))
+_graph_session = requests.Session()
+_graph_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=int(os.getenv('GRAPH_POOL_SIZE', '20'))))
+_graph_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=int(os.getenv('GRAPH_POOL_SIZE', '20'))))
+
+# Audiences som godtas för Graph-accesstokens
+GRAPH_AUDIENCES = {'https://graph.microsoft.com', '00000003-0000-0000-c000-000000000000'}
+
+# 'graph' validerar via Graph /me, 'jwks' verifierar ID-token lokalt mot tenantens nycklar
+AUTH_VALIDATION_MODE = (os.getenv('AUTH_VALIDATION_MODE') or 'graph').strip().lower()
+_jwks_key_store = None
+# Eget lås: första hämtningen av nycklarna får inte blockera token-cachen
+_jwks_lock = threading.Lock()
+
+# Validerade tokens cachas (nyckel: sha256 av token) tills exp
+MAX_TOKEN_CACHE = 5000
+_token_cache = {}
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Adminroller cachas kort per oid; set_admin_role invaliderar direkt
+role_cache = RoleCache(
+    ttl=float(os.getenv('ROLE_CACHE_TTL', '30')),
+    marker_dir=(os.getenv('ROLE_CACHE_DIR') or '').strip() or None,
+    check_interval=float(os.getenv('ROLE_CACHE_CHECK_INTERVAL', '1.0'))
+)
+
 def _decode_claims(token: str) -> dict:
     """Decode JWT payload without verifying signature."""
     try:
@@ -44,28 +87,85 @@ def get_azure_config():
     
     return jsonify(config)
 
-def validate_azure_token(token):
-    """Validate Azure AD Graph token using claim inspection + Graph API."""
-    claims = _decode_claims(token)
-    if not claims:
-        logger.warning('Token saknar claims')
+def _token_cache_get(key):
+    entry = _token_cache.get(key)
+    if not entry:
+        return None
+    user_data, exp = entry
+    if time.time() >= exp:
+        _token_cache.pop(key, None)
         return None
+    return user_data
+
+
+def _token_cache_put(key, user_data, exp):
+    with _inflight_lock:
+        if len(_token_cache) >= MAX_TOKEN_CACHE:
+            now = time.time()
+            for k in [k for k, (_, e) in _token_cache.items() if e <= now]:
+                del _token_cache[k]
+            if len(_token_cache) >= MAX_TOKEN_CACHE:
+                _token_cache.clear()
+        _token_cache[key] = (user_data, exp)
+
+
+def validate_azure_token(token):
+    """Validate Azure AD Graph token, cached per token hash until exp.
+
+    Concurrent validations of the same token share one Graph call.
+    """
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    cached = _token_cache_get(key)
+    if cached:
+        return dict(cached)
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        try:
+            result = future.result(timeout=GRAPH_TIMEOUT + 1)
+        except Exception:
+            return None
+        return dict(result) if result else None
+
+    try:
+        result = _validate_azure_token_uncached(token)
+        if result:
+            try:
+                _token_cache_put(key, result, float(_decode_claims(token).get('exp')))
+            except (TypeError, ValueError):
+                pass
+        future.set_result(result)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return dict(result) if result else None
 
+
+def _check_claims(claims, allowed_aud):
+    """Gemensamma kontroller av exp, nbf, tid, aud och iss."""
     now = datetime.now(timezone.utc).timestamp()
     try:
         exp = float(claims.get('exp'))
         if now > exp:
             logger.warning('Token har utgått')
-            return None
+            return False
     except Exception:
         logger.warning('Token saknar exp-claim')
-        return None
+        return False
 
     try:
         nbf = float(claims.get('nbf', 0))
         if now < nbf:
             logger.warning('Token inte giltig ännu (nbf)')
-            return None
+            return False
     except Exception:
         pass
 
@@ -73,13 +173,12 @@ def validate_azure_token(token):
     token_tid = str(claims.get('tid') or '').strip().lower()
     if expected_tid and token_tid != expected_tid:
         logger.warning('Token tenant mismatch: expected %s got %s', expected_tid, token_tid)
-        return None
+        return False
 
     aud = str(claims.get('aud') or '').strip().rstrip('/').lower()
-    allowed_aud = {'https://graph.microsoft.com', '00000003-0000-0000-c000-000000000000'}
     if aud not in allowed_aud:
         logger.warning('Unexpected token audience: %s', claims.get('aud'))
-        return None
+        return False
 
     iss = str(claims.get('iss') or '')
     allowed_issuers = (
@@ -88,31 +187,53 @@ def validate_azure_token(token):
     )
     if not any(iss.lower().startswith(prefix) for prefix in allowed_issuers):
         logger.warning('Unexpected issuer: %s', iss)
-        return None
+        return False
     if expected_tid and expected_tid not in iss.lower():
         logger.warning('Issuer tenant mismatch: %s', iss)
-        return None
+        return False
+    return True
+
 
+def _fetch_graph_profile(token, token_oid):
+    """Hämta /me från Graph. Returnerar profil eller None."""
     try:
-        graph_response = requests.get(
-            'https://graph.microsoft.com/v1.0/me',
+        graph_response = _graph_session.get(
+            GRAPH_ME_URL,
             headers={'Authorization': f'Bearer {token}'},
-            timeout=5
+            timeout=GRAPH_TIMEOUT
         )
     except RequestException as exc:
-        logger.error(f"Graph API unreachable: {exc}")
+        logger.error('Graph API unreachable: %s', exc)
         return None
 
     if graph_response.status_code != 200:
-        logger.error(f"Graph API validation failed: {graph_response.status_code}")
+        logger.error('Graph API validation failed: %s', graph_response.status_code)
         return None
 
     user_data = graph_response.json()
-    token_oid = str(claims.get('oid') or '').strip().lower()
     graph_oid = str(user_data.get('id') or '').strip().lower()
     if token_oid and graph_oid and token_oid != graph_oid:
         logger.warning('OID mismatch mellan token och Graph: %s vs %s', token_oid, graph_oid)
         return None
+    return user_data
+
+
+def _validate_azure_token_uncached(token):
+    """Validate Azure AD Graph token using claim inspection + Graph API."""
+    claims = _decode_claims(token)
+    if not claims:
+        logger.warning('Token saknar claims')
+        return None
+    if not _check_claims(claims, GRAPH_AUDIENCES):
+        return None
+
+    token_oid = str(claims.get('oid') or '').strip().lower()
+    user_data = _fetch_graph_profile(token, token_oid)
+    if user_data is None:
+        return None
+    graph_oid = str(user_data.get('id') or '').strip().lower()
+    expected_tid = (os.getenv('AZURE_TENANT_ID') or '').strip().lower()
+    token_tid = str(claims.get('tid') or '').strip().lower()
 
     return {
         'name': user_data.get('displayName', ''),
@@ -124,6 +245,75 @@ def validate_azure_token(token):
         'tid': token_tid or expected_tid or 'unknown'
     }
 
+
+def _jwks_store():
+    global _jwks_key_store
+    if _jwks_key_store is None:
+        with _jwks_lock:
+            if _jwks_key_store is None:
+                tenant = (os.getenv('AZURE_TENANT_ID') or '').strip()
+                store = JwksKeyStore(
+                    jwks_url=os.getenv('AZURE_JWKS_URL') or f'https://login.microsoftonline.com/{tenant}/discovery/v2.0/keys',
+                    jwks_file=(os.getenv('AZURE_JWKS_FILE') or '').strip() or None,
+                    http_session=_graph_session,
+                    refresh_interval=float(os.getenv('AZURE_JWKS_REFRESH', '3600')),
+                )
+                store.start_background_refresh()
+                _jwks_key_store = store
+    return _jwks_key_store
+
+
+def validate_id_token(token, graph_token=None):
+    """Validate an Azure AD ID token locally against the tenant's cached signing keys.
+
+    Graph is only called to fill in a missing profile for a user that is not
+    yet stored in the users container.
+    """
+    claims = verify_signature(token, _jwks_store())
+    if not claims:
+        return None
+    client_id = (os.getenv('AZURE_CLIENT_ID') or '').strip().lower()
+    if not _check_claims(claims, {client_id, f'api://{client_id}'} if client_id else set()):
+        return None
+
+    expected_tid = (os.getenv('AZURE_TENANT_ID') or '').strip().lower()
+    token_oid = str(claims.get('oid') or '').strip().lower()
+    upn = claims.get('preferred_username') or claims.get('upn') or ''
+    user = {
+        'name': claims.get('name', ''),
+        'given_name': claims.get('given_name', ''),
+        'email': claims.get('email') or upn,
+        'preferred_username': upn,
+        'upn': upn,
+        'oid': token_oid or 'unknown',
+        'tid': str(claims.get('tid') or '').strip().lower() or expected_tid or 'unknown'
+    }
+    if user['email'] and user['name']:
+        return user
+
+    # Profilclaims saknas: använd sparad profil, annars Graph (första inloggningen)
+    try:
+        doc = get_storage_service().get_user(token_oid)
+    except Exception as e:
+        logger.error('Failed to read user profile: %s', e)
+        doc = None
+    if doc:
+        user['email'] = user['email'] or doc.get('email', '')
+        user['name'] = user['name'] or doc.get('display_name', '')
+    elif graph_token:
+        user_data = _fetch_graph_profile(graph_token, token_oid)
+        if user_data:
+            user['name'] = user['name'] or user_data.get('displayName', '')
+            user['given_name'] = user['given_name'] or user_data.get('givenName', '')
+            user['email'] = user['email'] or user_data.get('mail') or user_data.get('userPrincipalName', '')
+    return user
+
+def _record_login(oid, email, display_name):
+    try:
+        get_storage_service().upsert_user(oid, email, display_name, min_interval_seconds=LOGIN_WRITE_GRANULARITY)
+    except Exception as e:
+        logger.error('Failed to upsert user in Cosmos DB: %s', e)
+
 def get_azure_user():
     """Hämtar användarinfo från Azure AD token"""
     auth_header = request.headers.get('Authorization')
@@ -133,8 +323,18 @@ def get_azure_user():
     token = auth_header.split(' ')[1]
     
     try:
-        # Validera token med Microsoft Graph API
-        user_data = validate_azure_token(token)
+        if AUTH_VALIDATION_MODE == 'jwks':
+            # Verifiera ID-token lokalt; Bearer-token (Graph) används bara för profilkomplettering
+            id_token = request.headers.get('X-Id-Token')
+            if id_token:
+                user_data = validate_id_token(id_token, graph_token=token)
+            else:
+                # Bearer är en Graph-token (fel audience för lokal validering): validera via Graph
+                logger.warning('X-Id-Token missing in jwks mode – validating the Bearer token via Graph')
+                user_data = validate_azure_token(token)
+        else:
+            # Validera token med Microsoft Graph API
+            user_data = validate_azure_token(token)
         if not user_data:
             return jsonify({'error': 'Invalid token'}), 401
         
@@ -153,79 +353,127 @@ def get_azure_user():
         session.modified = True
         session.permanent = False
 
-        # Upsert user into Cosmos DB users container
-        try:
-            cs = CosmosService()
-            cs.upsert_user(user_info.get('oid'), user_info.get('email'), user_info.get('full_name') or user_info.get('name'))
-        except Exception as e:
-            logger.error(f"Failed to upsert user in Cosmos DB: {e}")
+        # Upsert user into Cosmos DB users container (utanför request-tråden)
+        _login_executor.submit(
+            _record_login, user_info.get('oid'), user_info.get('email'),
+            user_info.get('full_name') or user_info.get('name')
+        )
 
-        logger.info(f"User logged in: OID={user_info['oid']}")
+        log_sampled(logger, 'login', 'User logged in: OID=%s', user_info['oid'])
         return jsonify(user_info)
         
     except Exception as e:
-        logger.error(f"Error fetching user info: {str(e)}")
+        logger.error('Error fetching user info: %s', e)
         return jsonify({'error': 'Failed to fetch user info'}), 500
 
 def require_auth(f):
     """Decorator som kräver autentisering med förbättrad säkerhet"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Kontrollera session
-        if 'azure_user' not in session:
-            logger.warning(f"Authentication failed for {request.path}. No user in session.")
-            return jsonify({'error': 'Authentication required'}), 401
-            
-        # Kontrollera session timeout (2 timmar)
-        if 'login_time' in session:
-            login_time = session['login_time']
-            if isinstance(login_time, str):
-                login_time = datetime.fromisoformat(login_time)
-            
-            if (datetime.now() - login_time).total_seconds() > 7200:
-                session.clear()
-                logger.warning(f"Session expired for user: {session.get('azure_user', {}).get('email', 'unknown')}")
-                return jsonify({'error': 'Session expired'}), 401
-        
-        # Logga utan känslig data
-        user_oid = session.get('azure_user', {}).get('oid', 'unknown')
-        logger.info(f"Auth successful for user OID: {user_oid} on endpoint: {request.path}")
-        
+        with timed('auth'):
+            error = _check_session()
+        if error is not None:
+            return error
         return f(*args, **kwargs)
     return decorated_function
 
 
+def _check_session():
+    """None om sessionen är giltig, annars ett 401-svar."""
+    # Kontrollera session
+    if 'azure_user' not in session:
+        logger.warning('Authentication failed for %s. No user in session.', request.path)
+        return jsonify({'error': 'Authentication required'}), 401
+
+    # Kontrollera session timeout (2 timmar)
+    if 'login_time' in session:
+        login_time = session['login_time']
+        if isinstance(login_time, str):
+            login_time = datetime.fromisoformat(login_time)
+
+        if (datetime.now() - login_time).total_seconds() > 7200:
+            session.clear()
+            logger.warning('Session expired for user: %s', session.get('azure_user', {}).get('email', 'unknown'))
+            return jsonify({'error': 'Session expired'}), 401
+
+    # Logga utan känslig data
+    user_oid = session.get('azure_user', {}).get('oid', 'unknown')
+    log_sampled(logger, 'auth', 'Auth successful for user OID: %s on endpoint: %s', user_oid, request.path)
+    return None
+
+
 def require_superadmin(f):
     """Decorator that allows only SUPERADMIN_EMAIL."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        azure_user = session.get('azure_user') or {}
-        superadmin_email = (os.getenv('SUPERADMIN_EMAIL') or '').strip().lower()
-        user_email = (azure_user.get('email') or '').strip().lower()
-        if not superadmin_email or user_email != superadmin_email:
-            logger.warning(f"Superadmin required for {request.path}. user_email={user_email}")
+        with timed('auth'):
+            azure_user = session.get('azure_user') or {}
+            superadmin_email = (os.getenv('SUPERADMIN_EMAIL') or '').strip().lower()
+            user_email = (azure_user.get('email') or '').strip().lower()
+            allowed = bool(superadmin_email) and user_email == superadmin_email
+        if not allowed:
+            logger.warning('Superadmin required for %s. user_email=%s', request.path, user_email)
             return jsonify({'error': 'Forbidden'}), 403
+        g.is_admin = True
         return f(*args, **kwargs)
     return decorated
 
 
+def is_admin_user(oid):
+    """Adminflagga för oid, från rollcachen eller Cosmos."""
+    if not oid:
+        return False
+    cached = role_cache.get(oid)
+    if cached is not None:
+        return cached
+    fetched_at = time.time()
+    u = get_storage_service().get_user(oid)
+    is_admin = bool(u and isinstance(u.get('roles'), dict) and u['roles'].get('admin'))
+    role_cache.put(oid, is_admin, fetched_at=fetched_at)
+    return is_admin
+
+
 def require_admin(f):
     """Decorator that allows SUPERADMIN or users/{oid}.roles.admin == true."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        azure_user = session.get('azure_user') or {}
-        user_email = (azure_user.get('email') or '').strip().lower()
-        superadmin_email = (os.getenv('SUPERADMIN_EMAIL') or '').strip().lower()
-        if superadmin_email and user_email == superadmin_email:
+        with timed('auth'):
+            allowed = is_admin_session()
+        if allowed:
             return f(*args, **kwargs)
-        # Check Cosmos role
-        try:
-            cs = CosmosService()
-            u = cs.get_user(azure_user.get('oid'))
-            if u and isinstance(u.get('roles'), dict) and bool(u['roles'].get('admin')):
-                return f(*args, **kwargs)
-        except Exception as e:
-            logger.error(f"Error checking admin role: {e}")
-        logger.warning(f"Admin required for {request.path}. OID={azure_user.get('oid')} email={user_email}")
+        azure_user = session.get('azure_user') or {}
+        logger.warning('Admin required for %s. OID=%s email=%s', request.path, azure_user.get('oid'), azure_user.get('email'))
         return jsonify({'error': 'Forbidden'}), 403
     return decorated
+
+
+def is_admin_session():
+    """Om inloggad användare är superadmin eller admin (rollen cachas).
+
+    Svaret sparas på g, så att t.ex. Server-Timing återanvänder det som
+    require_admin redan räknat ut.
+    """
+    if 'azure_user' not in session:
+        return False
+    if 'is_admin' not in g:
+        g.is_admin = _resolve_admin_session()
+    return g.is_admin
+
+
+def admin_decided():
+    """True om requesten redan bedömts som admin (require_admin/is_admin_session), utan uppslag."""
+    return g.get('is_admin', False)
+
+
+def _resolve_admin_session():
+    azure_user = session.get('azure_user') or {}
+    user_email = (azure_user.get('email') or '').strip().lower()
+    superadmin_email = (os.getenv('SUPERADMIN_EMAIL') or '').strip().lower()
+    if superadmin_email and user_email == superadmin_email:
+        return True
+    # Check role (cached)
+    try:
+        return is_admin_user(azure_user.get('oid'))
+    except Exception as e:
+        logger.error('Error checking admin role: %s', e)
+        return False
@@ -0,0 +1,272 @@
+"""
+Benchmark av API:ets heta vägar mot en CosmosService i minnet.
+
+Kör appen i processen (Flask test client, en klient per tråd) mot
+InMemoryCosmosService med injicerad latens och en Graph-stand-in för
+inloggningen. Mäter req/s och latenspercentiler per endpoint och
+datamängd, sparar resultatet som JSON och jämför med en baseline.
+
+    python bench/bench_api.py                           # 1k och 100k besök
+    python bench/bench_api.py --sizes 1000,100000,1000000
+    python bench/bench_api.py --update-baseline         # skriv ny baseline
+
+Returnerar 1 om något endpoint blivit sämre än --threshold mot baseline.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import platform
+import threading
+from datetime import date, datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline_api.json')
+ENDPOINTS = ('login', 'register_visit', 'statistics', 'my_visits')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall, errors):
+    latencies = sorted(latencies)
+    ms = [v * 1000 for v in latencies]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'mean_ms': round(sum(ms) / len(ms), 2) if ms else 0.0,
+        'p50_ms': round(percentile(ms, 50), 2),
+        'p95_ms': round(percentile(ms, 95), 2),
+        'p99_ms': round(percentile(ms, 99), 2),
+    }
+
+
+def make_app(args):
+    """Importera appen mot stand-in-tjänsterna (en gång per process)."""
+    from graph_standin import GraphStandin, TENANT_ID
+
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ['FLASK_ENV'] = 'development'
+    os.environ['AZURE_TENANT_ID'] = TENANT_ID
+    os.environ['AUTH_VALIDATION_MODE'] = 'graph'
+    os.environ['GRAPH_ME_URL'] = GraphStandin(latency_ms=args.graph_latency_ms).start()
+    # Loggar formateras som i drift men skrivs inte till terminalen
+    logging.basicConfig(level=args.log_level, stream=open(os.devnull, 'w'))
+
+    import cosmos_service
+    from cosmos_standin import InMemoryCosmosService, Latency
+    service = InMemoryCosmosService(Latency(args.latency_ms, args.jitter_ms, args.seed), page_size=args.page_size)
+    cosmos_service._shared_service = service
+
+    import security
+    import app as app_module
+
+    class UnlimitedRateLimiter(type(security.rate_limiter)):
+        # Räknar som vanligt (kostnaden ingår i mätningen) men nekar aldrig
+        def is_allowed(self, *a, **kw):
+            super().is_allowed(*a, **kw)
+            return True
+
+    security.rate_limiter = UnlimitedRateLimiter()
+    return app_module.app, service
+
+
+class Scenario:
+    """Ett endpoint: request(client, user, i) returnerar statuskoden."""
+
+    def __init__(self, name, request, login=True):
+        self.name = name
+        self.request = request
+        self.login = login
+
+
+def scenarios(dataset):
+    from graph_standin import make_token
+    homes = dataset['homes']
+    month_from = dataset['dates'][29]
+    month_to = dataset['dates'][0]
+
+    def login(client, user, i):
+        token = make_token(user['oid'], nonce=uuid.uuid4().hex)
+        return client.post('/api/azure-user', headers={'Authorization': f'Bearer {token}'}).status_code
+
+    def register_visit(client, user, i):
+        home = homes[i % len(homes)]
+        return client.post('/api/visits', json={
+            'home_id': home['id'], 'department_id': home['departments'][i % len(home['departments'])]['id'],
+            'date': month_to, 'visit_type': 'group', 'offer_status': 'accepted',
+            'activity_name': 'Promenad', 'companion_name': 'Personal', 'duration_minutes': 30,
+            'gender_counts': {'men': 1, 'women': 2},
+            'satisfaction_entries': [{'gender': 'women', 'rating': 5}],
+        }).status_code
+
+    def statistics(client, user, i):
+        home = homes[i % len(homes)]
+        return client.get(f"/api/statistics?home={home['id']}&from={month_from}&to={month_to}").status_code
+
+    def my_visits(client, user, i):
+        return client.get('/api/my-visits').status_code
+
+    return {
+        'login': Scenario('login', login, login=False),
+        'register_visit': Scenario('register_visit', register_visit),
+        'statistics': Scenario('statistics', statistics),
+        'my_visits': Scenario('my_visits', my_visits),
+    }
+
+
+def run_scenario(app, scenario, users, requests, concurrency, warmup):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests + warmup))
+
+    def worker(slot):
+        user = users[slot % len(users)]
+        client = app.test_client()
+        if scenario.login:
+            with client.session_transaction() as sess:
+                sess['azure_user'] = {'email': user['email'], 'oid': user['oid'], 'name': user['name']}
+                sess['login_time'] = datetime.now().isoformat()
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            status = scenario.request(client, user, i)
+            elapsed = time.perf_counter() - start
+            if not 200 <= status < 300:
+                with lock:
+                    errors[0] += 1
+            elif i >= warmup:
+                local.append(elapsed)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    # Väggtiden inkluderar uppvärmningen; räkna om till den uppmätta andelen
+    wall *= requests / (requests + warmup)
+    return summarize(latencies, wall, errors[0])
+
+
+def compare(results, baseline, threshold, min_ms):
+    """Jämför med baseline. Returnerar lista med regressioner (text)."""
+    regressions = []
+    for size, endpoints in results['results'].items():
+        for name, current in endpoints.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if not base:
+                continue
+            if base['rps'] and current['rps'] < base['rps'] * (1 - threshold):
+                regressions.append(f"{size} {name}: {current['rps']} req/s (baseline {base['rps']})")
+            for key in ('p50_ms', 'p95_ms'):
+                if current[key] > base[key] * (1 + threshold) and current[key] - base[key] > min_ms:
+                    regressions.append(f"{size} {name}: {key} {current[key]} ms (baseline {base[key]})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,100000', help='Antal besök, kommaseparerat')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=400, help='Mätta anrop per endpoint')
+    parser.add_argument('--warmup', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Cosmos-latens per rundresa')
+    parser.add_argument('--jitter-ms', type=float, default=2.0)
+    parser.add_argument('--graph-latency-ms', type=float, default=50.0)
+    parser.add_argument('--page-size', type=int, default=100, help='Dokument per Cosmos-sida')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results', 'api.json'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25, help='Tillåten försämring (andel)')
+    parser.add_argument('--min-ms', type=float, default=2.0, help='Ignorera latensskillnader under detta')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    from cosmos_standin import seed_dataset
+
+    app, service = make_app(args)
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    selected = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+
+    results = {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'graph_latency_ms': args.graph_latency_ms,
+            'page_size': args.page_size, 'concurrency': args.concurrency, 'requests': args.requests,
+            'users': args.users, 'seed': args.seed,
+        },
+        'results': {},
+    }
+    print(f"{'besök':>8} {'endpoint':<16} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'fel':>4}")
+    for size in sizes:
+        service.clear()
+        start = time.perf_counter()
+        dataset = seed_dataset(service, size, users=args.users, seed=args.seed, today=date.today())
+        print(f'# {size} besök seedade på {time.perf_counter() - start:.1f} s')
+        available = scenarios(dataset)
+        results['results'][str(size)] = {}
+        for name in selected:
+            stats = run_scenario(app, available[name], dataset['users'], args.requests,
+                                 args.concurrency, args.warmup)
+            results['results'][str(size)][name] = stats
+            print(f"{size:>8} {name:<16} {stats['rps']:>8.1f} {stats['p50_ms']:>8.2f} "
+                  f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['errors']:>4}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as fh:
+        json.dump(results, fh, indent=2, ensure_ascii=False)
+    print(f'Resultat: {args.output}')
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2, ensure_ascii=False)
+        print(f'Baseline uppdaterad: {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('Ingen baseline att jämföra med (kör med --update-baseline)')
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as fh:
+        baseline = json.load(fh)
+    for key in ('latency_ms', 'jitter_ms', 'graph_latency_ms', 'page_size', 'concurrency'):
+        if baseline.get('meta', {}).get(key) != results['meta'][key]:
+            print(f"Obs: {key} skiljer sig från baseline ({baseline['meta'].get(key)} mot {results['meta'][key]})")
+    regressions = compare(results, baseline, args.threshold, args.min_ms)
+    errors = sum(s['errors'] for endpoints in results['results'].values() for s in endpoints.values())
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if errors:
+        print(f'{errors} anrop misslyckades')
+    if regressions or errors:
+        return 1
+    print(f'Inga regressioner mot baseline (tröskel {args.threshold:.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
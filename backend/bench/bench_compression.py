@@ -0,0 +1,66 @@
+"""
+Jämför komprimeringsnivåer för typiska API-svar (lista med besöksdokument).
+
+Skriver storlek och CPU-tid per nivå för gzip och brotli, som underlag för
+COMPRESSION_GZIP_LEVEL och COMPRESSION_BROTLI_QUALITY.
+
+    python bench/bench_compression.py --visits 2000
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import brotli  # noqa: E402
+
+
+def sample_visits(count):
+    activities = ['Promenad i parken', 'Fika på altanen', 'Trädgårdsarbete', 'Utflykt till sjön']
+    return [
+        {
+            'id': f'{i:08x}-5c1e-4f6a-9d3b-{i * 7919:012x}', 'home_id': f'boende_{i % 12}',
+            'department_id': f'boende_{i % 12}__avd_{i % 3}', 'date': f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+            'visit_type': 'group' if i % 3 else 'individual', 'offer_status': 'accepted',
+            'activity': activities[i % len(activities)], 'activity_id': f'act_{i % len(activities)}',
+            'companion': 'Personal', 'companion_id': 'personal', 'duration_minutes': 15 + i % 90,
+            'gender_counts': {'men': i % 4, 'women': i % 6}, 'total_participants': i % 4 + i % 6,
+            'satisfaction_entries': [{'gender': 'women', 'rating': 4}, {'gender': 'men', 'rating': 5}],
+            'created_by_email': f'personal{i % 40}@skovde.se', 'registered_at': '2024-05-01T08:00:00',
+        }
+        for i in range(count)
+    ]
+
+
+def measure(fn, data, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(data)
+        best = min(best, time.perf_counter() - start)
+    return len(out), best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--visits', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = json.dumps(sample_visits(args.visits), ensure_ascii=False).encode('utf-8')
+    print(f'{len(data)} byte JSON ({args.visits} besök)')
+    print(f'{"kodning":<12} {"byte":>10} {"kvot":>6} {"ms":>8}')
+    for level in (1, 5, 6, 9):
+        size, ms = measure(lambda d: zlib.compress(d, level), data, args.repeat)
+        print(f'{"gzip " + str(level):<12} {size:>10} {len(data) / size:>6.1f} {ms:>8.1f}')
+    if brotli is not None:
+        for quality in (1, 4, 5, 6, 9, 11):
+            size, ms = measure(lambda d: brotli.compress(d, quality=quality), data, args.repeat)
+            print(f'{"brotli " + str(quality):<12} {size:>10} {len(data) / size:>6.1f} {ms:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
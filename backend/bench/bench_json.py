@@ -0,0 +1,59 @@
+"""
+Jämför JSON-providers (std och orjson) på realistiska besökslistor.
+
+Mäter kodning (jsonify-vägen) och avkodning (request.get_json-vägen).
+
+    python bench/bench_json.py --visits 5000
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from json_provider import JSON_PROVIDERS, orjson  # noqa: E402
+from bench_compression import sample_visits  # noqa: E402
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--visits', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    visits = sample_visits(args.visits)
+    for v in visits[::2]:
+        # Som direkt efter register_visit: datetime-objekt och svenska tecken
+        v['registered_at'] = datetime(2024, 5, 1, 8, 15, 30, 123456)
+        v['activity'] = 'Fika på ängen med Åsa'
+    print(f'{args.visits} besök')
+    print(f'{"provider":<8} {"koda MB/s":>10} {"avkoda MB/s":>12} {"byte":>10}')
+    for name, provider_class in JSON_PROVIDERS.items():
+        if name == 'orjson' and orjson is None:
+            print(f'{name:<8} (inte installerat)')
+            continue
+        app = Flask(__name__)
+        app.json = provider_class(app)
+        with app.app_context():
+            body = app.json.response(visits).get_data()
+            encode = best_of(lambda: app.json.response(visits).get_data(), args.repeat)
+            decode = best_of(lambda: app.json.loads(body), args.repeat)
+        mb = len(body) / 1e6
+        print(f'{name:<8} {mb / encode:>10.0f} {mb / decode:>12.0f} {len(body):>10}')
+
+
+if __name__ == '__main__':
+    main()
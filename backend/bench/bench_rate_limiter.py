@@ -0,0 +1,91 @@
+"""
+Mikrobenchmark för rate limitern: overhead per request vid hög samtidighet.
+
+Jämför den gamla deque-baserade limitern (simple_rate_limiter) med
+sliding window-limitern i security.py, och med --shared även de delade
+lagringarna (delat minne och Redis via lokal stand-in).
+
+    python bench/bench_rate_limiter.py --threads 16 --keys 1 --ops 200000
+    python bench/bench_rate_limiter.py --shared --ops 20000
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from security import SlidingWindowRateLimiter  # noqa: E402
+from rate_limit_stores import SharedMemoryRateLimiter, RedisRateLimiter  # noqa: E402
+from resp_standin import RespStandin  # noqa: E402
+from simple_rate_limiter import SimpleRateLimiter as DequeRateLimiter  # noqa: E402
+
+
+def run(limiter, threads, keys, ops, max_requests, window):
+    per_thread = ops // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(n):
+        key_names = [f'10.0.{(n + i) % 256}.{i % 256}' for i in range(keys)]
+        barrier.wait()
+        for i in range(per_thread):
+            limiter.is_allowed(key_names[i % keys], max_requests, window)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return elapsed / (per_thread * threads) * 1e9
+
+
+def memory(factory, keys, max_requests, window):
+    tracemalloc.start()
+    limiter = factory()
+    for i in range(max_requests):
+        limiter.is_allowed(f'key-{i % keys}', max_requests, window)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--keys', type=int, default=1, help='antal klient-IP:n (1 = alla bakom samma NAT)')
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--max-requests', type=int, default=1000000)
+    parser.add_argument('--window', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5, help='bästa av N körningar')
+    parser.add_argument('--shared', action='store_true', help='mät även delat minne och Redis (stand-in)')
+    parser.add_argument('--redis-url', help='riktig Redis i stället för lokal stand-in')
+    args = parser.parse_args()
+
+    limiters = {
+        'deque (gammal)': DequeRateLimiter,
+        'sliding window': SlidingWindowRateLimiter,
+    }
+    if args.shared:
+        shm_path = os.path.join(tempfile.gettempdir(), f'bench_rate_limit_{os.getpid()}')
+        redis_url = args.redis_url or RespStandin().start()
+        limiters['delat minne'] = lambda: SharedMemoryRateLimiter(path=shm_path)
+        limiters['redis'] = lambda: RedisRateLimiter(redis_url, fallback=SlidingWindowRateLimiter(), timeout=1.0)
+    print(f'threads={args.threads} keys={args.keys} ops={args.ops} max_requests={args.max_requests}')
+    print(f'{"limiter":<16} {"ns/request":>12} {"minne (byte)":>14}')
+    for name, factory in limiters.items():
+        ns = min(
+            run(factory(), args.threads, args.keys, args.ops, args.max_requests, args.window)
+            for _ in range(args.repeat)
+        )
+        mem = memory(factory, args.keys, min(args.ops, args.max_requests), args.window)
+        print(f'{name:<16} {ns:>12.0f} {mem:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Jämför validering av besök: den tidigare validate_attendance_data
+(referenskopia i legacy_validation.py) mot VisitValidator
+(visit_validation.py), som också normaliserar dokumentet.
+
+    python bench/bench_validation.py --visits 20000
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from legacy_validation import validate_attendance_data  # noqa: E402
+from visit_validation import VisitValidator  # noqa: E402
+
+HOME = {
+    'id': 'boende-1',
+    'departments': [{'id': f'boende-1__avd_{i}', 'name': f'Avdelning {i}', 'active': i != 7} for i in range(12)],
+}
+
+
+def sample_rows(count):
+    activities = ['Promenad i parken', 'Fika på altanen', 'Trädgårdsarbete', 'Utflykt till sjön']
+    rows = []
+    for i in range(count):
+        declined = i % 10 == 0
+        individual = i % 3 == 0
+        men, women = (1, 0) if individual else (i % 4, i % 6 + 1)
+        rows.append({
+            'home_id': 'boende-1', 'department_id': f'boende-1__avd_{i % 12}',
+            'date': f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+            'visit_type': 'individual' if individual else 'group',
+            'offer_status': 'declined' if declined else 'accepted',
+            'activity_name': activities[i % len(activities)], 'activity_id': f'act_{i % len(activities)}',
+            'companion_name': 'Personal', 'companion_id': 'personal', 'duration_minutes': 15 + i % 90,
+            'gender_counts': {'men': men, 'women': women},
+            'satisfaction_entries': [{'gender': 'men' if men else 'women', 'rating': i % 6 + 1}],
+        })
+    return rows
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--visits', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = sample_rows(args.visits)
+
+    def old():
+        for row in rows:
+            validate_attendance_data(row, HOME)
+
+    def new():
+        validator = VisitValidator(HOME)
+        for row in rows:
+            validator.validate(row)
+
+    print(f'{args.visits} besök ({sum(1 for r in rows if r["department_id"].endswith("_7"))} på inaktiv avdelning)')
+    print(f'{"väg":<28} {"rader/s":>10}')
+    for name, fn in (('validate_attendance_data', old), ('VisitValidator', new)):
+        seconds = best_of(fn, args.repeat)
+        print(f'{name:<28} {args.visits / seconds:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
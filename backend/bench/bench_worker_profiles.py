@@ -0,0 +1,114 @@
+"""
+Lasttest som jämför gunicorn-profilerna i gunicorn.conf.py.
+
+Startar gunicorn med varje profil mot stand-in-appen i worker_app.py och
+kör samtidiga klienter med keep-alive mot /io (väntar som ett Cosmos-anrop)
+och /cpu (JSON-serialisering). Skriver req/s och latens per profil.
+
+    python bench/bench_worker_profiles.py --clients 32 --duration 10
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/io')
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def load(port, path, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise OSError(response.status)
+                local.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float('nan')
+
+    return len(latencies) / duration, pct(0.5), pct(0.95), pct(0.99), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--profiles', default='sync,gthread,gevent')
+    parser.add_argument('--workers', type=int, default=2, help='samma antal workers för alla profiler')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--io-ms', type=float, default=20.0, help='simulerad Cosmos-latens')
+    args = parser.parse_args()
+
+    print(f'workers={args.workers} clients={args.clients} duration={args.duration}s io={args.io_ms}ms')
+    print(f'{"profil":<9} {"endpoint":<6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"fel":>5}')
+    for profile in args.profiles.split(','):
+        port = free_port()
+        env = dict(os.environ, GUNICORN_PROFILE=profile, GUNICORN_WORKERS=str(args.workers),
+                   PORT=str(port), BENCH_IO_MS=str(args.io_ms), GUNICORN_LOG_LEVEL='warning')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+             '--chdir', BENCH_DIR, 'worker_app:app'],
+            env=env,
+        )
+        try:
+            if not wait_for(port):
+                print(f'{profile:<9} startade inte')
+                continue
+            for path in ('/io', '/cpu'):
+                rps, p50, p95, p99, errors = load(port, path, args.clients, args.duration)
+                print(f'{profile:<9} {path:<6} {rps:>8.0f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>5}')
+        finally:
+            server.terminate()
+            server.wait(30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""
+Deterministisk CosmosService i minnet för benchmarks och lasttester.
+
+InMemoryCosmosService ärver CosmosService och byter bara ut containrarna,
+så all fråge- och affärslogik i cosmos_service.py körs som i produktion.
+Containrarna förstår den SQL-delmängd som tjänsten skickar (SELECT [TOP n],
+WHERE c.fält =/>=/<= @param AND ...) och väntar en konfigurerbar latens per
+rundresa, med en rundresa per sida om page_size dokument som i Cosmos.
+
+    from cosmos_standin import InMemoryCosmosService, Latency
+    import cosmos_service
+    cosmos_service._shared_service = InMemoryCosmosService(Latency(5, jitter_ms=2))
+    import app  # använder stand-in via get_cosmos_service()
+"""
+import os
+import re
+import sys
+import time
+import random
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError  # noqa: E402
+
+from cosmos_service import CosmosService  # noqa: E402
+from server_timing import record  # noqa: E402
+
+# Cosmos standardstorlek på en frågesida (x-ms-max-item-count)
+DEFAULT_PAGE_SIZE = 100
+
+_SELECT = re.compile(r'^SELECT\s+(?:TOP\s+(\d+)\s+)?(.+?)\s+FROM\s+c(?:\s+WHERE\s+(.+))?$', re.IGNORECASE)
+_CONDITION = re.compile(r'^c\.(\w+)\s*(=|>=|<=)\s*(@\w+|true|false)$', re.IGNORECASE)
+
+
+class Latency:
+    """Väntetid per rundresa: ms plus jämnt fördelad jitter, seedad."""
+
+    def __init__(self, ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.ms = ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        delay = self.ms
+        if self.jitter_ms:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+def _copy(doc: Dict) -> Dict:
+    # Cosmos lämnar ut nya objekt vid varje läsning; en nivå djupt räcker för tjänsten
+    return {k: (v.copy() if isinstance(v, (dict, list)) else v) for k, v in doc.items()}
+
+
+def _compile(query: str):
+    match = _SELECT.match(' '.join(query.split()))
+    if not match:
+        raise ValueError(f'Query not supported by the stand-in: {query}')
+    top, projection, where = match.groups()
+    fields = None
+    if projection.strip() != '*':
+        fields = [p.strip()[2:] for p in projection.split(',')]
+    conditions = []
+    for part in re.split(r'\s+AND\s+', where or '', flags=re.IGNORECASE) if where else []:
+        cond = _CONDITION.match(part.strip())
+        if not cond:
+            raise ValueError(f'Condition not supported by the stand-in: {part}')
+        conditions.append(cond.groups())
+    return int(top) if top else None, fields, conditions
+
+
+class InMemoryContainer:
+    """Container i minnet med partitioner, valfria index och latens."""
+
+    def __init__(self, partition_path: str, latency: Latency, page_size: int = DEFAULT_PAGE_SIZE,
+                 indexes: Iterable[str] = ()):
+        self.partition_key = partition_path.lstrip('/')
+        self.latency = latency
+        self.page_size = page_size
+        # partition -> id -> dokument
+        self.partitions: Dict[str, Dict[str, Dict]] = {}
+        # fält -> värde -> {(partition, id)}
+        self.indexes: Dict[str, Dict[object, set]] = {field: {} for field in indexes}
+        self.lock = threading.RLock()
+        self._queries: Dict[str, tuple] = {}
+        self.round_trips = 0
+
+    # ---- Lagring utan latens (för seedning) ----
+    def load(self, docs: Iterable[Dict]) -> int:
+        count = 0
+        with self.lock:
+            for doc in docs:
+                self._store(doc)
+                count += 1
+        return count
+
+    def clear(self) -> None:
+        with self.lock:
+            self.partitions.clear()
+            for index in self.indexes.values():
+                index.clear()
+
+    def __len__(self) -> int:
+        return sum(len(p) for p in self.partitions.values())
+
+    def _store(self, doc: Dict) -> None:
+        pk = doc.get(self.partition_key)
+        old = self.partitions.get(pk, {}).get(doc['id'])
+        if old is not None:
+            self._unindex(pk, old)
+        self.partitions.setdefault(pk, {})[doc['id']] = doc
+        for field, index in self.indexes.items():
+            if field in doc:
+                index.setdefault(doc[field], set()).add((pk, doc['id']))
+
+    def _unindex(self, pk, doc: Dict) -> None:
+        for field, index in self.indexes.items():
+            entries = index.get(doc.get(field))
+            if entries is not None:
+                entries.discard((pk, doc['id']))
+
+    def _round_trip(self) -> None:
+        self.round_trips += 1
+        start = time.perf_counter()
+        self.latency.wait()
+        # Motsvarar raw_response_hook i CosmosService: rundresan syns i Server-Timing
+        record('cosmos', time.perf_counter() - start)
+
+    def _get(self, item: str, partition_key) -> Dict:
+        doc = self.partitions.get(partition_key, {}).get(item)
+        if doc is None:
+            raise CosmosResourceNotFoundError(status_code=404, message='Resource Not Found')
+        return doc
+
+    # ---- Samma anrop som azure.cosmos ContainerProxy ----
+    def read_item(self, item: str, partition_key, **kwargs) -> Dict:
+        self._round_trip()
+        with self.lock:
+            return _copy(self._get(item, partition_key))
+
+    def create_item(self, body: Dict, **kwargs) -> Dict:
+        self._round_trip()
+        with self.lock:
+            if body['id'] in self.partitions.get(body.get(self.partition_key), {}):
+                raise CosmosHttpResponseError(status_code=409, message='Conflict')
+            self._store(_copy(body))
+        return _copy(body)
+
+    def upsert_item(self, body: Dict, **kwargs) -> Dict:
+        self._round_trip()
+        with self.lock:
+            self._store(_copy(body))
+        return _copy(body)
+
+    def patch_item(self, item: str, partition_key, patch_operations: List[Dict], **kwargs) -> Dict:
+        self._round_trip()
+        with self.lock:
+            doc = _copy(self._get(item, partition_key))
+            for op in patch_operations:
+                if op['op'] not in ('set', 'add', 'replace'):
+                    raise ValueError(f"Patch operation not supported by the stand-in: {op['op']}")
+                doc[op['path'].lstrip('/')] = op.get('value')
+            self._store(doc)
+            return _copy(doc)
+
+    def delete_item(self, item: str, partition_key, **kwargs) -> None:
+        self._round_trip()
+        with self.lock:
+            doc = self._get(item, partition_key)
+            self._unindex(partition_key, doc)
+            del self.partitions[partition_key][item]
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs) -> List[Dict]:
+        self._round_trip()
+        with self.lock:
+            docs = [args[0] for _, args, *_ in batch_operations]
+            existing = self.partitions.get(partition_key, {})
+            if any(d['id'] in existing for d in docs):
+                # Transaktionell batch: allt eller inget
+                raise CosmosHttpResponseError(status_code=409, message='Conflict')
+            for doc in docs:
+                self._store(_copy(doc))
+        return [{'statusCode': 201} for _ in docs]
+
+    def read_all_items(self, max_item_count: Optional[int] = None, **kwargs) -> Iterator[Dict]:
+        with self.lock:
+            docs = [d for p in self.partitions.values() for d in p.values()]
+        return self._pages(docs, None, max_item_count)
+
+    def query_items(self, query: str, parameters: Optional[List[Dict]] = None,
+                    max_item_count: Optional[int] = None, **kwargs) -> Iterator[Dict]:
+        compiled = self._queries.get(query)
+        if compiled is None:
+            compiled = self._queries[query] = _compile(query)
+        top, fields, conditions = compiled
+        params = {p['name']: p['value'] for p in parameters or []}
+        resolved = []
+        for field, op, value in conditions:
+            if value.startswith('@'):
+                value = params[value]
+            else:
+                value = value.lower() == 'true'
+            resolved.append((field, op, value))
+
+        with self.lock:
+            docs = self._candidates(resolved)
+            matches = [d for d in docs if all(_match(d, f, op, v) for f, op, v in resolved)]
+        if top is not None:
+            matches = matches[:top]
+        return self._pages(matches, fields, max_item_count)
+
+    def _candidates(self, conditions) -> List[Dict]:
+        # Partitionsnyckel först, sedan index, annars hela containern
+        for field, op, value in conditions:
+            if op == '=' and field == self.partition_key:
+                return list(self.partitions.get(value, {}).values())
+        for field, op, value in conditions:
+            if op == '=' and field in self.indexes:
+                return [self.partitions[pk][doc_id] for pk, doc_id in self.indexes[field].get(value, ())]
+        return [d for p in self.partitions.values() for d in p.values()]
+
+    def _pages(self, docs: List[Dict], fields, max_item_count: Optional[int]) -> Iterator[Dict]:
+        page_size = max_item_count or self.page_size
+        for start in range(0, max(len(docs), 1), page_size):
+            self._round_trip()
+            for doc in docs[start:start + page_size]:
+                yield {f: doc.get(f) for f in fields} if fields else _copy(doc)
+
+
+def _match(doc: Dict, field: str, op: str, value) -> bool:
+    actual = doc.get(field)
+    if op == '=':
+        return actual == value
+    if actual is None:
+        return False
+    return actual >= value if op == '>=' else actual <= value
+
+
+class InMemoryCosmosService(CosmosService):
+    """CosmosService mot containrar i minnet. Data finns kvar vid connect()."""
+
+    def __init__(self, latency: Optional[Latency] = None, page_size: int = DEFAULT_PAGE_SIZE):
+        self.latency = latency or Latency()
+        self.page_size = page_size
+        self.containers: Dict[str, InMemoryContainer] = {}
+        super().__init__()
+
+    def connect(self, ensure: bool = True) -> None:
+        def container(name, partition_path, indexes=()):
+            if name not in self.containers:
+                self.containers[name] = InMemoryContainer(partition_path, self.latency, self.page_size, indexes)
+            return self.containers[name]
+
+        self.c_visits = container('outdoor_visits', '/home_id', ('id', 'registered_by_oid', 'registered_by'))
+        self.c_act = container('activities', '/id', ('name',))
+        self.c_homes = container('homes', '/id')
+        self.c_comp = container('companions', '/id')
+        self.c_users = container('users_sabo', '/id')
+        self.c_admin_audit = container('admin_audit_sabo', '/id')
+        self.c_visit_audit = container('visit_audit_sabo', '/id')
+
+    def clear(self) -> None:
+        for container in self.containers.values():
+            container.clear()
+        self._login_seen.clear()
+
+    def round_trips(self) -> int:
+        return sum(c.round_trips for c in self.containers.values())
+
+
+# ---- Seedad testdata ----
+ACTIVITIES = ['Promenad', 'Fika ute', 'Trädgårdsarbete', 'Utflykt', 'Grillning', 'Boule']
+COMPANIONS = ['Personal', 'Anhörig', 'Volontär', 'Aktivitetsledare']
+
+
+def bench_user(index: int) -> Dict:
+    return {'oid': f'bench-user-{index:04d}', 'email': f'personal{index:04d}@skovde.se', 'name': f'Personal {index}'}
+
+
+def seed_dataset(service: InMemoryCosmosService, visits: int, homes: int = 12, departments: int = 4,
+                 users: int = 200, days: int = 365, seed: int = 1, today: Optional[date] = None) -> Dict:
+    """Fyll service med äldreboenden, aktiviteter och visits besök.
+
+    Besöken fördelas jämnt över homes, users och de senaste days dagarna
+    (till och med today) och blir identiska för samma seed.
+    """
+    rnd = random.Random(seed)
+    today = today or date.today()
+    dates = [(today - timedelta(days=d)).isoformat() for d in range(days)]
+    times = [f'T{h:02d}:{m:02d}:00' for h in range(7, 21) for m in range(0, 60, 5)]
+
+    home_docs = []
+    for h in range(homes):
+        home_id = f'boende-{h:02d}'
+        home_docs.append({
+            'id': home_id, 'name': f'Äldreboende {h:02d}', 'active': True,
+            'departments': [
+                {'id': f'{home_id}__avd-{d}', 'name': f'Avdelning {d}', 'active': True} for d in range(departments)
+            ],
+        })
+    service.c_homes.load(home_docs)
+    service.c_act.load(
+        {'id': name.lower().replace(' ', '-').replace('ä', 'a').replace('å', 'a'), 'name': name,
+         'active': True, 'category': 'allman', 'sort_order': i + 1}
+        for i, name in enumerate(ACTIVITIES)
+    )
+    service.c_comp.load(
+        {'id': name.lower(), 'name': name, 'active': True} for name in COMPANIONS
+    )
+    user_list = [bench_user(u) for u in range(users)]
+    service.c_users.load(
+        {'id': u['oid'], 'email': u['email'], 'display_name': u['name'], 'roles': {'admin': False}}
+        for u in user_list
+    )
+
+    def generate():
+        for i in range(visits):
+            home = home_docs[i % homes]
+            user = user_list[rnd.randrange(users)]
+            day = dates[rnd.randrange(days)]
+            declined = rnd.random() < 0.1
+            individual = rnd.random() < 0.3
+            men = 1 if individual and rnd.random() < 0.4 else (0 if individual else rnd.randrange(4))
+            women = (1 - men) if individual else rnd.randrange(1, 6)
+            activity = ACTIVITIES[rnd.randrange(len(ACTIVITIES))]
+            companion = COMPANIONS[rnd.randrange(len(COMPANIONS))]
+            registered_at = day + times[rnd.randrange(len(times))]
+            yield {
+                'id': f'{seed:04x}{i:012x}-0000-4000-8000-000000000000',
+                'home_id': home['id'],
+                'department_id': home['departments'][rnd.randrange(departments)]['id'],
+                'date': day,
+                'visit_type': 'individual' if individual else 'group',
+                'offer_status': 'declined' if declined else 'accepted',
+                'activity': '' if declined else activity, 'activity_name': '' if declined else activity,
+                'activity_id': '', 'companion': '' if declined else companion,
+                'companion_name': '' if declined else companion, 'companion_id': '',
+                'duration_minutes': None if declined else rnd.choice((15, 30, 45, 60, 90)),
+                'gender_counts': {'men': men, 'women': women},
+                'total_participants': men + women,
+                'satisfaction_entries': [] if declined else [{'gender': 'women', 'rating': rnd.randrange(1, 7)}],
+                'registered_by': user['email'], 'registered_by_oid': user['oid'],
+                'registered_at': registered_at, 'last_modified_at': registered_at, 'edit_count': 0,
+            }
+
+    service.c_visits.load(generate())
+    return {'homes': home_docs, 'users': user_list, 'dates': dates}
@@ -0,0 +1,99 @@
+"""
+Minimal Microsoft Graph /me för lokala benchmarks av inloggningen.
+
+Svarar med en profil för oid i tokenens claims efter en konfigurerbar
+fördröjning. Peka appen hit med GRAPH_ME_URL. Inte avsedd för produktion.
+
+    python bench/graph_standin.py --port 8765 --latency-ms 50
+    GRAPH_ME_URL=http://127.0.0.1:8765/v1.0/me flask run
+"""
+import json
+import time
+import base64
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TENANT_ID = 'bench-tenant'
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def make_token(oid: str, tenant_id: str = TENANT_ID, lifetime: int = 3600, nonce: str = '') -> str:
+    """Osignerad Graph-liknande token; nonce ger en ny token (och cachemiss) per anrop."""
+    now = time.time()
+    claims = {
+        'oid': oid, 'tid': tenant_id, 'aud': 'https://graph.microsoft.com',
+        'iss': f'https://sts.windows.net/{tenant_id}/', 'nbf': now - 60, 'exp': now + lifetime,
+    }
+    if nonce:
+        claims['uti'] = nonce
+    return f"{_b64({'alg': 'none', 'typ': 'JWT'})}.{_b64(claims)}.sig"
+
+
+def _claims(token: str) -> dict:
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError):
+        return {}
+
+
+class GraphStandin:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0):
+        latency = latency_ms / 1000
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                token = (self.headers.get('Authorization') or '')[len('Bearer '):]
+                oid = _claims(token).get('oid')
+                if latency:
+                    time.sleep(latency)
+                if not oid:
+                    self.send_response(401)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = json.dumps({
+                    'id': oid, 'displayName': f'Personal {oid}', 'givenName': 'Personal',
+                    'mail': f'{oid}@skovde.se', 'userPrincipalName': f'{oid}@skovde.se',
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1.0/me'
+
+    def start(self) -> str:
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    args = parser.parse_args()
+    standin = GraphStandin(args.host, args.port, args.latency_ms)
+    print(standin.url)
+    standin.server.serve_forever()
@@ -0,0 +1,175 @@
+"""
+Referenskopia av den tidigare valideringen av besök (validate_attendance_data
+med hjälpfunktioner) från security.py, oförändrad.
+
+Appen validerar med visit_validation.validate_visit och
+security.validate_attendance_data är numera en tunn wrapper runt den.
+Kopian finns bara för jämförelsen i bench_validation.py.
+"""
+import os
+import re
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from security import (  # noqa: E402
+    ALLOWED_GENDERS, ALLOWED_OFFER_STATUS, ALLOWED_VISIT_TYPES,
+    MAX_DURATION_MINUTES, MAX_PARTICIPANTS_PER_ENTRY, MIN_DURATION_MINUTES,
+)
+
+
+def validate_home_id(home_id):
+    """Validera äldreboende-ID."""
+    if not home_id or not isinstance(home_id, str):
+        return False, "Äldreboende-ID saknas"
+    if not re.match(r'^[a-z0-9-]{1,50}$', home_id):
+        return False, "Ogiltigt format för äldreboende-ID"
+    return True, None
+
+def validate_date(date_str):
+    """Validera datumformat"""
+    if not date_str:
+        return False, "Datum saknas"
+    
+    try:
+        datetime.strptime(date_str, '%Y-%m-%d')
+        return True, None
+    except ValueError:
+        return False, "Ogiltigt datumformat (använd YYYY-MM-DD)"
+
+def validate_visit_type(visit_type):
+    if visit_type not in ALLOWED_VISIT_TYPES:
+        return False, f"Ogiltig typ. Måste vara en av: {', '.join(sorted(ALLOWED_VISIT_TYPES))}"
+    return True, None
+
+
+def validate_offer_status(status):
+    if status not in ALLOWED_OFFER_STATUS:
+        return False, f"Ogiltigt svar. Måste vara en av: {', '.join(sorted(ALLOWED_OFFER_STATUS))}"
+    return True, None
+
+
+def validate_name(value, field='fältet', max_length=100):
+    if not value or not isinstance(value, str):
+        return False, f"{field} saknas"
+    value = value.strip()
+    if not value:
+        return False, f"{field} får inte vara tomt"
+    if len(value) > max_length:
+        return False, f"{field} får högst innehålla {max_length} tecken"
+    if not re.match(r'^[a-zA-ZåäöÅÄÖ0-9\s\-\_]+$', value):
+        return False, f"{field} innehåller ogiltiga tecken"
+    return True, None
+
+
+def validate_gender_counts(gender_counts, visit_type, offer_status=None):
+    if not isinstance(gender_counts, dict):
+        return False, "Deltagarantal måste vara ett objekt"
+    total = 0
+    for gender in ALLOWED_GENDERS:
+        value = gender_counts.get(gender, 0)
+        if not isinstance(value, int) or value < 0 or value > MAX_PARTICIPANTS_PER_ENTRY:
+            return False, f"Ogiltigt värde för {gender} (0-{MAX_PARTICIPANTS_PER_ENTRY})"
+        total += value
+    # Tillåt 0 deltagare om besöket avböjdes
+    if offer_status != 'declined' and total <= 0:
+        return False, "Minst en deltagare måste anges"
+    if visit_type == 'individual' and offer_status != 'declined' and total != 1:
+        return False, "Enskild registrering måste avse exakt en person"
+    return True, None
+
+
+def validate_duration_minutes(value):
+    if value is None:
+        return False, "Varaktighet i minuter krävs"
+    if not isinstance(value, int):
+        return False, "Varaktighet måste anges i heltal"
+    if value < MIN_DURATION_MINUTES or value > MAX_DURATION_MINUTES:
+        return False, f"Varaktighet måste vara mellan {MIN_DURATION_MINUTES}-{MAX_DURATION_MINUTES} minuter"
+    return True, None
+
+
+def validate_satisfaction_entries(entries, total_participants):
+    if entries is None:
+        return True, None
+    if not isinstance(entries, list):
+        return False, "Nöjdhet måste vara en lista"
+    if len(entries) > total_participants:
+        return False, "Antalet nöjdhetsnoteringar får inte överstiga antalet deltagare"
+    for entry in entries:
+        if not isinstance(entry, dict):
+            return False, "Nöjdhetsposter måste vara objekt"
+        gender = entry.get('gender')
+        rating = entry.get('rating')
+        if gender not in ALLOWED_GENDERS:
+            return False, "Nöjdhet måste kopplas till man eller kvinna"
+        if not isinstance(rating, int) or rating < 1 or rating > 6:
+            return False, "Nöjdhet måste vara ett heltal mellan 1-6"
+    return True, None
+
+
+def validate_department(home_doc, department_id, existing_department_id=None):
+    if not department_id or not isinstance(department_id, str):
+        if existing_department_id and department_id == existing_department_id:
+            # Allow legacy department to pass through even if missing now
+            return True, None
+        return False, "Avdelning måste anges"
+    departments = (home_doc or {}).get('departments') or []
+    for dept in departments:
+        if dept.get('id') == department_id:
+            if dept.get('active', True):
+                return True, None
+            break
+    if existing_department_id and department_id == existing_department_id:
+        # Allow edits to legacy/removed departments
+        return True, None
+    return False, "Ogiltig avdelning"
+
+def validate_attendance_data(data, home_doc=None, existing_department_id=None):
+    """Validera utevistelse-data."""
+    errors = []
+
+    valid, error = validate_home_id(data.get('home_id'))
+    if not valid:
+        errors.append(error)
+
+    valid, error = validate_department(home_doc, data.get('department_id'), existing_department_id=existing_department_id)
+    if not valid:
+        errors.append(error)
+
+    valid, error = validate_date(data.get('date'))
+    if not valid:
+        errors.append(error)
+
+    valid, error = validate_visit_type(data.get('visit_type'))
+    if not valid:
+        errors.append(error)
+
+    valid, error = validate_offer_status(data.get('offer_status'))
+    if not valid:
+        errors.append(error)
+
+    valid_gc, gc_error = validate_gender_counts(data.get('gender_counts', {}), data.get('visit_type'), data.get('offer_status'))
+    if not valid_gc:
+        errors.append(gc_error)
+    total = 0
+    if valid_gc:
+        total = sum(int(data.get('gender_counts', {}).get(g, 0)) for g in ALLOWED_GENDERS)
+
+    if data.get('offer_status') == 'accepted':
+        valid, error = validate_name(data.get('activity_name'), field='Aktivitet')
+        if not valid:
+            errors.append(error)
+        valid, error = validate_name(data.get('companion_name'), field='Med vem')
+        if not valid:
+            errors.append(error)
+        valid, error = validate_duration_minutes(data.get('duration_minutes'))
+        if not valid:
+            errors.append(error)
+
+    valid, error = validate_satisfaction_entries(data.get('satisfaction_entries'), total)
+    if not valid:
+        errors.append(error)
+
+    return len(errors) == 0, errors
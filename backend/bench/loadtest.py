@@ -0,0 +1,356 @@
+"""
+Lasttest med användarresor mot appen under gunicorn (se loadtest_scenarios.py).
+
+Startar en Graph-stand-in och gunicorn med loadtest_app (Cosmos i minnet
+med latens) för varje antal workers, kör scenariot med virtuella
+användare (trådar med egen session) och rapporterar per endpoint req/s,
+latenspercentiler, fel- och 429-andel samt hur mättade workerna var. Ett
+svep över flera workerantal används för att dimensionera repliker:
+
+    python bench/loadtest.py                                  # shift_change, 2 workers
+    python bench/loadtest.py --workers 1,2,4 --time-scale 0.1
+    python bench/loadtest.py --scenario steady --profile gevent --output bench/results/steady.json
+
+Med --time-scale 0.1 körs scenariot tio gånger snabbare (tänketider,
+ramp och längd), vilket ger samma anropsmönster med tio gånger högre last.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import date
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_api import percentile  # noqa: E402
+from cosmos_standin import bench_user  # noqa: E402
+from graph_standin import GraphStandin, TENANT_ID  # noqa: E402
+from loadtest_scenarios import JOURNEYS, SCENARIOS  # noqa: E402
+from visit_dataset import DEFAULT_TODAY  # noqa: E402
+
+
+class Recorder:
+    """Samlar latens och status per endpoint och resultat per resa."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(list)
+        self.journeys = defaultdict(list)
+        self.started = defaultdict(int)
+
+    def call(self, label, elapsed, status):
+        with self.lock:
+            self.calls[label].append((elapsed, status))
+
+    def start(self, name):
+        with self.lock:
+            self.started[name] += 1
+
+    def journey(self, name, elapsed):
+        with self.lock:
+            self.journeys[name].append(elapsed)
+
+
+class VirtualUser:
+    def __init__(self, base_url, user, rng, recorder, time_scale, stop_at, ip, timeout, today):
+        self.base_url = base_url
+        self.user = user
+        self.rng = rng
+        self.recorder = recorder
+        self.time_scale = time_scale
+        self.stop_at = stop_at
+        self.timeout = timeout
+        # Datumen i resorna räknas från datats sista dag, inte från klockan
+        self.today = today
+        self.session = requests.Session()
+        # Ett IP per användare, om inte alla sitter bakom samma NAT (--shared-ip)
+        self.session.headers['X-Forwarded-For'] = ip
+
+    def request(self, label, method, path, **kwargs):
+        """Returnerar svaret, eller None vid nätverksfel/timeout (räknas som fel)."""
+        if time.monotonic() >= self.stop_at:
+            return None
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            self.recorder.call(label, time.perf_counter() - start, 0)
+            return None
+        self.recorder.call(label, time.perf_counter() - start, response.status_code)
+        return response
+
+    def think(self, low, high):
+        """Pausa en slumpad tänketid. Returnerar False om scenariot tagit slut."""
+        pause = self.rng.uniform(low, high) * self.time_scale
+        remaining = self.stop_at - time.monotonic()
+        if pause >= remaining:
+            time.sleep(max(0.0, remaining))
+            return False
+        time.sleep(pause)
+        return True
+
+
+def run_scenario(base_url, scenario, args):
+    """Kör scenariot och returnerar (recorder, uppmätt tid i sekunder)."""
+    recorder = Recorder()
+    scale = args.time_scale
+    duration = scenario['duration'] * scale
+    ramp = scenario['ramp'] * scale
+    users = args.users or scenario['users']
+    names = list(scenario['journeys'])
+    weights = [scenario['journeys'][n] for n in names]
+    start = time.monotonic()
+    stop_at = start + duration
+
+    def run_user(index):
+        rng = random.Random(args.seed * 100003 + index)
+        time.sleep(ramp * index / users + rng.uniform(0, ramp / users if users else 0))
+        ip = '10.0.0.1' if args.shared_ip else f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}'
+        vu = VirtualUser(base_url, bench_user(index), rng, recorder, scale, stop_at, ip, args.timeout,
+                         date.fromisoformat(args.today))
+        name = rng.choices(names, weights)[0]
+        while time.monotonic() < stop_at:
+            recorder.start(name)
+            journey_start = time.perf_counter()
+            JOURNEYS[name](vu)
+            if time.monotonic() < stop_at:
+                recorder.journey(name, time.perf_counter() - journey_start)
+            if not scenario['repeat'] or not vu.think(60, 180):
+                break
+            name = rng.choices(names, weights)[0]
+
+    threads = [threading.Thread(target=run_user, args=(i,), daemon=True) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=max(0.0, stop_at - time.monotonic()) + args.timeout + 5)
+    return recorder, time.monotonic() - start
+
+
+def summarize_calls(calls, wall):
+    latencies = sorted(elapsed * 1000 for elapsed, _ in calls)
+    count = len(calls)
+    # 429 redovisas separat; övriga 4xx är oväntade i resorna och räknas som fel
+    throttled = sum(1 for _, status in calls if status == 429)
+    errors = sum(1 for _, status in calls if status == 0 or status >= 400) - throttled
+    return {
+        'requests': count,
+        'rps': round(count / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'error_pct': round(100 * errors / count, 2) if count else 0.0,
+        'throttled_pct': round(100 * throttled / count, 2) if count else 0.0,
+    }
+
+
+def read_worker_stats(stats_dir):
+    stats = {}
+    for name in os.listdir(stats_dir):
+        if name.startswith('worker-') and name.endswith('.json'):
+            try:
+                with open(os.path.join(stats_dir, name)) as fh:
+                    doc = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            stats[doc['pid']] = doc
+    return stats
+
+
+def summarize_workers(before, after):
+    """Belastning per worker under mätningen (skillnad mellan två avläsningar)."""
+    workers = []
+    for pid, end in sorted(after.items()):
+        begin = before.get(pid, {})
+        elapsed = end['time'] - begin.get('time', end['time'] - end['samples'] * 0.05)
+        samples = end['samples'] - begin.get('samples', 0)
+        workers.append({
+            'pid': pid,
+            'slots': end['slots'],
+            'requests': end['requests'] - begin.get('requests', 0),
+            'cpu_pct': round(100 * (end['cpu_seconds'] - begin.get('cpu_seconds', 0)) / elapsed, 1) if elapsed > 0 else 0.0,
+            'avg_busy_slots': round((end['in_flight_sum'] - begin.get('in_flight_sum', 0)) / samples, 2) if samples else 0.0,
+            'saturated_pct': round(100 * (end['saturated_samples'] - begin.get('saturated_samples', 0)) / samples, 1)
+            if samples else 0.0,
+            'peak_in_flight': end['peak_in_flight'],
+        })
+    return workers
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workers, graph_url, stats_dir):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'GUNICORN_PROFILE': args.profile,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'GUNICORN_LOG_LEVEL': 'warning',
+        # Samma nyckel i alla workers, annars gäller sessionen bara i en av dem
+        'SECRET_KEY': 'loadtest',
+        'FLASK_ENV': 'development',
+        'AZURE_TENANT_ID': TENANT_ID,
+        'AUTH_VALIDATION_MODE': 'graph',
+        'GRAPH_ME_URL': graph_url,
+        'STORAGE_BACKEND': 'cosmos',
+        'LOADTEST_VISITS': str(args.visits),
+        'LOADTEST_USERS': str(max(args.users or 0, 200)),
+        'LOADTEST_SEED': str(args.seed),
+        'LOADTEST_TODAY': args.today,
+        'LOADTEST_LEGACY': str(args.legacy),
+        'LOADTEST_COSMOS_LATENCY_MS': str(args.latency_ms),
+        'LOADTEST_COSMOS_JITTER_MS': str(args.jitter_ms),
+        'LOADTEST_STATS_DIR': stats_dir,
+    })
+    log = open(os.path.join(stats_dir, 'server.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+         '--chdir', BACKEND_DIR, '--pythonpath', BENCH_DIR, 'loadtest_app:app'],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(base_url + '/health', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'gunicorn startade inte, se {log.name}')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def warm_up(base_url, workers):
+    # Varje worker startar sin mätning vid första anropet efter fork
+    for _ in range(workers * 4):
+        try:
+            requests.get(base_url + '/health', timeout=5)
+        except requests.RequestException:
+            pass
+    time.sleep(1.0)
+
+
+def run_once(args, scenario, workers, graph_url):
+    stats_dir = tempfile.mkdtemp(prefix='sabo-loadtest-')
+    process, base_url = start_server(args, workers, graph_url, stats_dir)
+    try:
+        warm_up(base_url, workers)
+        before = read_worker_stats(stats_dir)
+        recorder, wall = run_scenario(base_url, scenario, args)
+        time.sleep(1.0)
+        after = read_worker_stats(stats_dir)
+    finally:
+        stop_server(process)
+
+    endpoints = {label: summarize_calls(calls, wall) for label, calls in sorted(recorder.calls.items())}
+    every_call = [c for calls in recorder.calls.values() for c in calls]
+    journeys = {
+        name: {'started': started, 'completed': len(recorder.journeys[name]),
+               'mean_s': round(sum(recorder.journeys[name]) / len(recorder.journeys[name]), 1)
+               if recorder.journeys[name] else 0.0}
+        for name, started in sorted(recorder.started.items())
+    }
+    return {
+        'workers': workers,
+        'wall_s': round(wall, 1),
+        'total': summarize_calls(every_call, wall),
+        'endpoints': endpoints,
+        'journeys': journeys,
+        'worker_stats': summarize_workers(before, after),
+        'server_log': os.path.join(stats_dir, 'server.log'),
+    }
+
+
+def print_result(result):
+    print(f"\n== {result['workers']} worker(s), {result['wall_s']} s ==")
+    print(f"{'endpoint':<16}{'antal':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'fel %':>7}{'429 %':>7}")
+    rows = list(result['endpoints'].items()) + [('TOTALT', result['total'])]
+    for label, s in rows:
+        print(f"{label:<16}{s['requests']:>7}{s['rps']:>8}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}"
+              f"{s['error_pct']:>7}{s['throttled_pct']:>7}")
+    for name, j in result['journeys'].items():
+        print(f"  resa {name}: {j['started']} startade, {j['completed']} klara, medel {j['mean_s']} s")
+    for w in result['worker_stats']:
+        print(f"  worker {w['pid']}: {w['requests']} anrop, CPU {w['cpu_pct']} %, "
+              f"{w['avg_busy_slots']}/{w['slots']} upptagna i snitt, mättad {w['saturated_pct']} %, "
+              f"max {w['peak_in_flight']} samtidiga")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenario', default='shift_change', choices=sorted(SCENARIOS))
+    parser.add_argument('--workers', default='2', help='Antal gunicorn-workers, kommaseparerat för svep')
+    parser.add_argument('--profile', default='gthread', choices=('gthread', 'gevent', 'sync'))
+    parser.add_argument('--threads', type=int, default=8, help='Trådar per worker (gthread)')
+    parser.add_argument('--users', type=int, default=0, help='Virtuella användare (standard: scenariots)')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Skalar tänketider, ramp och längd')
+    parser.add_argument('--shared-ip', action='store_true', help='Alla användare bakom samma IP (NAT)')
+    parser.add_argument('--visits', type=int, default=20000, help='Besök i datat (visit_dataset.py)')
+    parser.add_argument('--legacy', type=float, default=0.0, help='Andel äldre poster i datat')
+    parser.add_argument('--latency-ms', type=float, default=8.0, help='Cosmos-latens per rundresa')
+    parser.add_argument('--jitter-ms', type=float, default=4.0)
+    parser.add_argument('--graph-latency-ms', type=float, default=80.0)
+    parser.add_argument('--timeout', type=float, default=30.0, help='Klientens timeout per anrop')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--today', default=DEFAULT_TODAY.isoformat(), help='Sista dagen i datat, ÅÅÅÅ-MM-DD')
+    parser.add_argument('--output', help='Spara resultatet som JSON')
+    args = parser.parse_args()
+
+    scenario = SCENARIOS[args.scenario]
+    print(f"{args.scenario}: {scenario['description']}")
+    graph = GraphStandin(latency_ms=args.graph_latency_ms)
+    graph_url = graph.start()
+    results = []
+    try:
+        for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+            result = run_once(args, scenario, workers, graph_url)
+            print_result(result)
+            results.append(result)
+    finally:
+        graph.stop()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'scenario': args.scenario,
+                'config': {k: v for k, v in vars(args).items() if k != 'output'},
+                'machine': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+                'results': results,
+            }, fh, indent=2)
+        print(f'\nSparat: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Appen med stubbad Cosmos för lasttester (loadtest.py), körs av gunicorn:
+
+    gunicorn -c gunicorn.conf.py --pythonpath bench loadtest_app:app
+
+Datat genereras i mastern (preload) med VisitDataset från LOADTEST_VISITS,
+LOADTEST_SEED, LOADTEST_TODAY (sista dagen, ÅÅÅÅ-MM-DD) och LOADTEST_LEGACY
+(andel äldre poster) och Cosmos-latensen styrs av LOADTEST_COSMOS_LATENCY_MS/_JITTER_MS. Varje worker
+har en egen kopia av datat efter fork. Med LOADTEST_STATS_DIR skriver varje
+worker sin belastning (pågående anrop, upptagen tid, CPU) till
+worker-<pid>.json två gånger per sekund.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from datetime import date
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from werkzeug.wsgi import ClosingIterator  # noqa: E402
+
+import cosmos_service  # noqa: E402
+from cosmos_standin import InMemoryCosmosService, Latency  # noqa: E402
+from visit_dataset import DEFAULT_TODAY, VisitDataset, load_standin  # noqa: E402
+
+service = InMemoryCosmosService(Latency(
+    float(os.getenv('LOADTEST_COSMOS_LATENCY_MS', '8')),
+    float(os.getenv('LOADTEST_COSMOS_JITTER_MS', '4')),
+    int(os.getenv('LOADTEST_SEED', '1')),
+))
+load_standin(service, VisitDataset(seed=int(os.getenv('LOADTEST_SEED', '1')), users=int(os.getenv('LOADTEST_USERS', '200')),
+                                    legacy=float(os.getenv('LOADTEST_LEGACY', '0')),
+                                    today=date.fromisoformat(os.getenv('LOADTEST_TODAY', DEFAULT_TODAY.isoformat()))),
+             int(os.getenv('LOADTEST_VISITS', '20000')))
+cosmos_service._shared_service = service
+
+from app import app  # noqa: E402
+
+
+class WorkerStats:
+    """WSGI-mellanlager som mäter hur upptagen workern är."""
+
+    SAMPLE_INTERVAL = 0.05
+    WRITE_INTERVAL = 0.5
+
+    def __init__(self, wsgi_app, stats_dir, slots):
+        self.wsgi_app = wsgi_app
+        self.stats_dir = stats_dir
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.pid = None
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+        self.busy = 0.0
+        self.samples = 0
+        self.in_flight_sum = 0
+        self.saturated = 0
+
+    def _start(self):
+        # Första anropet efter fork: nollställ och starta sampling i den här processen
+        self.pid = os.getpid()
+        threading.Thread(target=self._sample, daemon=True).start()
+
+    def _sample(self):
+        path = os.path.join(self.stats_dir, f'worker-{self.pid}.json')
+        next_write = 0.0
+        while True:
+            time.sleep(self.SAMPLE_INTERVAL)
+            with self.lock:
+                self.samples += 1
+                self.in_flight_sum += self.in_flight
+                self.saturated += self.in_flight >= self.slots
+                snapshot = {
+                    'pid': self.pid, 'slots': self.slots, 'requests': self.requests,
+                    'busy_seconds': self.busy, 'in_flight': self.in_flight, 'peak_in_flight': self.peak,
+                    'samples': self.samples, 'in_flight_sum': self.in_flight_sum,
+                    'saturated_samples': self.saturated, 'cpu_seconds': time.process_time(),
+                    'time': time.time(),
+                }
+            if time.monotonic() >= next_write:
+                next_write = time.monotonic() + self.WRITE_INTERVAL
+                tmp = f'{path}.tmp'
+                with open(tmp, 'w') as fh:
+                    json.dump(snapshot, fh)
+                os.replace(tmp, path)
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._start()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        start = time.perf_counter()
+
+        def done():
+            with self.lock:
+                self.in_flight -= 1
+                self.requests += 1
+                self.busy += time.perf_counter() - start
+
+        try:
+            return ClosingIterator(self.wsgi_app(environ, start_response), [done])
+        except BaseException:
+            done()
+            raise
+
+
+if os.getenv('LOADTEST_STATS_DIR'):
+    os.makedirs(os.environ['LOADTEST_STATS_DIR'], exist_ok=True)
+    # Samtidiga anrop en worker klarar: trådar (gthread), greenlets (gevent) eller ett (sync)
+    profile = os.getenv('GUNICORN_PROFILE', 'gthread')
+    slots = {
+        'gthread': int(os.getenv('GUNICORN_THREADS', '8')),
+        'gevent': int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200')),
+    }.get(profile, 1)
+    app.wsgi_app = WorkerStats(app.wsgi_app, os.environ['LOADTEST_STATS_DIR'], slots)
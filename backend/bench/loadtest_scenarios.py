@@ -0,0 +1,145 @@
+"""
+Användarresor och scenarier för loadtest.py.
+
+En resa är en funktion som kör anrop via en VirtualUser (vu.request,
+vu.think). Ett scenario anger hur många virtuella användare som kommer in
+under ramp-tiden och hur de fördelas på resorna (vikter). Tider är i
+sekunder och skalas med --time-scale.
+"""
+import uuid
+from datetime import timedelta
+
+from cosmos_standin import ACTIVITIES, COMPANIONS
+from graph_standin import make_token
+
+SCENARIOS = {
+    'shift_change': {
+        'description': 'Skiftbyte: personalen loggar in och registrerar inom några minuter '
+                       'medan chefer har dashboards öppna',
+        'duration': 300,
+        'ramp': 180,
+        'users': 60,
+        'repeat': False,
+        'journeys': {'staff_registration': 0.75, 'staff_correction': 0.1, 'manager_dashboard': 0.15},
+    },
+    'steady': {
+        'description': 'Vanlig dag: färre användare som återkommer med längre pauser',
+        'duration': 300,
+        'ramp': 60,
+        'users': 20,
+        'repeat': True,
+        'journeys': {'staff_registration': 0.7, 'staff_correction': 0.1, 'manager_dashboard': 0.2},
+    },
+}
+
+
+def login(vu):
+    token = make_token(vu.user['oid'], nonce=uuid.uuid4().hex)
+    response = vu.request('login', 'POST', '/api/azure-user', headers={'Authorization': f'Bearer {token}'})
+    return response is not None and response.status_code == 200
+
+
+def open_registration(vu):
+    """Registreringsvyn: roll, äldreboenden, aktiviteter och följeslagare."""
+    vu.request('me', 'GET', '/api/me')
+    homes = vu.request('homes', 'GET', '/api/aldreboenden')
+    vu.request('activities', 'GET', '/api/activities')
+    vu.request('companions', 'GET', '/api/companions')
+    if homes is None or homes.status_code != 200:
+        return []
+    return [h for h in homes.json() if any(d.get('active', True) for d in h.get('departments') or [])]
+
+
+def visit_payload(rng, home, today):
+    departments = [d for d in home['departments'] if d.get('active', True)]
+    declined = rng.random() < 0.12
+    individual = rng.random() < 0.3
+    if individual:
+        counts = {'men': 1, 'women': 0} if rng.random() < 0.4 else {'men': 0, 'women': 1}
+    else:
+        counts = {'men': rng.randint(0, 3), 'women': rng.randint(1, 6)}
+    total = counts['men'] + counts['women']
+    payload = {
+        'home_id': home['id'],
+        'department_id': rng.choice(departments)['id'],
+        'date': today.isoformat(),
+        'visit_type': 'individual' if individual else 'group',
+        'offer_status': 'declined' if declined else 'accepted',
+        'gender_counts': counts,
+    }
+    if not declined:
+        payload.update({
+            'activity_name': rng.choice(ACTIVITIES),
+            'companion_name': rng.choice(COMPANIONS),
+            'duration_minutes': rng.choice([15, 30, 45, 60]),
+            'satisfaction_entries': [
+                {'gender': 'women' if counts['women'] else 'men', 'rating': rng.randint(3, 6)}
+                for _ in range(min(total, rng.randint(0, 2)))
+            ],
+        })
+    return payload
+
+
+def staff_registration(vu):
+    """Personal: loggar in, öppnar registreringen, registrerar 1-4 besök, kollar sina besök."""
+    if not login(vu):
+        return
+    homes = open_registration(vu)
+    if not homes:
+        return
+    home = vu.rng.choice(homes)
+    for _ in range(vu.rng.randint(1, 4)):
+        if not vu.think(15, 60):
+            return
+        vu.request('register_visit', 'POST', '/api/visits', json=visit_payload(vu.rng, home, vu.today),
+                   headers={'Idempotency-Key': uuid.uuid4().hex})
+    if vu.think(2, 10):
+        vu.request('my_visits', 'GET', '/api/my-visits')
+
+
+def staff_correction(vu):
+    """Personal: rättar en tidigare registrering."""
+    if not login(vu):
+        return
+    vu.request('me', 'GET', '/api/me')
+    today = vu.today
+    mine = vu.request('my_visits', 'GET', f'/api/my-visits?from={(today - timedelta(days=30)).isoformat()}'
+                                          f'&to={today.isoformat()}')
+    if mine is None or mine.status_code != 200 or not mine.json():
+        return
+    visit_id = vu.rng.choice(mine.json())['id']
+    if not vu.think(5, 20):
+        return
+    doc = vu.request('get_visit', 'GET', f'/api/visits/{visit_id}')
+    if doc is None or doc.status_code != 200:
+        return
+    body = doc.json()
+    if body.get('offer_status') == 'accepted':
+        body['duration_minutes'] = vu.rng.choice([15, 30, 45, 60])
+    if vu.think(10, 30):
+        vu.request('update_visit', 'PUT', f'/api/visits/{visit_id}', json=body)
+
+
+def manager_dashboard(vu):
+    """Chef: dashboard med statistik som uppdateras med jämna mellanrum."""
+    if not login(vu):
+        return
+    vu.request('me', 'GET', '/api/me')
+    homes = vu.request('homes', 'GET', '/api/aldreboenden')
+    home_ids = [h['id'] for h in homes.json()] if homes is not None and homes.status_code == 200 else []
+    today = vu.today
+    while True:
+        if home_ids and vu.rng.random() < 0.8:
+            query = f'home={vu.rng.choice(home_ids)}&from={(today - timedelta(days=30)).isoformat()}'
+        else:
+            query = f'from={(today - timedelta(days=90)).isoformat()}'
+        vu.request('statistics', 'GET', f'/api/statistics?{query}&to={today.isoformat()}')
+        if not vu.think(20, 60):
+            return
+
+
+JOURNEYS = {
+    'staff_registration': staff_registration,
+    'staff_correction': staff_correction,
+    'manager_dashboard': manager_dashboard,
+}
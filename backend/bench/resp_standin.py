@@ -0,0 +1,108 @@
+"""
+Minimal Redis-kompatibel server för lokala tester av delad rate limiting.
+
+Stöder de kommandon RedisRateLimiter använder (PING, GET, INCR(BY), DECR(BY),
+EXPIRE, DEL, FLUSHALL) med utgångstider. Inte avsedd för produktion.
+
+    python bench/resp_standin.py --port 6390
+    RATE_LIMIT_STORE=redis RATE_LIMIT_REDIS_URL=redis://127.0.0.1:6390/0 flask run
+"""
+import time
+import argparse
+import threading
+import socketserver
+
+
+class _Store:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def execute(self, args):
+        cmd = args[0].upper()
+        with self.lock:
+            if cmd in (b'PING', b'HELLO', b'CLIENT', b'SELECT'):
+                return b'+OK\r\n' if cmd != b'PING' else b'+PONG\r\n'
+            if cmd == b'FLUSHALL':
+                self.data.clear()
+                self.expires.clear()
+                return b'+OK\r\n'
+            key = args[1]
+            if cmd == b'GET':
+                if not self._alive(key):
+                    return b'$-1\r\n'
+                value = str(self.data[key]).encode()
+                return b'$%d\r\n%s\r\n' % (len(value), value)
+            if cmd in (b'INCR', b'DECR', b'INCRBY', b'DECRBY'):
+                step = int(args[2]) if len(args) > 2 else 1
+                value = (self.data[key] if self._alive(key) else 0) + (step if cmd.startswith(b'INCR') else -step)
+                self.data[key] = value
+                return b':%d\r\n' % value
+            if cmd == b'EXPIRE':
+                if not self._alive(key):
+                    return b':0\r\n'
+                self.expires[key] = time.time() + int(args[2])
+                return b':1\r\n'
+            if cmd == b'DEL':
+                removed = sum(1 for k in args[1:] if self._alive(k) and self.data.pop(k, None) is not None)
+                return b':%d\r\n' % removed
+        return b'-ERR unknown command\r\n'
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b'*'):
+                self.wfile.write(b'-ERR protocol error\r\n')
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.server.store.execute(args))
+
+
+class RespStandin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'redis://{host}:{port}/0'
+
+    def start(self):
+        """Starta servern i en bakgrundstråd och returnera URL:en."""
+        threading.Thread(target=self.serve_forever, name='resp-standin', daemon=True).start()
+        return self.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+    server = RespStandin(args.host, args.port)
+    print(f'Listening on {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
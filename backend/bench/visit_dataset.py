@@ -0,0 +1,365 @@
+"""
+Syntetiska besök i samma form som register_visit sparar, för skaltester.
+
+Produktionsdata innehåller personalens identiteter och kan inte kopieras,
+så VisitDataset genererar äldreboenden, avdelningar, personal och besök
+med realistiska fördelningar: stora och små boenden, fler besök på
+vardagar och sommartid, förmiddags- och eftermiddagstoppar, populära
+aktiviteter, mest nöjda deltagare och en liten andel personal som
+registrerar det mesta. Med legacy > 0 blandas äldre poster in
+(traffpunkt_id i stället för home_id, participants i stället för
+gender_counts och ägare med bara e-post). Samma seed och today ger samma
+data; today är DEFAULT_TODAY om inget annat anges (--today).
+
+    python bench/visit_dataset.py --visits 1000000 --sqlite data/skala.sqlite3
+    python bench/visit_dataset.py --visits 100000 --legacy 0.05 --jsonl /tmp/besok.jsonl
+
+I kod: load_standin(InMemoryCosmosService(), dataset, n) eller
+load_sqlite(SqliteStorage(path), dataset, n).
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import multiprocessing
+from bisect import bisect
+from functools import partial
+from itertools import accumulate
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from cosmos_standin import ACTIVITIES, COMPANIONS, bench_user  # noqa: E402
+
+# Andel av besöken per aktivitet och följeslagare (samma ordning som listorna)
+ACTIVITY_WEIGHTS = [40, 18, 12, 8, 7, 15]
+COMPANION_WEIGHTS = [62, 16, 8, 14]
+DURATIONS = [15, 30, 45, 60, 90, 120]
+DURATION_WEIGHTS = [10, 35, 20, 24, 8, 3]
+# Nöjdhet 1-6, de flesta är nöjda
+RATING_WEIGHTS = [2, 3, 8, 20, 35, 32]
+# Deltagare i en gruppaktivitet (2-10)
+GROUP_SIZE_WEIGHTS = [14, 22, 22, 16, 10, 7, 5, 3, 1]
+# Registreringar per timme 07-21: efter förmiddagens och eftermiddagens utevistelser
+HOUR_WEIGHTS = [1, 3, 8, 14, 16, 10, 7, 12, 16, 9, 4, 2, 1, 1]
+WOMEN_SHARE = 0.65
+
+
+def _cumulative(weights) -> List[float]:
+    return list(accumulate(weights))
+
+
+def _women_cumulative(size: int) -> List[float]:
+    # Binomialfördelning: antal kvinnor i en grupp med size deltagare
+    return _cumulative(math.comb(size, k) * WOMEN_SHARE ** k * (1 - WOMEN_SHARE) ** (size - k) for k in range(size + 1))
+
+
+# Fast sista dag i datat, så att en seed ger samma besök oavsett vilken dag det körs
+DEFAULT_TODAY = date(2026, 6, 30)
+
+
+class VisitDataset:
+    """Referensdata och en deterministisk ström av besök.
+
+    Äldreboendena heter boende-NN med avdelningarna boende-NN__avd-D och
+    personalen är bench_user(0..users-1), så dataset kan användas av
+    bench_api.py och loadtest.py. Besöken fördelas över de senaste days
+    dagarna till och med today.
+    """
+
+    CHUNK = 10000
+
+    def __init__(self, seed: int = 1, homes: int = 12, departments: int = 4, users: int = 200,
+                 days: int = 365, legacy: float = 0.0, today: Optional[date] = None):
+        self.seed = seed
+        self.days = days
+        self.legacy = legacy
+        self.today = today or DEFAULT_TODAY
+        rnd = random.Random(seed)
+
+        self.homes = []
+        home_weights = []
+        for h in range(homes):
+            home_id = f'boende-{h:02d}'
+            count = rnd.randint(min(2, departments), departments)
+            self.homes.append({
+                'id': home_id, 'name': f'Äldreboende {h:02d}', 'active': True,
+                'departments': [
+                    {'id': f'{home_id}__avd-{d}', 'name': f'Avdelning {d}', 'active': d == 0 or rnd.random() > 0.05}
+                    for d in range(count)
+                ],
+            })
+            # Boendenas storlek varierar ungefär fyra gånger
+            home_weights.append(rnd.uniform(0.5, 2.0))
+        self.activities = [
+            {'id': name.lower().replace(' ', '-').replace('ä', 'a').replace('å', 'a'), 'name': name,
+             'active': True, 'category': 'allman', 'sort_order': i + 1}
+            for i, name in enumerate(ACTIVITIES)
+        ]
+        self.companions = [{'id': name.lower(), 'name': name, 'active': True} for name in COMPANIONS]
+        self.users = [bench_user(u) for u in range(users)]
+
+        # Personalen hör till ett boende och registrerar olika mycket (Pareto)
+        self._staff_by_home = [[] for _ in range(homes)]
+        for u, user in enumerate(self.users):
+            home = u % homes if u < homes else rnd.choices(range(homes), home_weights)[0]
+            self._staff_by_home[home].append((user, rnd.paretovariate(1.5)))
+        self._staff_cum = [_cumulative(w for _, w in staff) for staff in self._staff_by_home]
+        self._home_cum = _cumulative(
+            weight if self._staff_by_home[h] else 0.0 for h, weight in enumerate(home_weights)
+        )
+
+        # Färre besök på helger och vintertid (toppen i mitten av juli)
+        self.dates = [self.today - timedelta(days=d) for d in range(days)]
+        self._date_cum = _cumulative(
+            (0.4 if d.weekday() >= 5 else 1.0) * (1 + 0.6 * math.cos(2 * math.pi * (d.timetuple().tm_yday - 196) / 365))
+            for d in self.dates
+        )
+        self._date_iso = [d.isoformat() for d in self.dates]
+        # Äldre poster finns bara i den äldre halvan av perioden
+        old_share = 1 - self._date_cum[days // 2 - 1] / self._date_cum[-1] if days > 1 else 1.0
+        self._legacy_p = min(1.0, legacy / old_share) if old_share else 0.0
+        self._winter = [d.month in (11, 12, 1, 2, 3) for d in self.dates]
+        self._women_cum = {size: _women_cumulative(size) for size in range(2, 11)}
+
+    def reference(self) -> Dict[str, List[Dict]]:
+        return {
+            'homes': self.homes,
+            'activities': self.activities,
+            'companions': self.companions,
+            'users': [{'id': u['oid'], 'email': u['email'], 'display_name': u['name'], 'roles': {'admin': False}}
+                      for u in self.users],
+        }
+
+    def visits(self, count: int, start: int = 0) -> Iterator[Dict]:
+        """Besök nummer start..start+count-1.
+
+        Besöken genereras i block om CHUNK; med start delbart med CHUNK blir
+        besöken desamma som när allt genereras i ett svep.
+        """
+        for offset in range(start, start + count, self.CHUNK):
+            yield from self._chunk(offset, min(self.CHUNK, start + count - offset))
+
+    def _chunk(self, offset: int, size: int) -> Iterator[Dict]:
+        # Varje block har en egen slumpgenerator så att block kan genereras var för sig
+        rnd = random.Random(self.seed * 1000003 + offset)
+        random_ = rnd.random
+        choices = rnd.choices
+        homes = choices(range(len(self.homes)), cum_weights=self._home_cum, k=size)
+        days = choices(range(self.days), cum_weights=self._date_cum, k=size)
+        hours = choices(range(7, 21), cum_weights=_cumulative(HOUR_WEIGHTS), k=size)
+        activities = choices(ACTIVITIES, cum_weights=_cumulative(ACTIVITY_WEIGHTS), k=size)
+        companions = choices(COMPANIONS, cum_weights=_cumulative(COMPANION_WEIGHTS), k=size)
+        durations = choices(DURATIONS, cum_weights=_cumulative(DURATION_WEIGHTS), k=size)
+        group_sizes = choices(range(2, 11), cum_weights=_cumulative(GROUP_SIZE_WEIGHTS), k=size)
+        rating_cum = _cumulative(RATING_WEIGHTS)
+        rating_total = rating_cum[-1]
+        id_prefix = (self.seed & 0xffffffff) << 96
+
+        for n in range(size):
+            index = offset + n
+            home_index = homes[n]
+            home = self.homes[home_index]
+            staff = self._staff_by_home[home_index]
+            cum = self._staff_cum[home_index]
+            user = staff[bisect(cum, random_() * cum[-1])][0]
+            departments = home['departments']
+            day = days[n]
+            department = departments[int(random_() * len(departments))]
+            if not department['active'] and day < self.days // 2:
+                # Inaktiverade avdelningar har bara äldre besök
+                department = departments[0]
+            department = department['id']
+
+            individual = random_() < 0.35
+            # Enskilda erbjudanden avböjs oftare, och oftare vintertid
+            declined = random_() < (0.16 if individual else 0.09) * (1.4 if self._winter[day] else 1.0)
+            if individual:
+                women = 1 if random_() < WOMEN_SHARE else 0
+                men = 1 - women
+            else:
+                total = group_sizes[n]
+                women_cum = self._women_cum[total]
+                women = bisect(women_cum, random_() * women_cum[-1])
+                men = total - women
+            total = men + women
+
+            satisfaction = []
+            if not declined and random_() < 0.7:
+                for _ in range(1 + int(random_() * total)):
+                    gender = 'women' if random_() * total < women else 'men'
+                    satisfaction.append({'gender': gender, 'rating': bisect(rating_cum, random_() * rating_total) + 1})
+
+            second = int(random_() * 3600)
+            registered_at = (f'{self._date_iso[day]}T{hours[n]:02d}:{second // 60:02d}:{second % 60:02d}'
+                             f'.{int(random_() * 1000000):06d}')
+            edit_count = 0
+            last_modified_at = registered_at
+            if random_() < 0.08:
+                edit_count = 1 + (random_() < 0.25)
+                last_modified_at = (self._date_iso[max(0, day - int(random_() * 3))]
+                                    + f'T{16 + int(random_() * 4):02d}:{int(random_() * 60):02d}:00.000000')
+
+            activity = '' if declined else activities[n]
+            companion = '' if declined else companions[n]
+            h = f'{id_prefix | index:032x}'
+            doc = {
+                'id': f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}',
+                'home_id': home['id'],
+                'department_id': department,
+                'date': self._date_iso[day],
+                'visit_type': 'individual' if individual else 'group',
+                'offer_status': 'declined' if declined else 'accepted',
+                'gender_counts': {'men': men, 'women': women},
+                'total_participants': total,
+                'activity': activity, 'activity_name': activity,
+                'companion': companion, 'companion_name': companion,
+                'activity_id': '', 'companion_id': '',
+                'duration_minutes': None if declined else durations[n],
+                'satisfaction_entries': satisfaction,
+                'registered_by': user['email'],
+                'registered_by_oid': user['oid'],
+                'registered_at': registered_at,
+                'last_modified_at': last_modified_at,
+                'edit_count': edit_count,
+            }
+            if self.legacy and day >= self.days // 2 and random_() < self._legacy_p:
+                self._make_legacy(doc, rnd)
+            yield doc
+
+    @staticmethod
+    def _make_legacy(doc: Dict, rnd: random.Random) -> None:
+        """Ge besöket en eller flera av de äldre formerna."""
+        kinds = [k for k in ('traffpunkt', 'participants', 'email_only') if rnd.random() < 0.6] or ['email_only']
+        if 'traffpunkt' in kinds:
+            # Från innan avdelningar fanns
+            doc['traffpunkt_id'] = doc.pop('home_id')
+            del doc['department_id']
+        if 'participants' in kinds:
+            counts = doc.pop('gender_counts')
+            del doc['total_participants']
+            doc['participants'] = {'deltagare': {'men': counts['men'], 'women': counts['women']}}
+        if 'email_only' in kinds:
+            del doc['registered_by_oid']
+
+
+def load_standin(service, dataset: VisitDataset, visits: int) -> int:
+    """Fyll en InMemoryCosmosService (tömmer den först). Returnerar antal besök."""
+    service.clear()
+    reference = dataset.reference()
+    service.c_homes.load(reference['homes'])
+    service.c_act.load(reference['activities'])
+    service.c_comp.load(reference['companions'])
+    service.c_users.load(reference['users'])
+    return service.c_visits.load(dataset.visits(visits))
+
+
+def _json_dumps():
+    from sqlite_storage import _dumps
+    try:
+        import orjson
+    except ImportError:
+        return _dumps
+
+    # Samma kompakta UTF-8-JSON som _dumps, ungefär tio gånger snabbare
+    def dumps(doc):
+        return orjson.dumps(doc).decode()
+    return dumps
+
+
+def _sqlite_rows(dataset: VisitDataset, span: Tuple[int, int]) -> List[tuple]:
+    from sqlite_storage import VISIT_COLUMNS
+    dumps = _json_dumps()
+    offset, size = span
+    # Kolumnfälten är alltid strängar i de genererade besöken (jfr _visit_row)
+    return [(doc['id'], *map(doc.get, VISIT_COLUMNS), dumps(doc)) for doc in dataset.visits(size, offset)]
+
+
+def load_sqlite(storage, dataset: VisitDataset, visits: int, processes: int = 1) -> int:
+    """Skriv besök och referensdata till en SqliteStorage med en bulkladdning.
+
+    Besöksindexen tas bort under laddningen och byggs om efteråt, och allt
+    skrivs i en transaktion utan fsync. Med processes > 1 genereras blocken
+    parallellt (samma data som med en process). Finns besöken redan (samma
+    seed) skrivs de över, så laddningen kan köras om.
+    """
+    from sqlite_storage import SCHEMA, _REPLACE_VISIT, _dumps
+
+    spans = [(offset, min(VisitDataset.CHUNK, visits - offset)) for offset in range(0, visits, VisitDataset.CHUNK)]
+    conn = storage._conn()
+    reference = dataset.reference()
+    indexes = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'visits' AND sql IS NOT NULL")]
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    chunks = (pool.imap if pool else map)(partial(_sqlite_rows, dataset), spans)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table in ('homes', 'companions', 'users'):
+            conn.executemany(f'INSERT OR REPLACE INTO {table} (id, doc) VALUES (?, ?)',
+                             [(doc['id'], _dumps(doc)) for doc in reference[table]])
+        conn.executemany('INSERT OR REPLACE INTO activities (id, name, doc) VALUES (?, ?, ?)',
+                         [(doc['id'], doc['name'], _dumps(doc)) for doc in reference['activities']])
+        for name in indexes:
+            conn.execute(f'DROP INDEX {name}')
+        count = 0
+        for rows in chunks:
+            conn.executemany(_REPLACE_VISIT, rows)
+            count += len(rows)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if pool:
+            pool.terminate()
+    conn.executescript(SCHEMA)
+    conn.execute('ANALYZE')
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--visits', type=int, default=1000000)
+    parser.add_argument('--homes', type=int, default=12)
+    parser.add_argument('--departments', type=int, default=4, help='Max antal avdelningar per boende')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--legacy', type=float, default=0.0, help='Andel äldre poster, t.ex. 0.05')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--today', type=date.fromisoformat, default=DEFAULT_TODAY,
+                        help='Sista dagen i datat, ÅÅÅÅ-MM-DD')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='Processer som genererar besök (--sqlite)')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--sqlite', help='SQLite-fil att ladda (STORAGE_BACKEND=sqlite)')
+    target.add_argument('--jsonl', help='Skriv besöken som NDJSON, ett dokument per rad')
+    args = parser.parse_args()
+
+    dataset = VisitDataset(seed=args.seed, homes=args.homes, departments=args.departments, users=args.users,
+                           days=args.days, legacy=args.legacy, today=args.today)
+    start = time.perf_counter()
+    if args.sqlite:
+        from sqlite_storage import SqliteStorage
+        count = load_sqlite(SqliteStorage(args.sqlite), dataset, args.visits, args.processes)
+    else:
+        count = 0
+        with open(args.jsonl, 'w', encoding='utf-8') as fh:
+            for doc in dataset.visits(args.visits):
+                fh.write(json.dumps(doc, ensure_ascii=False, separators=(',', ':')))
+                fh.write('\n')
+                count += 1
+    elapsed = time.perf_counter() - start
+    print(f'{count} besök på {elapsed:.1f} s ({count / elapsed:,.0f}/s) -> {args.sqlite or args.jsonl} '
+          f'(seed {args.seed}, t.o.m. {dataset.today.isoformat()})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Stand-in för appen vid jämförelse av gunicorn-profiler (bench_worker_profiles.py).
+
+Endpoints motsvarar appens typiska last utan riktiga Cosmos-/Graph-anrop:
+  /io   – väntar som ett Cosmos-anrop (BENCH_IO_MS) och returnerar en liten lista
+  /cpu  – serialiserar en statistiksida till JSON (ren CPU)
+"""
+import os
+import time
+import json
+
+from flask import Flask, Response, jsonify
+
+IO_MS = float(os.getenv('BENCH_IO_MS', '20'))
+
+app = Flask(__name__)
+
+_PAGE = [
+    {'id': f'v{i}', 'home_id': 'h1', 'date': '2024-05-01', 'visit_type': 'group',
+     'gender_counts': {'men': i % 3, 'women': i % 5}, 'activity': 'Promenad i parken'}
+    for i in range(500)
+]
+
+
+@app.route('/io')
+def io_bound():
+    time.sleep(IO_MS / 1000.0)
+    return jsonify(_PAGE[:20])
+
+
+@app.route('/cpu')
+def cpu_bound():
+    return Response(json.dumps(_PAGE, ensure_ascii=False), mimetype='application/json')
@@ -0,0 +1,122 @@
+"""
+Förhandlad gzip-/brotli-komprimering av API-svar (JSON, NDJSON, CSV)
+"""
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Utan brotli komprimeras bara med gzip
+    brotli = None
+
+# Under gränsen (byte) kostar komprimeringen mer än den sparar
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+# Nivåer för dynamiska svar: gzip 6 och brotli 5 ger ca 25x respektive 50x
+# mindre besökslistor på ett par ms per MB; högre nivåer kostar 4-5 gånger
+# mer CPU för liten vinst (mät med bench/bench_compression.py)
+GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html',
+}
+
+
+def accepted_encodings(header: Optional[str]):
+    """Kodningar klienten accepterar enligt Accept-Encoding (q=0 räknas som nej)."""
+    accepted = set()
+    for part in (header or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:].strip('0.') == '':
+            continue
+        accepted.add(name.strip())
+    return accepted
+
+
+def negotiate_encoding(header: Optional[str], available=('br', 'gzip')) -> Optional[str]:
+    """Bästa kodning som både klienten och servern stöder, eller None."""
+    accepted = accepted_encodings(header)
+    for encoding in available:
+        if encoding == 'br' and brotli is None:
+            continue
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            self.obj = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress = self.obj.process
+            self.flush = self.obj.flush
+            self.finish = self.obj.finish
+        else:
+            self.obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress = self.obj.compress
+            self.flush = lambda: self.obj.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.obj.flush
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    compressor = _Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Komprimera en ström block för block; varje block flushas så att
+    klienten får data direkt i stället för när hela svaret är klart."""
+    compressor = _Compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            block = compressor.compress(chunk) + compressor.flush()
+            if block:
+                yield block
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    """after_request: komprimera svaret om klienten vill och det lönar sig."""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(compress_bytes(data, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag'):
+        # Samma innehåll men andra byte: ETag måste skilja sig per kodning
+        tag, weak = response.get_etag()
+        response.set_etag(f'{tag}-{encoding}', weak)
+    return response
+
+
+def init_compression(app):
+    """Registrera komprimering för alla svar från appen."""
+    app.after_request(compress_response)
@@ -1,70 +1,95 @@
 import os
-import re
+import threading
 from uuid import uuid4
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, Tuple
 from datetime import datetime
 
 from azure.cosmos import CosmosClient, PartitionKey
-from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError
+from azure.cosmos.exceptions import (
+    CosmosBatchOperationError, CosmosHttpResponseError, CosmosResourceNotFoundError
+)
 
-MAX_DEPARTMENTS_PER_HOME = 20
+# VISIT_BATCH_LIMIT and visit_id_for_key are re-exported for existing imports
+from server_timing import cosmos_request_hook, cosmos_response_hook
+from storage import (  # noqa: F401
+    MAX_DEPARTMENTS_PER_HOME, MAX_LOGIN_SEEN, VISIT_BATCH_LIMIT, ConflictError, StorageBackend,
+    _activity_id, _iso_now, _parse_iso, _slugify, visit_id_for_key,
+)
 
+_shared_service = None
+_shared_lock = threading.Lock()
 
-def _iso_now() -> str:
-    return datetime.utcnow().isoformat()
 
+def get_cosmos_service() -> 'CosmosService':
+    """Return the process-wide CosmosService, creating it on first use."""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_lock:
+            if _shared_service is None:
+                _shared_service = CosmosService()
+    return _shared_service
 
-def _slugify(value: Optional[str]) -> str:
-    if not value:
-        return ''
-    slug = value.strip().lower()
-    slug = slug.replace('å', 'a').replace('ä', 'a').replace('ö', 'o')
-    slug = slug.replace(' ', '-')
-    slug = re.sub(r'[^a-z0-9-]', '', slug)
-    slug = re.sub(r'-+', '-', slug).strip('-')
-    return slug
 
-
-class CosmosService:
+class CosmosService(StorageBackend):
     def __init__(self):
+        self.connect(ensure=True)
+        # Optional callable(kind, doc) that takes over audit writes (see audit_queue)
+        self.audit_sink = None
+        # oid -> (email, display_name, last_login_at) of logins recorded by this process
+        self._login_seen: Dict[str, tuple] = {}
+
+    def connect(self, ensure: bool = True) -> None:
+        """Create the Cosmos client and container proxies.
+
+        With ensure=False the database and containers are assumed to exist;
+        gunicorn workers use that after fork so that each process gets its
+        own HTTP connections instead of sharing the master's sockets.
+        """
         endpoint = os.getenv('COSMOS_ENDPOINT')
         key = os.getenv('COSMOS_KEY')
         db_name = os.getenv('COSMOS_DATABASE', 'sabo')
         if not endpoint or not key:
             raise RuntimeError('COSMOS_ENDPOINT and COSMOS_KEY must be set')
 
-        self.client = CosmosClient(endpoint, key)
+        # Tid och RU per HTTP-anrop till Server-Timing-headern
+        self.client = CosmosClient(endpoint, key, raw_request_hook=cosmos_request_hook,
+                                   raw_response_hook=cosmos_response_hook)
 
-        # Ensure database exists
-        try:
-            self.db = self.client.create_database_if_not_exists(id=db_name)
-        except CosmosHttpResponseError as e:
-            raise RuntimeError(f'Failed to ensure Cosmos DB database {db_name}: {e}')
+        if ensure:
+            # Ensure database exists
+            try:
+                self.db = self.client.create_database_if_not_exists(id=db_name)
+            except CosmosHttpResponseError as e:
+                raise RuntimeError(f'Failed to ensure Cosmos DB database {db_name}: {e}')
+        else:
+            self.db = self.client.get_database_client(db_name)
 
         # Containers and partition keys
         self.c_visits = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_VISITS', 'outdoor_visits'), '/home_id'
+            os.getenv('COSMOS_CONTAINER_VISITS', 'outdoor_visits'), '/home_id', ensure
         )
         self.c_act = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_ACTIVITIES', 'activities'), '/id'
+            os.getenv('COSMOS_CONTAINER_ACTIVITIES', 'activities'), '/id', ensure
         )
         self.c_homes = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_HOMES', 'homes'), '/id'
+            os.getenv('COSMOS_CONTAINER_HOMES', 'homes'), '/id', ensure
         )
         self.c_comp = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_COMPANIONS', 'companions'), '/id'
+            os.getenv('COSMOS_CONTAINER_COMPANIONS', 'companions'), '/id', ensure
         )
         self.c_users = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_USERS', 'users_sabo'), '/id'
+            os.getenv('COSMOS_CONTAINER_USERS', 'users_sabo'), '/id', ensure
         )
         self.c_admin_audit = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_ADMIN_AUDIT', 'admin_audit_sabo'), '/id'
+            os.getenv('COSMOS_CONTAINER_ADMIN_AUDIT', 'admin_audit_sabo'), '/id', ensure
         )
         self.c_visit_audit = self._ensure_container(
-            os.getenv('COSMOS_CONTAINER_VISIT_AUDIT', 'visit_audit_sabo'), '/id'
+            os.getenv('COSMOS_CONTAINER_VISIT_AUDIT', 'visit_audit_sabo'), '/id', ensure
         )
 
-    def _ensure_container(self, container_id: str, partition_path: str):
+    def _ensure_container(self, container_id: str, partition_path: str, ensure: bool = True):
+        if not ensure:
+            return self.db.get_container_client(container_id)
         try:
             return self.db.create_container_if_not_exists(
                 id=container_id,
@@ -282,7 +307,7 @@ class CosmosService:
     def add_activity_if_not_exists(self, activity_name: Optional[str]) -> None:
         if not activity_name:
             return
-        activity_id = re.sub(r'[^a-z0-9-]', '', (activity_name or '').lower().replace(' ', '-'))
+        activity_id = _activity_id(activity_name)
         try:
             self.c_act.read_item(item=activity_id, partition_key=activity_id)
             return  # already exists
@@ -318,7 +343,7 @@ class CosmosService:
         name = (data.get('name') or '').strip()
         if not name:
             return None
-        activity_id = re.sub(r'[^a-z0-9-]', '', name.lower().replace(' ', '-'))
+        activity_id = _activity_id(name)
         try:
             # return None if exists
             try:
@@ -390,24 +415,49 @@ class CosmosService:
 
     # ---- Outdoor visits ----
     def add_visit(self, data: Dict) -> str:
-        d = dict(data)
-        if not d.get('id'):
-            d['id'] = str(uuid4())
-        # ensure timestamps as ISO strings
-        ra = d.get('registered_at')
-        if not isinstance(ra, str):
-            d['registered_at'] = _iso_now()
-        lma = d.get('last_modified_at')
-        if not isinstance(lma, str):
-            d['last_modified_at'] = d['registered_at']
-        if 'edit_count' not in d:
-            d['edit_count'] = 0
-        self.c_visits.create_item(d)
+        d = self._prepare_visit(data)
+        try:
+            self.c_visits.create_item(d)
+        except CosmosHttpResponseError as e:
+            if getattr(e, 'status_code', None) == 409:
+                raise ConflictError(d['id']) from e
+            raise
         return d['id']
 
-    def get_statistics(self, home_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
-                       department_id: Optional[str] = None, activity_id: Optional[str] = None, companion_id: Optional[str] = None,
-                       offer_status: Optional[str] = None, visit_type: Optional[str] = None) -> List[Dict]:
+    def add_visits_batch(self, home_id: str, docs: List[Dict]) -> List[Tuple[str, str]]:
+        """Write visits for one home in transactional batches.
+
+        Returns (id, status) per document where status is 'created', 'exists'
+        (the id was already stored, e.g. a resent client id) or 'error'.
+        """
+        prepared = [self._prepare_visit({**d, 'home_id': home_id}) for d in docs]
+        results: List[Tuple[str, str]] = []
+        for start in range(0, len(prepared), VISIT_BATCH_LIMIT):
+            chunk = prepared[start:start + VISIT_BATCH_LIMIT]
+            try:
+                self.c_visits.execute_item_batch(
+                    [('create', (d,)) for d in chunk], partition_key=home_id
+                )
+                results.extend((d['id'], 'created') for d in chunk)
+                continue
+            except (CosmosBatchOperationError, CosmosHttpResponseError):
+                # A batch is all-or-nothing: fall back to single writes so that
+                # one bad row does not fail the rest of the chunk.
+                pass
+            for d in chunk:
+                try:
+                    self.c_visits.create_item(d)
+                    results.append((d['id'], 'created'))
+                except CosmosHttpResponseError as e:
+                    status = 'exists' if getattr(e, 'status_code', None) == 409 else 'error'
+                    results.append((d['id'], status))
+        return results
+
+    def iter_statistics(self, home_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        department_id: Optional[str] = None, activity_id: Optional[str] = None, companion_id: Optional[str] = None,
+                        offer_status: Optional[str] = None, visit_type: Optional[str] = None,
+                        page_size: Optional[int] = None) -> Iterator[Dict]:
+        """Lazily page through visits matching the statistics filters."""
         # Build SQL query dynamically
         clauses = []
         params = []
@@ -437,8 +487,9 @@ class CosmosService:
             params.append({'name': '@vt', 'value': visit_type})
         where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
         q = f'SELECT * FROM c{where}'
-        items = list(self.c_visits.query_items(query=q, parameters=params, enable_cross_partition_query=True))
-        return items
+        return self.c_visits.query_items(
+            query=q, parameters=params, enable_cross_partition_query=True, max_item_count=page_size
+        )
 
     def list_my_visits(self, oid: str, email: Optional[str], date_from: Optional[str], date_to: Optional[str], limit: int = 500) -> List[Dict]:
         clauses = ['c.registered_by_oid = @oid']
@@ -509,42 +560,70 @@ class CosmosService:
         except CosmosHttpResponseError:
             return False
 
-    def write_visit_audit(self, action: str, actor_oid: str, actor_email: str, visit_id: str, changed_fields: Optional[List[str]] = None):
-        doc = {
-            'id': str(uuid4()),
-            'action': action,
-            'actor_oid': actor_oid,
-            'actor_email': (actor_email or '').lower(),
-            'visit_id': visit_id,
-            'changed_fields': changed_fields or [],
-            'ts': _iso_now(),
-        }
-        self.c_visit_audit.create_item(doc)
+    def write_audit_doc(self, kind: str, doc: Dict) -> None:
+        container = self.c_visit_audit if kind == 'visit' else self.c_admin_audit
+        try:
+            container.create_item(doc)
+        except CosmosHttpResponseError as e:
+            # Audit ids are fixed when the record is built, so a 409 means a
+            # retried or replayed record was already stored.
+            if getattr(e, 'status_code', None) != 409:
+                raise
 
     # ---- Users & roles ----
-    def upsert_user(self, oid: str, email: str, display_name: str) -> None:
+    def upsert_user(self, oid: str, email: str, display_name: str, min_interval_seconds: int = 0) -> bool:
+        """Record a login. Returns True if the users container was written.
+
+        The write is skipped when email and display name are unchanged and the
+        stored last_login_at is younger than min_interval_seconds.
+        """
         if not oid:
-            return
+            return False
         email_l = (email or '').strip().lower()
+        name = display_name or ''
+        now = datetime.utcnow()
+        if min_interval_seconds > 0:
+            seen = self._login_seen.get(oid)
+            if seen and seen[:2] == (email_l, name) and (now - seen[2]).total_seconds() < min_interval_seconds:
+                return False
         try:
             user = self.c_users.read_item(item=oid, partition_key=oid)
-            # update
-            user.update({
-                'email': email_l,
-                'display_name': display_name or '',
-                'last_login_at': _iso_now(),
-            })
-            self.c_users.upsert_item(user)
         except CosmosResourceNotFoundError:
             doc = {
                 'id': oid,
                 'email': email_l,
-                'display_name': display_name or '',
+                'display_name': name,
                 'roles': {'admin': False},
                 'created_at': _iso_now(),
                 'last_login_at': _iso_now(),
             }
-            self.c_users.create_item(doc)
+            try:
+                self.c_users.create_item(doc)
+                self._remember_login(oid, email_l, name, now)
+                return True
+            except CosmosHttpResponseError as e:
+                # Concurrent first login from another worker created it already
+                if getattr(e, 'status_code', None) != 409:
+                    raise
+                user = self.c_users.read_item(item=oid, partition_key=oid)
+
+        last_login = _parse_iso(user.get('last_login_at'))
+        if (user.get('email') == email_l and user.get('display_name') == name and last_login
+                and (now - last_login).total_seconds() < min_interval_seconds):
+            self._remember_login(oid, email_l, name, last_login)
+            return False
+        self.c_users.patch_item(item=oid, partition_key=oid, patch_operations=[
+            {'op': 'set', 'path': '/email', 'value': email_l},
+            {'op': 'set', 'path': '/display_name', 'value': name},
+            {'op': 'set', 'path': '/last_login_at', 'value': now.isoformat()},
+        ])
+        self._remember_login(oid, email_l, name, now)
+        return True
+
+    def _remember_login(self, oid: str, email: str, name: str, at: datetime) -> None:
+        if len(self._login_seen) >= MAX_LOGIN_SEEN:
+            self._login_seen.clear()
+        self._login_seen[oid] = (email, name, at)
 
     def get_user(self, oid: str) -> Optional[Dict]:
         if not oid:
@@ -572,7 +651,7 @@ class CosmosService:
         user['roles'] = roles
         self.c_users.upsert_item(user)
         # Audit
-        self.c_admin_audit.create_item({
+        self._write_audit('admin', {
             'id': str(uuid4()),
             'action': 'grant_admin' if admin else 'revoke_admin',
             'actor_oid': actor_oid,
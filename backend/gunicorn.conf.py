@@ -1 +1,99 @@
- 
+"""
+Gunicorn-konfiguration för produktion.
+
+Workerprofil väljs med GUNICORN_PROFILE:
+  gthread (standard) – trådade workers, bra för Cosmos-/Graph-anrop som mest väntar på nätverk
+  gevent             – asynkrona greenlets, för många samtidiga långsamma anslutningar
+  sync               – en request åt gången per worker (gamla beteendet)
+
+Antal workers räknas från tillgängliga CPU:er (inklusive cgroup-kvot i
+containern) och kan sättas med GUNICORN_WORKERS. Jämför profilerna med
+bench/bench_worker_profiles.py.
+"""
+import gc
+import os
+import sys
+
+
+def _cpu_count():
+    """CPU:er som processen får använda, med hänsyn till containerns kvot."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as fh:
+            quota, period = fh.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+profile = os.getenv('GUNICORN_PROFILE', 'gthread').strip().lower()
+if profile == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print('gevent is not installed – falling back to gthread', file=sys.stderr)
+        profile = 'gthread'
+if profile not in ('gthread', 'gevent', 'sync'):
+    print(f'Unknown GUNICORN_PROFILE {profile!r} – using gthread', file=sys.stderr)
+    profile = 'gthread'
+
+cpus = _cpu_count()
+bind = f":{os.getenv('PORT', '8080')}"
+worker_class = profile
+if profile == 'sync':
+    workers = int(os.getenv('GUNICORN_WORKERS', str(2 * cpus + 1)))
+elif profile == 'gthread':
+    workers = int(os.getenv('GUNICORN_WORKERS', str(cpus + 1)))
+    threads = int(os.getenv('GUNICORN_THREADS', '8'))
+else:
+    workers = int(os.getenv('GUNICORN_WORKERS', str(cpus)))
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200'))
+
+# Långa statistikexporter strömmas i flera minuter: ge dem tid både under
+# drift (sync-workers dödas efter timeout) och vid omstart (graceful_timeout)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '120'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Förladda appen i mastern så att workers delar kod och data via copy-on-write.
+# gevent patchar standardbiblioteket i varje worker och kräver därför att appen
+# laddas efter fork.
+preload_app = profile != 'gevent' and os.getenv('GUNICORN_PRELOAD', '1') == '1'
+# app.py skjuter upp anslutningar och bakgrundstrådar till post_fork
+os.environ['GUNICORN_PRELOAD'] = '1' if preload_app else '0'
+
+
+def when_ready(server):
+    """Frys objekten från preload så att GC i workers inte skriver i delade sidor."""
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+        server.log.info('Froze %d objects after preload', gc.get_freeze_count())
+    server.log.info('Profile %s: %d workers', profile, workers)
+
+
+def post_fork(server, worker):
+    """Egna Cosmos-klienter, auditkö och bakgrundstrådar per worker."""
+    if not preload_app:
+        return
+    init_worker = getattr(sys.modules.get('app'), 'init_worker', None)
+    if init_worker is not None:
+        init_worker(after_fork=True)
+
+
+def worker_exit(server, worker):
+    """Töm audit- och loggkön innan workern avslutas (graceful shutdown)."""
+    app_module = sys.modules.get('app')
+    audit_queue = getattr(app_module, 'audit_queue', None)
+    if audit_queue is not None:
+        audit_queue.close()
+    # Skriv ut loggposter som ligger kvar i kön
+    stop_logging = getattr(sys.modules.get('log_setup'), 'stop_logging', None)
+    if stop_logging is not None:
+        stop_logging()
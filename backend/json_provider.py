@@ -0,0 +1,96 @@
+"""
+JSON-providers för Flask: standardbiblioteket eller orjson (snabbare för
+statistik med tusentals besök). Väljs med JSON_PROVIDER=std|orjson.
+"""
+import os
+import logging
+from datetime import date, datetime
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+from server_timing import timed
+
+try:
+    import orjson
+except ImportError:  # Utan orjson används standardbiblioteket
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """Standardbibliotekets json, men datum som ISO 8601 (samma format som
+    sparas i Cosmos) och å, ä, ö oescapade."""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    @staticmethod
+    def default(o: Any) -> Any:
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def response(self, *args: Any, **kwargs: Any):
+        # Mäts som serialization i Server-Timing; _response gör jobbet
+        with timed('serialization'):
+            return self._response(*args, **kwargs)
+
+    def _response(self, *args: Any, **kwargs: Any):
+        return super().response(*args, **kwargs)
+
+
+class OrjsonProvider(IsoJSONProvider):
+    """orjson för både request-parsning och svar.
+
+    Ger samma JSON som IsoJSONProvider; värden som orjson inte kan koda
+    (t.ex. heltal över 64 bitar) går via standardbiblioteket. Ogiltig JSON
+    ger orjson.JSONDecodeError, en ValueError precis som i json-modulen.
+    """
+
+    _options = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def _dumps_bytes(self, obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            # indent/separators m.m. stöds bara av standardbiblioteket
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super()._response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {
+    'std': IsoJSONProvider,
+    'orjson': OrjsonProvider,
+}
+
+
+def init_json_provider(app, name=None):
+    """Sätt app.json enligt name eller JSON_PROVIDER (standard: orjson om installerat)."""
+    name = (name or os.getenv('JSON_PROVIDER') or ('orjson' if orjson is not None else 'std')).strip().lower()
+    if name == 'orjson' and orjson is None:
+        logger.warning('JSON_PROVIDER=orjson but orjson is not installed – using std')
+        name = 'std'
+    provider_class = JSON_PROVIDERS.get(name)
+    if provider_class is None:
+        logger.warning('Unknown JSON_PROVIDER %r – using std', name)
+        provider_class = IsoJSONProvider
+    app.json_provider_class = provider_class
+    app.json = provider_class(app)
+    return app.json
@@ -0,0 +1,140 @@
+"""
+Lokal signaturverifiering av Azure AD-tokens mot tenantens publicerade nycklar (JWKS)
+"""
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+try:
+    import jwt
+except ImportError:  # PyJWT[crypto] krävs bara när AUTH_VALIDATION_MODE=jwks
+    jwt = None
+
+logger = logging.getLogger(__name__)
+
+
+class JwksKeyStore:
+    """Cachade signeringsnycklar med bakgrundsuppdatering.
+
+    Nycklar läses från jwks_url (via http_session) eller från en lokal
+    JWKS-fil för helt offline tester. Ett okänt kid tvingar fram en
+    omedelbar uppdatering (nyckelrotation), högst var min_refresh_interval.
+    """
+
+    def __init__(self, jwks_url: Optional[str] = None, jwks_file: Optional[str] = None,
+                 http_session=None, refresh_interval: float = 3600.0,
+                 min_refresh_interval: float = 60.0, timeout: float = 5.0):
+        if jwt is None:
+            raise RuntimeError('PyJWT[crypto] must be installed for JWKS validation')
+        if not jwks_url and not jwks_file:
+            raise RuntimeError('jwks_url or jwks_file must be set')
+        self.jwks_url = jwks_url
+        self.jwks_file = jwks_file
+        self.http_session = http_session
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.keys: Dict[str, object] = {}
+        self.last_refresh = 0.0
+        self.last_attempt = 0.0
+        self.lock = threading.Lock()
+        # En uppdatering i taget från request-trådar; övriga väntar på den
+        self.refresh_lock = threading.Lock()
+        self.thread = None
+
+    def _load(self) -> Dict:
+        if self.jwks_file:
+            with open(self.jwks_file, encoding='utf-8') as fh:
+                return json.load(fh)
+        response = self.http_session.get(self.jwks_url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self) -> bool:
+        try:
+            data = self._load()
+        except Exception as e:
+            logger.error('Failed to load signing keys: %s', e)
+            return False
+        keys = {}
+        for jwk in data.get('keys') or []:
+            kid = jwk.get('kid')
+            if not kid or jwk.get('kty') != 'RSA' or jwk.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[kid] = jwt.PyJWK(jwk, algorithm='RS256').key
+            except Exception as e:
+                logger.warning('Skipping unusable signing key %s: %s', kid, e)
+        with self.lock:
+            # Behåll gamla nycklar om källan tillfälligt returnerar en tom lista
+            if keys:
+                self.keys = keys
+            self.last_refresh = time.time()
+        return bool(keys)
+
+    def get_key(self, kid: str):
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        # Okänt kid: nycklarna kan ha roterats sedan senaste hämtningen
+        if self._stale():
+            with self.refresh_lock:
+                # Kontrollera igen: en annan tråd kan just ha uppdaterat
+                if self._stale():
+                    self.last_attempt = time.time()
+                    self.refresh()
+        return self.keys.get(kid)
+
+    def _stale(self) -> bool:
+        # Även misslyckade försök räknas, så att en nere nyckeltjänst inte hamras
+        return time.time() - max(self.last_refresh, self.last_attempt) >= self.min_refresh_interval
+
+    def start_background_refresh(self) -> None:
+        if self.thread is not None:
+            return
+        self.refresh()
+
+        def run():
+            while True:
+                time.sleep(self.refresh_interval)
+                self.refresh()
+
+        self.thread = threading.Thread(target=run, name='jwks-refresh', daemon=True)
+        self.thread.start()
+
+
+def verify_signature(token: str, key_store: JwksKeyStore) -> Optional[Dict]:
+    """Verifiera signatur, exp och nbf. Returnerar claims eller None.
+
+    Audience, tenant och issuer kontrolleras av anroparen.
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError:
+        logger.warning('Token har ogiltig header')
+        return None
+    if header.get('alg') != 'RS256':
+        logger.warning('Unexpected token algorithm: %s', header.get('alg'))
+        return None
+    if 'nonce' in header:
+        # Graph-accesstokens signeras över ett hashat nonce och kan inte verifieras lokalt
+        logger.warning('Token är en Graph-accesstoken och kan inte verifieras lokalt')
+        return None
+    key = key_store.get_key(header.get('kid'))
+    if key is None:
+        logger.warning('Okänd signeringsnyckel: %s', header.get('kid'))
+        return None
+    try:
+        return jwt.decode(
+            token, key, algorithms=['RS256'],
+            options={'verify_aud': False, 'verify_iss': False, 'require': ['exp']},
+        )
+    except jwt.ExpiredSignatureError:
+        logger.warning('Token har utgått')
+    except jwt.ImmatureSignatureError:
+        logger.warning('Token inte giltig ännu (nbf)')
+    except jwt.PyJWTError as e:
+        logger.warning('Token signature verification failed: %s', e)
+    return None
@@ -0,0 +1,206 @@
+"""
+Loggning via kö, som JSON med request-id
+
+Request-tråden lägger bara posten i en kö; en bakgrundstråd (QueueListener)
+formaterar meddelandet (%-argumenten), tracebacks och JSON och skriver till
+stderr. Logga därför med %-stil, logger.info('... %s', värde), och inte
+f-strängar, så att formateringen sker utanför requesten och inte alls för
+poster som filtreras bort.
+
+Lyckade poster i stor volym loggas med log_sampled(logger, kategori, ...)
+och samplas per kategori enligt LOG_SAMPLING (t.ex. auth=0.01,visits=1)
+innan posten ens skapas. Varningar och fel samplas aldrig, och när kön är
+full skrivs de direkt i stället för att tappas.
+
+Varje request får ett id från X-Request-ID (sätts av ingressen i Azure
+Container Apps) eller ett nytt, som följer med i loggposterna och skickas
+tillbaka i svarets X-Request-ID.
+"""
+import os
+import re
+import json
+import queue
+import atexit
+import random
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').strip().lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Andel lyckade poster som skrivs per kategori; saknad kategori skrivs alltid
+DEFAULT_SAMPLING = {'auth': 0.01}
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'
+
+_request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+_handler: Optional['LogQueueHandler'] = None
+_listener: Optional[QueueListener] = None
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """'auth=0.01,visits=0.5' -> {'auth': 0.01, 'visits': 0.5} ovanpå standardvärdena."""
+    sampling = dict(DEFAULT_SAMPLING)
+    for item in (value or '').split(','):
+        name, _, rate = item.partition('=')
+        if not name.strip():
+            continue
+        try:
+            sampling[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logger.warning('Ignoring invalid LOG_SAMPLING entry %r', item)
+    return sampling
+
+
+_sampling = parse_sampling(os.getenv('LOG_SAMPLING', ''))
+
+
+def log_sampled(log: logging.Logger, category: str, msg: str, *args) -> None:
+    """log.info(msg, *args) för andelen LOG_SAMPLING[category] av anropen."""
+    rate = _sampling.get(category, 1.0)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    if log.isEnabledFor(logging.INFO):
+        extra = {'category': category}
+        if rate < 1.0:
+            extra['sample_rate'] = rate
+        log.info(msg, *args, extra=extra, stacklevel=2)
+
+
+class RequestIdFilter(logging.Filter):
+    """Sätter request_id på posten (körs i request-tråden)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = _request_id.get()
+        if request_id is not None:
+            record.request_id = request_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """En JSON-rad per post: ts, level, logger, msg, request_id, category, exc."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key in ('request_id', 'category', 'sample_rate'):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """QueueHandler som lämnar all formatering åt lyssnartråden.
+
+    Är kön full tappas info/debug (räknas och rapporteras senare) medan
+    varningar och fel skrivs direkt med target i request-tråden.
+    """
+
+    def __init__(self, log_queue: queue.Queue, target: logging.Handler):
+        super().__init__(log_queue)
+        self.target = target
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Samma process: posten behöver inte göras picklebar, getMessage() körs i lyssnaren
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.target.handle(record)
+            else:
+                self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.target.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'Log queue was full – dropped %d records', 'args': (dropped,),
+            }))
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Ersätter basicConfig: rotloggern skriver via kön. Gör inget om loggning redan är konfigurerad."""
+    global _handler
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    stream = logging.StreamHandler()
+    if fmt == 'text':
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT, defaults={'request_id': '-'}))
+    else:
+        stream.setFormatter(JsonFormatter())
+    _handler = LogQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE), stream)
+    _handler.addFilter(RequestIdFilter())
+    root.addHandler(_handler)
+    root.setLevel(level)
+    _start_listener()
+    atexit.register(stop_logging)
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = QueueListener(_handler.queue, _handler.target, respect_handler_level=True)
+    _listener.start()
+
+
+def restart_logging_after_fork() -> None:
+    """Ny kö och lyssnartråd i en worker (tråden överlever inte fork)."""
+    if _handler is None:
+        return
+    # Förälderns kö kan ha låsts mitt i ett anrop; dess poster skrivs av föräldern
+    _handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _start_listener()
+
+
+def stop_logging() -> None:
+    """Skriv ut kvarvarande poster och stoppa lyssnartråden."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def init_request_logging(app) -> None:
+    """Request-id per request, i loggposterna och i svarets X-Request-ID."""
+
+    @app.before_request
+    def _set_request_id():
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = os.urandom(8).hex()
+        _request_id.set(request_id)
+
+    @app.after_request
+    def _request_id_header(response):
+        request_id = _request_id.get()
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _clear_request_id(exc):
+        _request_id.set(None)
@@ -0,0 +1,187 @@
+"""
+Delade lagringar för rate limitern: mellan workers på samma värd (delat minne)
+och mellan repliker (Redis-kompatibel nätverkstjänst)
+"""
+import os
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import tempfile
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:  # Endast Linux/macOS har fcntl; delat minne kräver det
+    fcntl = None
+
+try:
+    import redis
+except ImportError:  # redis krävs bara när RATE_LIMIT_STORE=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# nyckelhash, fönsterindex, föregående antal, aktuellt antal
+_SLOT = struct.Struct('<QqII')
+
+
+def _sliding_estimate(prev_count, curr_count, now, index, window_seconds):
+    elapsed = (now - index * window_seconds) / window_seconds
+    return prev_count * (1.0 - elapsed) + curr_count
+
+
+class SharedMemoryRateLimiter:
+    """Sliding window counter i en mmap-fil som delas av alla workers på värden.
+
+    Tabellen består av hinkar om probe platser. En nyckel hashas till en hink;
+    hinken låses med ett fcntl-intervallås (mellan processer) plus ett
+    trådlås (inom processen, eftersom fcntl-lås ägs per process). Blir en
+    hink full återanvänds platsen med äldst fönster.
+    """
+
+    def __init__(self, path=None, slots=8192, probe=8):
+        if fcntl is None:
+            raise RuntimeError('Shared-memory rate limiting requires fcntl')
+        if path is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(base, 'sabo_rate_limit')
+        self.probe = probe
+        self.buckets = max(1, slots // probe)
+        size = self.buckets * probe * _SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.mm = mmap.mmap(self.fd, size)
+        self.thread_locks = [Lock() for _ in range(64)]
+
+    @staticmethod
+    def _hash(key, window_seconds):
+        digest = hashlib.blake2b(f'{window_seconds}:{key}'.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def is_allowed(self, key, max_requests, window_seconds, cost=1):
+        now = time.time()
+        index = int(now // window_seconds)
+        h = self._hash(key, window_seconds)
+        bucket = h % self.buckets
+        base = bucket * self.probe * _SLOT.size
+
+        with self.thread_locks[bucket % len(self.thread_locks)]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, bucket)
+            try:
+                target = None
+                oldest = None
+                for i in range(self.probe):
+                    offset = base + i * _SLOT.size
+                    slot_hash, slot_index, prev_count, curr_count = _SLOT.unpack_from(self.mm, offset)
+                    if slot_hash == h:
+                        target = (offset, slot_index, prev_count, curr_count)
+                        break
+                    if slot_hash == 0 or slot_index < index - 1:
+                        if target is None:
+                            target = (offset, None, 0, 0)
+                    elif oldest is None or slot_index < oldest[1]:
+                        oldest = (offset, slot_index)
+                if target is None:
+                    target = (oldest[0], None, 0, 0)
+
+                offset, slot_index, prev_count, curr_count = target
+                if slot_index is None:
+                    slot_index, prev_count, curr_count = index, 0, 0
+                elif slot_index != index:
+                    prev_count = curr_count if slot_index == index - 1 else 0
+                    curr_count = 0
+                    slot_index = index
+
+                if _sliding_estimate(prev_count, curr_count, now, index, window_seconds) + cost > max_requests:
+                    _SLOT.pack_into(self.mm, offset, h, slot_index, prev_count, curr_count)
+                    return False
+                _SLOT.pack_into(self.mm, offset, h, slot_index, prev_count, curr_count + cost)
+                return True
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, bucket)
+
+    def cleanup(self):
+        """Inaktuella platser återanvänds direkt – inget att rensa."""
+
+    def start_sweeper(self):
+        """Tabellen har fast storlek och behöver ingen bakgrundsrensning."""
+
+    def stats(self):
+        slots = self.buckets * self.probe
+        used = sum(1 for slot_hash, _, _, _ in _SLOT.iter_unpack(self.mm) if slot_hash)
+        return {'store': 'shm', 'tracked_keys': used, 'max_keys': slots, 'approx_bytes': slots * _SLOT.size}
+
+
+class RedisRateLimiter:
+    """Sliding window counter i en Redis-kompatibel tjänst, delad mellan repliker.
+
+    Varje request kostar en rundresa: ett Lua-skript (EVALSHA) läser båda
+    fönstren och ökar räknaren bara om requesten tillåts, så nekade requests
+    blåser aldrig upp räknaren för andra workers. Om tjänsten inte svarar
+    används den lokala fallback-limitern under cooldown sekunder.
+    """
+
+    # KEYS: aktuellt, föregående fönster. ARGV: kostnad, max, vikt för föregående, ttl
+    CHECK_SCRIPT = """
+local curr = tonumber(redis.call('GET', KEYS[1]) or '0')
+local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+local cost = tonumber(ARGV[1])
+if prev * tonumber(ARGV[3]) + curr + cost > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('INCRBY', KEYS[1], cost)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+    def __init__(self, url, fallback, timeout=0.1, cooldown=5.0, prefix='sabo:rl'):
+        if redis is None:
+            raise RuntimeError('redis must be installed for RATE_LIMIT_STORE=redis')
+        self.client = redis.Redis.from_url(
+            url, socket_timeout=timeout, socket_connect_timeout=timeout, health_check_interval=30
+        )
+        self.fallback = fallback
+        self.cooldown = cooldown
+        self.prefix = prefix
+        self.unavailable_until = 0.0
+        # EVALSHA, med SCRIPT LOAD automatiskt om skriptet saknas i tjänsten
+        self.check = self.client.register_script(self.CHECK_SCRIPT)
+
+    def is_allowed(self, key, max_requests, window_seconds, cost=1):
+        now = time.time()
+        if now < self.unavailable_until:
+            return self.fallback.is_allowed(key, max_requests, window_seconds, cost)
+
+        index = int(now // window_seconds)
+        # {key} håller båda fönstren i samma slot i ett Redis Cluster
+        current = f'{self.prefix}:{window_seconds}:{{{key}}}:{index}'
+        previous = f'{self.prefix}:{window_seconds}:{{{key}}}:{index - 1}'
+        # Samma uppskattning som _sliding_estimate, med vikten räknad här
+        prev_weight = 1.0 - (now - index * window_seconds) / window_seconds
+        try:
+            allowed = self.check(
+                keys=[current, previous],
+                args=[cost, max_requests, repr(prev_weight), window_seconds * 2],
+            )
+            return bool(allowed)
+        except redis.RedisError as e:
+            self.unavailable_until = now + self.cooldown
+            logger.warning('Rate limit store unavailable, using local limits for %.0fs: %s', self.cooldown, e)
+            return self.fallback.is_allowed(key, max_requests, window_seconds, cost)
+
+    def cleanup(self):
+        """Nycklar löper ut av sig själva (EXPIRE)."""
+        self.fallback.cleanup()
+
+    def start_sweeper(self):
+        self.fallback.start_sweeper()
+
+    def stats(self):
+        return {
+            'store': 'redis',
+            'degraded': time.time() < self.unavailable_until,
+            'fallback': self.fallback.stats(),
+        }
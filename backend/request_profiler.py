@@ -0,0 +1,261 @@
+"""
+Sampling-profilering av enskilda requests, påslagen vid behov av superadmin
+
+När profileringen är på väljs en andel av anropen (sample_rate) under en
+sökvägsprefix. En bakgrundstråd läser då request-trådens stack var
+PROFILE_INTERVAL_MS millisekund, och profiler för anrop som tog minst
+threshold_ms sparas som "folded stacks" (en rad per stack med antal
+sampel, läses av speedscope.app och flamegraph.pl) i en ringbuffert på
+disk med högst PROFILE_MAX_FILES profiler.
+
+Inställningen ligger i en fil i PROFILE_DIR som alla workers på värden
+läser om högst en gång per sekund, och stängs av automatiskt när tiden
+gått ut. Avstängd kostar profileringen en tidsjämförelse per request.
+Stackarna hämtas per tråd, så med GUNICORN_PROFILE=gevent (greenlets)
+blir profilerna tomma.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = (os.getenv('PROFILE_DIR') or '').strip() or os.path.join(tempfile.gettempdir(), 'sabo_profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+# Längsta tid profileringen kan vara på innan den stängs av
+PROFILE_MAX_MINUTES = 120
+# Hur ofta workers läser om inställningsfilen
+CONFIG_CHECK_INTERVAL = 1.0
+MAX_STACK_DEPTH = 128
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{12}-[0-9]+-[0-9]+$')
+DEFAULT_CONFIG = {'enabled': False, 'sample_rate': 0.1, 'threshold_ms': 0, 'path_prefix': '/api/', 'until': 0}
+
+
+class StackSampler:
+    """Bakgrundstråd som räknar stackar för registrerade trådar.
+
+    Tråden startas när första tråden registreras och avslutas när ingen
+    request profileras längre.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active: Dict[int, Counter] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.labels: Dict[object, str] = {}
+
+    def start(self, ident: int) -> None:
+        with self.lock:
+            self.active[ident] = Counter()
+            # Efter fork finns förälderns tråd inte i den här processen
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self.thread.start()
+
+    def stop(self, ident: int) -> Counter:
+        with self.lock:
+            return self.active.pop(ident, Counter())
+
+    def _label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = f'{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            self.labels[code] = label
+        return label
+
+    def _stack(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                frames = sys._current_frames()
+                for ident, counter in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counter[self._stack(frame)] += 1
+
+
+class RequestProfiler:
+    """Flask-krokar som profilerar utvalda requests enligt inställningen i directory."""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES,
+                 interval_ms: float = PROFILE_INTERVAL_MS):
+        self.directory = directory
+        self.config_path = os.path.join(directory, 'config.json')
+        self.max_files = max_files
+        self.interval_ms = interval_ms
+        self.sampler = StackSampler(interval_ms / 1000.0)
+        self.config = dict(DEFAULT_CONFIG)
+        self.enabled = False
+        self._next_check = 0.0
+        self._config_stamp = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    # ---- Inställning ----
+    def _refresh(self, now: float) -> None:
+        self._next_check = now + CONFIG_CHECK_INTERVAL
+        try:
+            stat = os.stat(self.config_path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp != self._config_stamp:
+                with open(self.config_path, encoding='utf-8') as fh:
+                    self.config = {**DEFAULT_CONFIG, **json.load(fh)}
+                self._config_stamp = stamp
+        except (OSError, ValueError):
+            self.config = dict(DEFAULT_CONFIG)
+            self._config_stamp = None
+        self.enabled = bool(self.config['enabled']) and self.config['until'] > time.time()
+
+    def get_config(self) -> Dict:
+        self._refresh(time.monotonic())
+        config = dict(self.config)
+        config['enabled'] = self.enabled
+        config['until'] = datetime.utcfromtimestamp(config['until']).isoformat() if self.enabled else None
+        return config
+
+    def set_config(self, enabled: bool, sample_rate: float, threshold_ms: float, path_prefix: str,
+                   minutes: float) -> Dict:
+        """Spara inställningen för alla workers på värden."""
+        config = {
+            'enabled': enabled, 'sample_rate': sample_rate, 'threshold_ms': threshold_ms,
+            'path_prefix': path_prefix, 'until': time.time() + minutes * 60 if enabled else 0,
+        }
+        tmp = f'{self.config_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(config, fh)
+        os.replace(tmp, self.config_path)
+        return self.get_config()
+
+    # ---- Krokar ----
+    def _before_request(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._refresh(now)
+        if not self.enabled:
+            return
+        config = self.config
+        if not request.path.startswith(config['path_prefix']) or random.random() >= config['sample_rate']:
+            return
+        ident = threading.get_ident()
+        self.sampler.start(ident)
+        g._profile = (ident, time.perf_counter(), datetime.utcnow())
+
+    def _after_request(self, response):
+        if self.sampler.active and '_profile' in g:
+            g._profile_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        # Ingen request profileras: slå inte upp g
+        if not self.sampler.active:
+            return
+        state = g.pop('_profile', None)
+        if state is None:
+            return
+        ident, started, started_at = state
+        stacks = self.sampler.stop(ident)
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.config['threshold_ms']:
+            return
+        meta = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': g.pop('_profile_status', 500 if exc else None),
+            'duration_ms': round(duration_ms, 1),
+            'started_at': started_at.isoformat(),
+            'pid': os.getpid(),
+            'interval_ms': self.interval_ms,
+            'samples': sum(stacks.values()),
+        }
+        # Skriv utanför request-tråden så att svaret inte väntar på disken
+        threading.Thread(target=self._save, args=(started_at, meta, stacks), daemon=True).start()
+
+    # ---- Ringbuffert ----
+    def _save(self, started_at: datetime, meta: Dict, stacks: Counter) -> None:
+        with self._lock:
+            self._seq += 1
+            profile_id = f"{started_at.strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}-{self._seq}"
+        meta['id'] = profile_id
+        base = os.path.join(self.directory, profile_id)
+        try:
+            with open(f'{base}.folded', 'w', encoding='utf-8') as fh:
+                for stack, count in stacks.most_common():
+                    fh.write(f'{stack} {count}\n')
+            with open(f'{base}.json', 'w', encoding='utf-8') as fh:
+                json.dump(meta, fh)
+            self._prune()
+        except OSError as e:
+            logger.warning('Could not save profile %s: %s', profile_id, e)
+
+    def _profile_ids(self) -> List[str]:
+        ids = [name[:-5] for name in os.listdir(self.directory)
+               if name.endswith('.json') and PROFILE_ID_PATTERN.match(name[:-5])]
+        ids.sort()
+        return ids
+
+    def _prune(self) -> None:
+        ids = self._profile_ids()
+        for profile_id in ids[:max(0, len(ids) - self.max_files)]:
+            for suffix in ('.json', '.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except OSError:
+                    pass
+
+    def list_profiles(self) -> List[Dict]:
+        """Sparade profiler, nyast först."""
+        profiles = []
+        for profile_id in reversed(self._profile_ids()):
+            try:
+                with open(os.path.join(self.directory, f'{profile_id}.json'), encoding='utf-8') as fh:
+                    profiles.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def profile_path(self, profile_id: str) -> Optional[str]:
+        """Sökväg till profilens folded stacks, eller None om id är ogiltigt eller saknas."""
+        if not PROFILE_ID_PATTERN.match(profile_id or ''):
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.folded')
+        return path if os.path.exists(path) else None
+
+
+def init_profiling(app) -> RequestProfiler:
+    """Registrera profileringskrokarna (avstängda tills superadmin slår på dem)."""
+    profiler = RequestProfiler()
+    profiler.init_app(app)
+    return profiler
@@ -0,0 +1,107 @@
+"""
+Kortlivad cache för adminroller med riktad invalidering
+"""
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+MAX_ENTRIES = 10000
+
+
+class RoleCache:
+    """Cache oid -> admin-flagga med TTL.
+
+    Invalidering skriver en markörfil per oid i marker_dir. Alla workers på
+    samma värd läser markörernas mtime (högst en katalogläsning per
+    check_interval och process) och jämför med när posten cachades, så en
+    rolländring syns i hela containern inom check_interval sekunder. Andra
+    repliker ser ändringen senast efter ttl sekunder. Markörer äldre än ttl
+    kan inte längre påverka någon post och rensas vid nästa invalidering.
+    """
+
+    def __init__(self, ttl: float = 30.0, marker_dir: Optional[str] = None, check_interval: float = 1.0):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.marker_dir = marker_dir or os.path.join(tempfile.gettempdir(), 'sabo_role_cache')
+        os.makedirs(self.marker_dir, exist_ok=True)
+        self.entries: Dict[str, Tuple[bool, float]] = {}
+        self.lock = threading.Lock()
+        # Markörnamn -> mtime från senaste katalogläsningen
+        self.markers: Dict[str, float] = {}
+        self.markers_read_at: Optional[float] = None
+
+    @staticmethod
+    def _marker_name(oid: str) -> str:
+        return hashlib.sha256(oid.encode('utf-8')).hexdigest()[:32]
+
+    def _read_markers(self) -> Dict[str, float]:
+        markers = {}
+        try:
+            with os.scandir(self.marker_dir) as it:
+                for item in it:
+                    try:
+                        markers[item.name] = item.stat().st_mtime
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return markers
+
+    def _invalidated_at(self, oid: str) -> float:
+        now = time.monotonic()
+        if self.markers_read_at is None or now - self.markers_read_at >= self.check_interval:
+            with self.lock:
+                if self.markers_read_at is None or now - self.markers_read_at >= self.check_interval:
+                    self.markers = self._read_markers()
+                    self.markers_read_at = now
+        return self.markers.get(self._marker_name(oid), 0.0)
+
+    def get(self, oid: str) -> Optional[bool]:
+        if not oid or self.ttl <= 0:
+            return None
+        entry = self.entries.get(oid)
+        if entry is None:
+            return None
+        is_admin, cached_at = entry
+        if time.time() - cached_at > self.ttl or self._invalidated_at(oid) >= cached_at:
+            with self.lock:
+                self.entries.pop(oid, None)
+            return None
+        return is_admin
+
+    def put(self, oid: str, is_admin: bool, fetched_at: Optional[float] = None) -> None:
+        """Cacha rollen. fetched_at ska vara tiden innan rollen lästes, så att
+        en invalidering under läsningen inte göms av ett gammalt värde."""
+        if not oid or self.ttl <= 0:
+            return
+        with self.lock:
+            if len(self.entries) >= MAX_ENTRIES:
+                self.entries.clear()
+            self.entries[oid] = (bool(is_admin), fetched_at if fetched_at is not None else time.time())
+
+    def invalidate(self, oid: str) -> None:
+        """Glöm rollen för oid i alla workers på värden."""
+        if not oid:
+            return
+        with self.lock:
+            self.entries.pop(oid, None)
+        marker = os.path.join(self.marker_dir, self._marker_name(oid))
+        with open(marker, 'a'):
+            pass
+        now = time.time()
+        os.utime(marker, (now, now))
+        # Egen process ser invalideringen direkt, utan att vänta på nästa läsning
+        self.markers[self._marker_name(oid)] = now
+        self._prune_markers(now)
+
+    def _prune_markers(self, now: float) -> None:
+        # En post cachad före now - ttl har redan gått ut, så äldre markörer gör ingen nytta
+        for name, mtime in self._read_markers().items():
+            if mtime < now - self.ttl:
+                try:
+                    os.remove(os.path.join(self.marker_dir, name))
+                except OSError:
+                    pass
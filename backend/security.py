@@ -1,13 +1,20 @@
 """
 Säkerhetsmodul för Traffpunk - innehåller rate limiting och säkerhetsheaders
 """
-import time
+import os
 import re
-from collections import defaultdict, deque
+import sys
+import time
+import logging
+from collections import OrderedDict
 from functools import wraps
-from flask import request, jsonify, make_response
-from threading import Lock
-from datetime import datetime
+from flask import request, jsonify, make_response, session
+from threading import Lock, Thread
+
+from rate_limit_stores import SharedMemoryRateLimiter, RedisRateLimiter
+from server_timing import timed
+
+logger = logging.getLogger(__name__)
 
 ALLOWED_GENDERS = {'men', 'women'}
 ALLOWED_VISIT_TYPES = {'group', 'individual'}
@@ -19,59 +26,226 @@ MAX_DEPARTMENTS_PER_HOME = 20
 
 # ========== RATE LIMITING ==========
 
-class SimpleRateLimiter:
-    def __init__(self):
-        self.requests = defaultdict(deque)
-        self.lock = Lock()
-    
-    def is_allowed(self, key, max_requests, window_seconds):
-        """Kontrollera om request är tillåten"""
+class SlidingWindowRateLimiter:
+    """Sliding window counter med konstant minne per nyckel.
+
+    Varje nyckel har bara räknare för aktuellt och föregående fönster;
+    antalet requests uppskattas som föregående * (andel kvar av fönstret)
+    + aktuellt. Nycklarna är uppdelade i shards med var sitt lås (lock
+    striping). Varje shard är LRU-ordnad och har ett tak, så minnet är
+    begränsat även när många IP-adresser skannar; utgångna nycklar rensas
+    stegvis av en bakgrundstråd (start_sweeper).
+    """
+
+    def __init__(self, stripes=64, max_keys=100000, sweep_interval=1.0, sweep_budget=0.002):
+        # Antal shards avrundas till en tvåpotens så att valet blir en bitmask
+        stripes = 1 << max(0, (stripes - 1).bit_length())
+        self.locks = [Lock() for _ in range(stripes)]
+        # (fönsterlängd, nyckel) -> [fönsterindex, föregående antal, aktuellt antal], äldst först
+        self.shards = [OrderedDict() for _ in range(stripes)]
+        self.mask = stripes - 1
+        self.max_keys = max_keys
+        self.shard_cap = max(1, max_keys // stripes)
+        self.sweep_interval = sweep_interval
+        self.sweep_budget = sweep_budget
+        self.evicted = 0
+        self.expired = 0
+        self.sweeper_pid = None
+
+    def is_allowed(self, key, max_requests, window_seconds, cost=1):
+        """Kontrollera om request är tillåten och dra cost från budgeten"""
         now = time.time()
-        cutoff = now - window_seconds
-        
-        with self.lock:
-            # Rensa gamla requests
-            while self.requests[key] and self.requests[key][0] < cutoff:
-                self.requests[key].popleft()
-            
-            # Kontrollera antal
-            if len(self.requests[key]) >= max_requests:
+        index = int(now // window_seconds)
+        stripe = hash(key) & self.mask
+        shard = self.shards[stripe]
+        slot = (window_seconds, key)
+
+        with self.locks[stripe]:
+            entry = shard.get(slot)
+            if entry is None:
+                if cost > max_requests:
+                    return False
+                if len(shard) >= self.shard_cap:
+                    # Taket nått: släpp den nyckel som använts minst nyligen
+                    shard.popitem(last=False)
+                    self.evicted += 1
+                shard[slot] = [index, 0, cost]
+                return True
+            shard.move_to_end(slot)
+            if entry[0] != index:
+                # Nytt fönster: aktuellt blir föregående (eller 0 om ett fönster hoppats över)
+                entry[1] = entry[2] if entry[0] == index - 1 else 0
+                entry[2] = 0
+                entry[0] = index
+
+            if entry[1]:
+                elapsed = (now - index * window_seconds) / window_seconds
+                if entry[1] * (1.0 - elapsed) + entry[2] + cost > max_requests:
+                    return False
+            elif entry[2] + cost > max_requests:
                 return False
-            
-            # Lägg till ny request
-            self.requests[key].append(now)
+
+            entry[2] += cost
             return True
-    
+
+    def _sweep_shard(self, stripe, now, deadline=None):
+        """Ta bort utgångna nycklar från shardens LRU-ände.
+
+        Nycklar som använts nyligen ligger sist, så svepet avbryts vid
+        första levande nyckel (eller när tidsbudgeten är slut)."""
+        shard = self.shards[stripe]
+        removed = 0
+        with self.locks[stripe]:
+            while shard:
+                (window_seconds, _), entry = next(iter(shard.items()))
+                if entry[0] >= int(now // window_seconds) - 1:
+                    break
+                shard.popitem(last=False)
+                removed += 1
+                if deadline is not None and removed % 64 == 0 and time.perf_counter() > deadline:
+                    break
+            self.expired += removed
+        return removed
+
     def cleanup(self):
-        """Rensa gamla entries (kör periodiskt)"""
-        cutoff = time.time() - 3600  # Behåll senaste timmen
-        
-        with self.lock:
-            keys_to_delete = []
-            for key, times in self.requests.items():
-                # Rensa gamla tider
-                while times and times[0] < cutoff:
-                    times.popleft()
-                
-                # Ta bort tomma keys
-                if not times:
-                    keys_to_delete.append(key)
-            
-            for key in keys_to_delete:
-                del self.requests[key]
+        """Rensa nycklar vars båda fönster har löpt ut i alla shards"""
+        now = time.time()
+        return sum(self._sweep_shard(stripe, now) for stripe in range(len(self.shards)))
+
+    def _sweep_forever(self):
+        while True:
+            # Ett uppvaknande per sweep_interval, även när det är tomt
+            time.sleep(self.sweep_interval)
+            now = time.time()
+            for stripe in range(len(self.shards)):
+                # Tidsbudget per shard så att varje lås hålls kort
+                self._sweep_shard(stripe, now, time.perf_counter() + self.sweep_budget)
+
+    def start_sweeper(self):
+        """Starta bakgrundsrensningen (en gång per process, även efter fork)"""
+        if self.sweeper_pid == os.getpid():
+            return
+        self.sweeper_pid = os.getpid()
+        Thread(target=self._sweep_forever, name='rate-limit-sweeper', daemon=True).start()
+
+    def stats(self):
+        """Mätvärden för minnesanvändningen"""
+        keys = sum(len(shard) for shard in self.shards)
+        return {
+            'store': 'memory',
+            'tracked_keys': keys,
+            'max_keys': self.max_keys,
+            'evicted_keys': self.evicted,
+            'expired_keys': self.expired,
+            # Ungefärligt: nyckeltupel, räknarlista och OrderedDict-länk per nyckel
+            'approx_bytes': sum(sys.getsizeof(shard) for shard in self.shards) + keys * _APPROX_ENTRY_BYTES,
+        }
+
+
+# Ungefärlig storlek per nyckel i SlidingWindowRateLimiter (IPv4-nyckel, tupel, lista, LRU-länk)
+_APPROX_ENTRY_BYTES = 250
+
+
+# Bakåtkompatibelt namn
+SimpleRateLimiter = SlidingWindowRateLimiter
+
+
+def create_rate_limiter():
+    """Välj lagring för rate limitern enligt RATE_LIMIT_STORE.
+
+    memory: per process (standard). shm: delat minne för alla workers på
+    värden. redis: delat mellan repliker, med lokala limits som reserv.
+    """
+    store = os.getenv('RATE_LIMIT_STORE', 'memory').strip().lower()
+    local = SlidingWindowRateLimiter(
+        max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000')),
+        sweep_interval=float(os.getenv('RATE_LIMIT_SWEEP_INTERVAL', '1.0')),
+    )
+    try:
+        if store == 'shm':
+            return SharedMemoryRateLimiter(
+                path=os.getenv('RATE_LIMIT_SHM_PATH') or None,
+                slots=int(os.getenv('RATE_LIMIT_SHM_SLOTS', '8192')),
+            )
+        if store == 'redis':
+            return RedisRateLimiter(
+                os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'),
+                fallback=local,
+                timeout=float(os.getenv('RATE_LIMIT_REDIS_TIMEOUT', '0.1')),
+            )
+    except Exception as e:
+        logger.error('Could not create %s rate limit store, using local limits: %s', store, e)
+    return local
+
 
 # Global instans
-rate_limiter = SimpleRateLimiter()
+rate_limiter = create_rate_limiter()
+
+# Budgetar: namn -> (max kostnad, fönster i sekunder). Räknas per inloggad
+# användare (oid) och annars per IP-adress.
+RATE_LIMIT_BUDGETS = {
+    'public': (1000, 60),   # Health och inloggning, ofta utan session
+    'api': (600, 60),       # Vanliga anrop från appen
+    'admin': (300, 60),     # Ändringar i äldreboenden, aktiviteter och roller
+}
+
+# Endpoint -> (budget, kostnad per request). Dyra anrop drar mer av budgeten.
+RATE_LIMITS = {
+    'health_check': ('public', 1),
+    'azure_config': ('public', 2),
+    'azure_user': ('public', 2),
+    'me': ('api', 1),
+    'get_homes': ('api', 1),
+    'get_activities': ('api', 1),
+    'get_companions': ('api', 1),
+    'get_visit': ('api', 2),
+    'register_visit': ('api', 2),
+    'update_visit': ('api', 5),
+    'delete_visit': ('api', 5),
+    'my_visits': ('api', 5),
+    'register_visits_batch': ('api', 10),
+    'get_statistics': ('api', 10),
+    'export_statistics': ('api', 20),
+    'import_visits': ('api', 60),
+    'add_home': ('admin', 3),
+    'add_department': ('admin', 3),
+    'update_department': ('admin', 3),
+    'delete_department': ('admin', 5),
+    'add_activity': ('admin', 3),
+    'rename_activity': ('admin', 5),
+    'delete_activity': ('admin', 5),
+    'add_companion': ('admin', 3),
+    'rename_companion': ('admin', 5),
+    'delete_companion': ('admin', 5),
+    'list_users': ('admin', 5),
+    'set_user_role': ('admin', 10),
+    'get_server_health': ('admin', 1),
+    'get_profiling': ('admin', 1),
+    'update_profiling': ('admin', 5),
+    'download_profile': ('admin', 2),
+}
+
+
+def rate_limit_key():
+    """Inloggad användares oid, annars IP-adress (efter ProxyFix)"""
+    oid = session.get('azure_user', {}).get('oid')
+    if oid and oid != 'unknown':
+        return f'user:{oid}'
+    return f'ip:{request.remote_addr or "unknown"}'
+
+
+def rate_limit(endpoint):
+    """Decorator för rate limiting enligt RATE_LIMITS[endpoint]"""
+    budget, cost = RATE_LIMITS[endpoint]
+    max_cost, window_seconds = RATE_LIMIT_BUDGETS[budget]
 
-def rate_limit(max_requests=60, window_seconds=60):
-    """Decorator för rate limiting"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Använd IP-adress efter ProxyFix (X-Forwarded-For hanteras i WSGI-lagret)
-            key = request.remote_addr or 'unknown'
-            
-            if not rate_limiter.is_allowed(key, max_requests, window_seconds):
+            with timed('ratelimit'):
+                key = f'{budget}:{rate_limit_key()}'
+                allowed = rate_limiter.is_allowed(key, max_cost, window_seconds, cost)
+            if not allowed:
                 return jsonify({
                     'error': 'För många förfrågningar. Vänta en stund och försök igen.'
                 }), 429
@@ -80,9 +254,9 @@ def rate_limit(max_requests=60, window_seconds=60):
         return decorated_function
     return decorator
 
-def rate_limit_auth(max_requests=100, window_seconds=300):
+def rate_limit_auth(endpoint='azure_user'):
     """Rate limiting för autentisering - generös för arbetsplatser"""
-    return rate_limit(max_requests, window_seconds)
+    return rate_limit(endpoint)
 
 # ========== SÄKERHETSHEADERS ==========
 
@@ -134,160 +308,12 @@ def init_security_headers(app):
 
 # ========== INPUT VALIDERING ==========
 
-def validate_home_id(home_id):
-    """Validera äldreboende-ID."""
-    if not home_id or not isinstance(home_id, str):
-        return False, "Äldreboende-ID saknas"
-    if not re.match(r'^[a-z0-9-]{1,50}$', home_id):
-        return False, "Ogiltigt format för äldreboende-ID"
-    return True, None
-
-def validate_date(date_str):
-    """Validera datumformat"""
-    if not date_str:
-        return False, "Datum saknas"
-    
-    try:
-        datetime.strptime(date_str, '%Y-%m-%d')
-        return True, None
-    except ValueError:
-        return False, "Ogiltigt datumformat (använd YYYY-MM-DD)"
-
-def validate_visit_type(visit_type):
-    if visit_type not in ALLOWED_VISIT_TYPES:
-        return False, f"Ogiltig typ. Måste vara en av: {', '.join(sorted(ALLOWED_VISIT_TYPES))}"
-    return True, None
-
-
-def validate_offer_status(status):
-    if status not in ALLOWED_OFFER_STATUS:
-        return False, f"Ogiltigt svar. Måste vara en av: {', '.join(sorted(ALLOWED_OFFER_STATUS))}"
-    return True, None
-
-
-def validate_name(value, field='fältet', max_length=100):
-    if not value or not isinstance(value, str):
-        return False, f"{field} saknas"
-    value = value.strip()
-    if not value:
-        return False, f"{field} får inte vara tomt"
-    if len(value) > max_length:
-        return False, f"{field} får högst innehålla {max_length} tecken"
-    if not re.match(r'^[a-zA-ZåäöÅÄÖ0-9\s\-\_]+$', value):
-        return False, f"{field} innehåller ogiltiga tecken"
-    return True, None
-
-
-def validate_gender_counts(gender_counts, visit_type, offer_status=None):
-    if not isinstance(gender_counts, dict):
-        return False, "Deltagarantal måste vara ett objekt"
-    total = 0
-    for gender in ALLOWED_GENDERS:
-        value = gender_counts.get(gender, 0)
-        if not isinstance(value, int) or value < 0 or value > MAX_PARTICIPANTS_PER_ENTRY:
-            return False, f"Ogiltigt värde för {gender} (0-{MAX_PARTICIPANTS_PER_ENTRY})"
-        total += value
-    # Tillåt 0 deltagare om besöket avböjdes
-    if offer_status != 'declined' and total <= 0:
-        return False, "Minst en deltagare måste anges"
-    if visit_type == 'individual' and offer_status != 'declined' and total != 1:
-        return False, "Enskild registrering måste avse exakt en person"
-    return True, None
-
-
-def validate_duration_minutes(value):
-    if value is None:
-        return False, "Varaktighet i minuter krävs"
-    if not isinstance(value, int):
-        return False, "Varaktighet måste anges i heltal"
-    if value < MIN_DURATION_MINUTES or value > MAX_DURATION_MINUTES:
-        return False, f"Varaktighet måste vara mellan {MIN_DURATION_MINUTES}-{MAX_DURATION_MINUTES} minuter"
-    return True, None
-
-
-def validate_satisfaction_entries(entries, total_participants):
-    if entries is None:
-        return True, None
-    if not isinstance(entries, list):
-        return False, "Nöjdhet måste vara en lista"
-    if len(entries) > total_participants:
-        return False, "Antalet nöjdhetsnoteringar får inte överstiga antalet deltagare"
-    for entry in entries:
-        if not isinstance(entry, dict):
-            return False, "Nöjdhetsposter måste vara objekt"
-        gender = entry.get('gender')
-        rating = entry.get('rating')
-        if gender not in ALLOWED_GENDERS:
-            return False, "Nöjdhet måste kopplas till man eller kvinna"
-        if not isinstance(rating, int) or rating < 1 or rating > 6:
-            return False, "Nöjdhet måste vara ett heltal mellan 1-6"
-    return True, None
-
-
-def validate_department(home_doc, department_id, existing_department_id=None):
-    if not department_id or not isinstance(department_id, str):
-        if existing_department_id and department_id == existing_department_id:
-            # Allow legacy department to pass through even if missing now
-            return True, None
-        return False, "Avdelning måste anges"
-    departments = (home_doc or {}).get('departments') or []
-    for dept in departments:
-        if dept.get('id') == department_id:
-            if dept.get('active', True):
-                return True, None
-            break
-    if existing_department_id and department_id == existing_department_id:
-        # Allow edits to legacy/removed departments
-        return True, None
-    return False, "Ogiltig avdelning"
-
 def validate_attendance_data(data, home_doc=None, existing_department_id=None):
-    """Validera utevistelse-data."""
-    errors = []
-
-    valid, error = validate_home_id(data.get('home_id'))
-    if not valid:
-        errors.append(error)
-
-    valid, error = validate_department(home_doc, data.get('department_id'), existing_department_id=existing_department_id)
-    if not valid:
-        errors.append(error)
-
-    valid, error = validate_date(data.get('date'))
-    if not valid:
-        errors.append(error)
-
-    valid, error = validate_visit_type(data.get('visit_type'))
-    if not valid:
-        errors.append(error)
-
-    valid, error = validate_offer_status(data.get('offer_status'))
-    if not valid:
-        errors.append(error)
-
-    valid_gc, gc_error = validate_gender_counts(data.get('gender_counts', {}), data.get('visit_type'), data.get('offer_status'))
-    if not valid_gc:
-        errors.append(gc_error)
-    total = 0
-    if valid_gc:
-        total = sum(int(data.get('gender_counts', {}).get(g, 0)) for g in ALLOWED_GENDERS)
-
-    if data.get('offer_status') == 'accepted':
-        valid, error = validate_name(data.get('activity_name'), field='Aktivitet')
-        if not valid:
-            errors.append(error)
-        valid, error = validate_name(data.get('companion_name'), field='Med vem')
-        if not valid:
-            errors.append(error)
-        valid, error = validate_duration_minutes(data.get('duration_minutes'))
-        if not valid:
-            errors.append(error)
-
-    valid, error = validate_satisfaction_entries(data.get('satisfaction_entries'), total)
-    if not valid:
-        errors.append(error)
-
-    return len(errors) == 0, errors
+    """Validera utevistelse-data. Reglerna finns i visit_validation.validate_visit."""
+    # Importeras här: visit_validation läser konstanterna ovan från den här modulen
+    from visit_validation import validate_visit
+    _, errors = validate_visit(data, home_doc, existing_department_id)
+    return not errors, errors
 
 def sanitize_string(value, max_length=100):
     """Sanitera sträng för säker lagring"""
@@ -0,0 +1,140 @@
+"""
+Server-Timing-header som delar upp API-anropens tid (auth, rate limit,
+Cosmos, validering, JSON) så att den syns direkt i webbläsarens devtools.
+
+Lagren mäter med timed(name) eller record(name, sekunder) och tiden läggs
+på pågående request via en ContextVar (ingen kostnad utanför requests,
+t.ex. i bakgrundstrådar). Cosmos-anropen mäts per HTTP-rundresa med
+hookarna cosmos_request_hook/cosmos_response_hook, inklusive RU.
+
+SERVER_TIMING=admin (standard) visar uppdelningen på admin-endpoints, där
+rollen redan kontrollerats, och annars bara total, all visar den för alla (utveckling, lasttester) och off
+stänger av headern.
+"""
+import os
+import logging
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, Optional
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'admin').strip().lower()
+SERVER_TIMING_MODES = ('admin', 'all', 'off')
+
+# Mätvärden i headerns ordning: namn -> beskrivning (ASCII, headern är latin-1)
+METRICS = (
+    ('auth', 'Session och roller'),
+    ('ratelimit', 'Rate limit'),
+    ('cosmos', 'Cosmos DB'),
+    ('validation', 'Validering'),
+    ('serialization', 'JSON'),
+)
+
+_current: ContextVar[Optional['RequestTimings']] = ContextVar('server_timing', default=None)
+
+
+class RequestTimings:
+    """Summerad tid och antal per mätvärde för en request."""
+
+    __slots__ = ('start', 'durations', 'counts', 'request_charge')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.request_charge = 0.0
+
+    def add(self, name: str, seconds: float, request_charge: float = 0.0) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.request_charge += request_charge
+
+    def header(self, detail: bool) -> str:
+        parts = []
+        if detail:
+            for name, description in METRICS:
+                if name not in self.durations:
+                    continue
+                if name == 'cosmos':
+                    description = f'{description} ({self.counts[name]} anrop, {self.request_charge:.1f} RU)'
+                parts.append(f'{name};dur={self.durations[name] * 1000:.1f};desc="{description}"')
+        parts.append(f'total;dur={(perf_counter() - self.start) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+class timed:
+    """with timed('validation'): ... lägger tiden på mätvärdet i pågående request."""
+
+    __slots__ = ('name', 'timings', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            self.timings.add(self.name, perf_counter() - self.start)
+        return False
+
+
+def record(name: str, seconds: float, request_charge: float = 0.0) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, request_charge)
+
+
+def cosmos_request_hook(pipeline_request) -> None:
+    """raw_request_hook för CosmosClient: starttid per HTTP-anrop."""
+    pipeline_request.context['server_timing_start'] = perf_counter()
+
+
+def cosmos_response_hook(pipeline_response) -> None:
+    """raw_response_hook för CosmosClient: tid och RU (x-ms-request-charge) per HTTP-anrop."""
+    timings = _current.get()
+    start = pipeline_response.context.get('server_timing_start')
+    if timings is None or start is None:
+        return
+    try:
+        charge = float(pipeline_response.http_response.headers.get('x-ms-request-charge') or 0)
+    except (TypeError, ValueError):
+        charge = 0.0
+    timings.add('cosmos', perf_counter() - start, charge)
+
+
+def init_server_timing(app, show_detail: Callable[[], bool], mode: Optional[str] = None) -> None:
+    """Mät alla requests och sätt Server-Timing på /api/-svar.
+
+    show_detail() avgör med mode=admin om uppdelningen visas. Den körs för
+    varje /api/-svar och får inte slå upp roller (se admin_decided). Registreras
+    före övriga after_request-krokar så att total även täcker dem.
+    """
+    mode = mode or SERVER_TIMING
+    if mode not in SERVER_TIMING_MODES:
+        logger.warning('Unknown SERVER_TIMING %r – using admin', mode)
+        mode = 'admin'
+    if mode == 'off':
+        return
+
+    @app.before_request
+    def _start_timings():
+        _current.set(RequestTimings())
+
+    @app.after_request
+    def _server_timing_header(response):
+        timings = _current.get()
+        if timings is not None and request.path.startswith('/api/'):
+            response.headers['Server-Timing'] = timings.header(mode == 'all' or show_detail())
+        return response
+
+    @app.teardown_request
+    def _stop_timings(exc):
+        # Tråden återanvänds för nästa request
+        _current.set(None)
@@ -0,0 +1,559 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from uuid import uuid4
+from typing import Optional, List, Dict, Iterator, Tuple
+from datetime import datetime
+
+from storage import (
+    MAX_DEPARTMENTS_PER_HOME, MAX_LOGIN_SEEN, VISIT_BATCH_LIMIT, ConflictError, StorageBackend,
+    _activity_id, _iso_now, _parse_iso, _slugify,
+)
+
+# Visit fields copied to their own columns so that filters can use indexes.
+# The full document is kept as JSON in the doc column.
+VISIT_COLUMNS = (
+    'home_id', 'traffpunkt_id', 'date', 'registered_by_oid', 'registered_by', 'registered_at',
+    'department_id', 'activity_id', 'activity', 'companion_id', 'offer_status', 'visit_type',
+)
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS visits (
+    id TEXT PRIMARY KEY,
+    {', '.join(f'{c} TEXT' for c in VISIT_COLUMNS)},
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_home_date ON visits (home_id, date);
+CREATE INDEX IF NOT EXISTS visits_date ON visits (date);
+CREATE INDEX IF NOT EXISTS visits_oid_date ON visits (registered_by_oid, date);
+CREATE INDEX IF NOT EXISTS visits_email_date ON visits (registered_by, date);
+CREATE INDEX IF NOT EXISTS visits_activity_id ON visits (activity_id);
+CREATE INDEX IF NOT EXISTS visits_activity ON visits (activity);
+CREATE TABLE IF NOT EXISTS homes (id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS activities (id TEXT PRIMARY KEY, name TEXT, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS activities_name ON activities (name);
+CREATE TABLE IF NOT EXISTS companions (id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS visit_audit (id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS admin_audit (id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+'''
+
+# Statistics filter -> indexed column
+_STATISTICS_FILTERS = (
+    ('home_id', 'home_id = ?'),
+    ('date_from', 'date >= ?'),
+    ('date_to', 'date <= ?'),
+    ('department_id', 'department_id = ?'),
+    ('activity_id', 'activity_id = ?'),
+    ('companion_id', 'companion_id = ?'),
+    ('offer_status', 'offer_status = ?'),
+    ('visit_type', 'visit_type = ?'),
+)
+
+
+def _dumps(doc: Dict) -> str:
+    return json.dumps(doc, ensure_ascii=False, separators=(',', ':'))
+
+
+def _text(value) -> Optional[str]:
+    # Cosmos only matches a string parameter against string values
+    return value if isinstance(value, str) else None
+
+
+def _visit_row(doc: Dict) -> tuple:
+    return (doc['id'],) + tuple(_text(doc.get(c)) for c in VISIT_COLUMNS) + (_dumps(doc),)
+
+
+_INSERT_VISIT = f"INSERT INTO visits (id, {', '.join(VISIT_COLUMNS)}, doc) VALUES ({', '.join('?' * (len(VISIT_COLUMNS) + 2))})"
+_REPLACE_VISIT = 'INSERT OR REPLACE' + _INSERT_VISIT[len('INSERT'):]
+
+
+class SqliteStorage(StorageBackend):
+    """Storage in a local SQLite database (WAL mode).
+
+    For small installations and load tests without Cosmos. Each thread gets
+    its own connection. Read-modify-write operations run in BEGIN IMMEDIATE
+    transactions, so several gunicorn workers can share the file.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.audit_sink = None
+        # oid -> (email, display_name, last_login_at) of logins recorded by this process
+        self._login_seen: Dict[str, tuple] = {}
+        self.connect(ensure=True)
+
+    def connect(self, ensure: bool = True) -> None:
+        """Drop connections inherited from the parent process; ensure creates the schema."""
+        self._local = threading.local()
+        if ensure:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _read_doc(self, table: str, doc_id: Optional[str], conn=None) -> Optional[Dict]:
+        if not doc_id:
+            return None
+        row = (conn or self._conn()).execute(f'SELECT doc FROM {table} WHERE id = ?', (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _all_docs(self, table: str, conn=None) -> List[Dict]:
+        return [json.loads(row[0]) for row in (conn or self._conn()).execute(f'SELECT doc FROM {table}')]
+
+    @staticmethod
+    def _put(conn, table: str, doc: Dict) -> None:
+        conn.execute(f'INSERT OR REPLACE INTO {table} (id, doc) VALUES (?, ?)', (doc['id'], _dumps(doc)))
+
+    # ---- Homes ----
+    def get_all_homes(self) -> List[Dict]:
+        items = [d for d in self._all_docs('homes') if d.get('active') is True]
+        for item in items:
+            departments = item.get('departments') or []
+            departments.sort(key=lambda x: (x.get('name') or '').lower())
+            item['departments'] = departments
+        items.sort(key=lambda x: (x.get('name') or '').lower())
+        return items
+
+    def get_home(self, home_id: str, conn=None) -> Optional[Dict]:
+        doc = self._read_doc('homes', home_id, conn)
+        if doc and doc.get('departments'):
+            doc['departments'].sort(key=lambda x: (x.get('name') or '').lower())
+        return doc
+
+    def add_home(self, data: Dict) -> Optional[str]:
+        name = (data.get('name') or '').strip()
+        if not name:
+            return None
+        home_id = _slugify(name)
+        if not home_id:
+            return None
+        doc = {
+            'id': home_id,
+            'name': name,
+            'active': bool(data.get('active', True)),
+            'address': data.get('address', ''),
+            'description': data.get('description', ''),
+            'created_at': _iso_now(),
+            'departments': data.get('departments') or [],
+        }
+        with self._write() as conn:
+            inserted = conn.execute('INSERT OR IGNORE INTO homes (id, doc) VALUES (?, ?)', (home_id, _dumps(doc)))
+        return home_id if inserted.rowcount else None
+
+    # ---- Departments ----
+    def add_department(self, home_id: str, name: str) -> Optional[Dict]:
+        with self._write() as conn:
+            doc = self.get_home(home_id, conn)
+            if not doc:
+                raise ValueError('home_not_found')
+            departments_value = doc.get('departments')
+            departments = departments_value if isinstance(departments_value, list) else []
+            if len(departments) >= MAX_DEPARTMENTS_PER_HOME:
+                raise ValueError('max_departments')
+            slug = _slugify(name)
+            if not slug:
+                raise ValueError('invalid_department')
+            dept_id = f"{home_id}__{slug}"
+            if any(dept.get('id') == dept_id for dept in departments):
+                return None
+            new_dept = {
+                'id': dept_id,
+                'slug': slug,
+                'name': name,
+                'active': True,
+                'created_at': _iso_now(),
+            }
+            departments.append(new_dept)
+            doc['departments'] = departments
+            self._put(conn, 'homes', doc)
+        return new_dept
+
+    def update_department(self, home_id: str, department_id: str, *, name: Optional[str] = None, active: Optional[bool] = None) -> bool:
+        with self._write() as conn:
+            doc = self.get_home(home_id, conn)
+            if not doc:
+                return False
+            for dept in doc.get('departments') or []:
+                if dept.get('id') == department_id:
+                    if name:
+                        dept['name'] = name
+                    if active is not None:
+                        dept['active'] = bool(active)
+                    self._put(conn, 'homes', doc)
+                    return True
+        return False
+
+    def remove_department(self, home_id: str, department_id: str) -> bool:
+        with self._write() as conn:
+            doc = self.get_home(home_id, conn)
+            if not doc:
+                return False
+            departments = doc.get('departments') or []
+            new_departments = [dept for dept in departments if dept.get('id') != department_id]
+            if len(new_departments) == len(departments):
+                return False
+            doc['departments'] = new_departments
+            self._put(conn, 'homes', doc)
+        return True
+
+    # ---- Activities ----
+    def get_all_activities(self) -> List[Dict]:
+        items = [d for d in self._all_docs('activities') if d.get('active') is True]
+        # Guard against null/invalid sort_order; push nulls last and normalize to numeric
+        items.sort(key=lambda x: (
+            x.get('sort_order') is None,
+            x.get('sort_order') if isinstance(x.get('sort_order'), (int, float)) else 0
+        ))
+        return items
+
+    def get_activity(self, activity_id: str) -> Optional[Dict]:
+        return self._read_doc('activities', activity_id)
+
+    def find_activity_by_name(self, name: str) -> Optional[Dict]:
+        if not name:
+            return None
+        row = self._conn().execute('SELECT doc FROM activities WHERE name = ? LIMIT 1', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _create_activity(self, conn, doc: Dict) -> bool:
+        if conn.execute('SELECT 1 FROM activities WHERE id = ?', (doc['id'],)).fetchone():
+            return False
+        sort_orders = [d.get('sort_order') for d in self._all_docs('activities', conn)]
+        doc['sort_order'] = max([int(s or 0) for s in sort_orders] or [0]) + 1
+        conn.execute('INSERT INTO activities (id, name, doc) VALUES (?, ?, ?)',
+                     (doc['id'], _text(doc.get('name')), _dumps(doc)))
+        return True
+
+    def _put_activity(self, conn, doc: Dict) -> None:
+        conn.execute('INSERT OR REPLACE INTO activities (id, name, doc) VALUES (?, ?, ?)',
+                     (doc['id'], _text(doc.get('name')), _dumps(doc)))
+
+    def add_activity_if_not_exists(self, activity_name: Optional[str]) -> None:
+        if not activity_name:
+            return
+        activity_id = _activity_id(activity_name)
+        if self.get_activity(activity_id):
+            return
+        with self._write() as conn:
+            self._create_activity(conn, {
+                'id': activity_id,
+                'name': activity_name,
+                'active': True,
+                'category': 'allman',
+                'created_at': _iso_now(),
+            })
+
+    def add_activity(self, data: Dict) -> Optional[str]:
+        name = (data.get('name') or '').strip()
+        if not name:
+            return None
+        doc = {
+            'id': _activity_id(name),
+            'name': name,
+            'active': bool(data.get('active', True)),
+            'description': data.get('description', ''),
+            'category': data.get('category', 'allman'),
+            'created_at': _iso_now(),
+        }
+        with self._write() as conn:
+            created = self._create_activity(conn, doc)
+        return doc['id'] if created else None
+
+    def update_activity_name(self, activity_id: str, new_name: str, old_name: str) -> bool:
+        if not activity_id or not new_name:
+            return False
+        with self._write() as conn:
+            doc = self._read_doc('activities', activity_id, conn)
+            if not doc:
+                return False
+            doc['name'] = new_name
+            self._put_activity(conn, doc)
+
+            # Update visit records with old name
+            if old_name and old_name != new_name:
+                rows = conn.execute('SELECT doc FROM visits WHERE activity = ?', (old_name,)).fetchall()
+                for (raw,) in rows:
+                    visit = json.loads(raw)
+                    if not (visit.get('home_id') or visit.get('traffpunkt_id')):
+                        continue
+                    visit['activity'] = new_name
+                    conn.execute(_REPLACE_VISIT, _visit_row(visit))
+        return True
+
+    def deactivate_activity(self, activity_id: str) -> bool:
+        with self._write() as conn:
+            doc = self._read_doc('activities', activity_id, conn)
+            if not doc:
+                return False
+            doc['active'] = False
+            self._put_activity(conn, doc)
+        return True
+
+    # ---- Companions ----
+    def get_all_companions(self) -> List[Dict]:
+        items = [d for d in self._all_docs('companions') if d.get('active') is True]
+        items.sort(key=lambda x: (x.get('name') or '').lower())
+        return items
+
+    def get_companion(self, companion_id: str) -> Optional[Dict]:
+        return self._read_doc('companions', companion_id)
+
+    def add_companion(self, data: Dict) -> Optional[str]:
+        name = (data.get('name') or '').strip()
+        if not name:
+            return None
+        companion_id = _slugify(name)
+        if not companion_id:
+            return None
+        doc = {
+            'id': companion_id,
+            'name': name,
+            'active': bool(data.get('active', True)),
+            'created_at': _iso_now(),
+        }
+        with self._write() as conn:
+            inserted = conn.execute('INSERT OR IGNORE INTO companions (id, doc) VALUES (?, ?)',
+                                    (companion_id, _dumps(doc)))
+        return companion_id if inserted.rowcount else None
+
+    def _set_companion_field(self, companion_id: str, field: str, value) -> bool:
+        if not companion_id:
+            return False
+        with self._write() as conn:
+            doc = self._read_doc('companions', companion_id, conn)
+            if not doc:
+                return False
+            doc[field] = value
+            self._put(conn, 'companions', doc)
+        return True
+
+    def update_companion_name(self, companion_id: str, new_name: str) -> bool:
+        if not new_name:
+            return False
+        return self._set_companion_field(companion_id, 'name', new_name)
+
+    def deactivate_companion(self, companion_id: str) -> bool:
+        return self._set_companion_field(companion_id, 'active', False)
+
+    # ---- Outdoor visits ----
+    def add_visit(self, data: Dict) -> str:
+        d = self._prepare_visit(data)
+        try:
+            with self._write() as conn:
+                conn.execute(_INSERT_VISIT, _visit_row(d))
+        except sqlite3.IntegrityError as e:
+            raise ConflictError(d['id']) from e
+        return d['id']
+
+    def add_visits_batch(self, home_id: str, docs: List[Dict]) -> List[Tuple[str, str]]:
+        """Write visits for one home, VISIT_BATCH_LIMIT per transaction.
+
+        Returns (id, status) per document where status is 'created', 'exists'
+        (the id was already stored, e.g. a resent client id) or 'error'.
+        """
+        prepared = [self._prepare_visit({**d, 'home_id': home_id}) for d in docs]
+        results: List[Tuple[str, str]] = []
+        for start in range(0, len(prepared), VISIT_BATCH_LIMIT):
+            chunk = prepared[start:start + VISIT_BATCH_LIMIT]
+            try:
+                with self._write() as conn:
+                    conn.executemany(_INSERT_VISIT, [_visit_row(d) for d in chunk])
+                results.extend((d['id'], 'created') for d in chunk)
+                continue
+            except (sqlite3.IntegrityError, TypeError, ValueError):
+                # All-or-nothing like a Cosmos batch: retry one by one
+                pass
+            for d in chunk:
+                try:
+                    with self._write() as conn:
+                        conn.execute(_INSERT_VISIT, _visit_row(d))
+                    results.append((d['id'], 'created'))
+                except sqlite3.IntegrityError:
+                    results.append((d['id'], 'exists'))
+                except (TypeError, ValueError):
+                    results.append((d['id'], 'error'))
+        return results
+
+    def iter_statistics(self, home_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        department_id: Optional[str] = None, activity_id: Optional[str] = None, companion_id: Optional[str] = None,
+                        offer_status: Optional[str] = None, visit_type: Optional[str] = None,
+                        page_size: Optional[int] = None) -> Iterator[Dict]:
+        """Lazily page through visits matching the statistics filters."""
+        filters = {
+            'home_id': home_id, 'date_from': date_from, 'date_to': date_to, 'department_id': department_id,
+            'activity_id': activity_id, 'companion_id': companion_id, 'offer_status': offer_status,
+            'visit_type': visit_type,
+        }
+        clauses = []
+        params = []
+        for name, clause in _STATISTICS_FILTERS:
+            if filters[name]:
+                clauses.append(clause)
+                params.append(filters[name])
+        where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        cursor = self._conn().execute(f'SELECT doc FROM visits{where}', params)
+        return self._iter_docs(cursor, page_size or 1000)
+
+    @staticmethod
+    def _iter_docs(cursor, page_size: int) -> Iterator[Dict]:
+        try:
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    return
+                for (raw,) in rows:
+                    yield json.loads(raw)
+        finally:
+            cursor.close()
+
+    def list_my_visits(self, oid: str, email: Optional[str], date_from: Optional[str], date_to: Optional[str], limit: int = 500) -> List[Dict]:
+        # Legacy fallback: records created before OID was stored match on email
+        clauses = ['(registered_by_oid = ? OR registered_by = ?)' if email else 'registered_by_oid = ?']
+        params = [oid, email] if email else [oid]
+        if date_from:
+            clauses.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('date <= ?')
+            params.append(date_to)
+        params.append(max(1, min(limit, 500)))
+        rows = self._conn().execute(
+            f'SELECT doc FROM visits WHERE {" AND ".join(clauses)} '
+            f'ORDER BY COALESCE(date, \'\') DESC, COALESCE(registered_at, \'\') DESC LIMIT ?', params
+        )
+        return [json.loads(raw) for (raw,) in rows]
+
+    def get_visit(self, doc_id: str) -> Optional[Dict]:
+        return self._read_doc('visits', doc_id)
+
+    def update_visit(self, doc_id: str, new_data: Dict) -> Optional[Dict]:
+        with self._write() as conn:
+            existing = self._read_doc('visits', doc_id, conn)
+            if not existing:
+                return None
+            edit_count = int(existing.get('edit_count', 0)) + 1
+            new_data2 = {**new_data, 'edit_count': edit_count, 'last_modified_at': _iso_now()}
+            # Preserve immutable/partition fields
+            new_data2['id'] = doc_id
+            if existing.get('home_id'):
+                new_data2['home_id'] = existing['home_id']
+            elif existing.get('traffpunkt_id'):
+                new_data2['home_id'] = existing['traffpunkt_id']
+            if not (existing.get('home_id') or existing.get('traffpunkt_id')):
+                return None
+            conn.execute(_REPLACE_VISIT, _visit_row(new_data2))
+        return new_data2
+
+    def delete_visit(self, doc_id: str) -> bool:
+        with self._write() as conn:
+            existing = self._read_doc('visits', doc_id, conn)
+            if not existing or not (existing.get('home_id') or existing.get('traffpunkt_id')):
+                return False
+            conn.execute('DELETE FROM visits WHERE id = ?', (doc_id,))
+        return True
+
+    def write_audit_doc(self, kind: str, doc: Dict) -> None:
+        table = 'visit_audit' if kind == 'visit' else 'admin_audit'
+        # Audit ids are fixed when the record is built; a replayed record is already stored
+        with self._write() as conn:
+            conn.execute(f'INSERT OR IGNORE INTO {table} (id, doc) VALUES (?, ?)', (doc['id'], _dumps(doc)))
+
+    # ---- Users & roles ----
+    def upsert_user(self, oid: str, email: str, display_name: str, min_interval_seconds: int = 0) -> bool:
+        """Record a login. Returns True if the users table was written.
+
+        The write is skipped when email and display name are unchanged and the
+        stored last_login_at is younger than min_interval_seconds.
+        """
+        if not oid:
+            return False
+        email_l = (email or '').strip().lower()
+        name = display_name or ''
+        now = datetime.utcnow()
+        if min_interval_seconds > 0:
+            seen = self._login_seen.get(oid)
+            if seen and seen[:2] == (email_l, name) and (now - seen[2]).total_seconds() < min_interval_seconds:
+                return False
+        with self._write() as conn:
+            user = self._read_doc('users', oid, conn)
+            if user is None:
+                user = {
+                    'id': oid,
+                    'email': email_l,
+                    'display_name': name,
+                    'roles': {'admin': False},
+                    'created_at': _iso_now(),
+                    'last_login_at': _iso_now(),
+                }
+            else:
+                last_login = _parse_iso(user.get('last_login_at'))
+                if (user.get('email') == email_l and user.get('display_name') == name and last_login
+                        and (now - last_login).total_seconds() < min_interval_seconds):
+                    self._remember_login(oid, email_l, name, last_login)
+                    return False
+                user.update(email=email_l, display_name=name, last_login_at=now.isoformat())
+            self._put(conn, 'users', user)
+        self._remember_login(oid, email_l, name, now)
+        return True
+
+    def _remember_login(self, oid: str, email: str, name: str, at: datetime) -> None:
+        if len(self._login_seen) >= MAX_LOGIN_SEEN:
+            self._login_seen.clear()
+        self._login_seen[oid] = (email, name, at)
+
+    def get_user(self, oid: str) -> Optional[Dict]:
+        return self._read_doc('users', oid)
+
+    def list_users(self, q: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        users = self._all_docs('users')
+        q_l = (q or '').strip().lower()
+        if q_l:
+            users = [u for u in users if q_l in (u.get('email') or '').lower()]
+        users.sort(key=lambda u: (u.get('created_at') is None, u.get('created_at'), u.get('email')))
+        return users[: max(1, min(limit, 500))]
+
+    def set_admin_role(self, target_oid: str, admin: bool, actor_oid: str, actor_email: str) -> Dict:
+        with self._write() as conn:
+            user = self._read_doc('users', target_oid, conn)
+            if user is None:
+                raise KeyError('user_not_found')
+            roles = dict(user.get('roles') or {})
+            roles['admin'] = bool(admin)
+            user['roles'] = roles
+            self._put(conn, 'users', user)
+        # Audit
+        self._write_audit('admin', {
+            'id': str(uuid4()),
+            'action': 'grant_admin' if admin else 'revoke_admin',
+            'actor_oid': actor_oid,
+            'actor_email': (actor_email or '').lower(),
+            'target_oid': target_oid,
+            'target_email': (user.get('email') or '').lower(),
+            'ts': _iso_now(),
+        })
+        return {'id': target_oid, 'roles': roles}
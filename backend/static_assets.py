@@ -0,0 +1,177 @@
+"""
+Servering av den byggda React-appen från ett manifest i minnet, med
+förkomprimerade gzip-/brotli-varianter och cache-headers efter filtyp.
+
+Kan också köras vid bygget för att skriva .gz/.br bredvid filerna:
+
+    python static_assets.py static
+"""
+import os
+import re
+import sys
+import gzip
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, Optional
+
+from flask import Response, request, send_file
+
+from compression import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:  # Utan brotli serveras bara gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Filtyper som lönar sig att komprimera (bilder och typsnitt är redan komprimerade)
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.css', '.json', '.map', '.svg', '.txt', '.ico', '.webmanifest'}
+MIN_COMPRESS_SIZE = 1024
+
+# CRA lägger ett innehållshash i filnamnet under static/, t.ex. main.3f2a9c1b.js
+FINGERPRINTED = re.compile(r'^static/(js|css|media)/.+\.[0-9a-f]{8,}\.')
+
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+CACHE_DEFAULT = 'public, max-age=3600'
+
+# Föredragen ordning när klienten accepterar flera kodningar
+ENCODINGS = ('br', 'gzip')
+
+
+class Asset:
+    __slots__ = ('path', 'mimetype', 'etag', 'cache_control', 'body', 'variants')
+
+    def __init__(self, path, mimetype, etag, cache_control, body=None, variants=None):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.cache_control = cache_control
+        # Okomprimerat innehåll i minnet (None = skickas från disk)
+        self.body = body
+        # kodning -> komprimerat innehåll
+        self.variants = variants or {}
+
+
+def _cache_control(rel_path: str) -> str:
+    if rel_path == 'index.html' or rel_path.endswith('service-worker.js'):
+        return CACHE_REVALIDATE
+    if FINGERPRINTED.match(rel_path):
+        return CACHE_IMMUTABLE
+    return CACHE_DEFAULT
+
+
+def _compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """Komprimera data. best=True (vid bygget) är långsamt men ger minst filer."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 9)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+class StaticAssets:
+    """Manifest över static-mappen, byggt en gång vid start.
+
+    Komprimerbara filer hålls i minnet tillsammans med gzip/brotli-varianter
+    (från .gz/.br på disk om bygget skapat dem, annars komprimeras de här).
+    Övriga filer skickas från disk men med samma cache-headers.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.assets: Dict[str, Asset] = {}
+        if os.path.isdir(root):
+            self._build()
+
+    def _build(self) -> None:
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+                self.assets[rel_path] = self._load(rel_path, path)
+                total += sum(len(v) for v in self.assets[rel_path].variants.values())
+        logger.info('Static manifest: %d files, %d bytes precompressed', len(self.assets), total)
+
+    def _load(self, rel_path: str, path: str) -> Asset:
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in COMPRESSIBLE_EXTENSIONS:
+            stat = os.stat(path)
+            etag = f'"{int(stat.st_mtime)}-{stat.st_size}"'
+            return Asset(path, mimetype, etag, _cache_control(rel_path))
+
+        body = _read(path)
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        variants = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if encoding == 'br' and brotli is None:
+                    continue
+                if os.path.exists(path + suffix):
+                    data = _read(path + suffix)
+                else:
+                    data = _compress(body, encoding)
+                if len(data) < len(body):
+                    variants[encoding] = data
+        return Asset(path, mimetype, f'"{digest}"', _cache_control(rel_path), body, variants)
+
+    def get(self, rel_path: str) -> Optional[Asset]:
+        return self.assets.get(rel_path)
+
+    def response(self, asset: Asset) -> Response:
+        """Svar för asset med förhandlad kodning, ETag och Cache-Control."""
+        if asset.body is None:
+            response = send_file(asset.path, mimetype=asset.mimetype, etag=asset.etag.strip('"'),
+                                 conditional=True)
+            response.headers['Cache-Control'] = asset.cache_control
+            return response
+
+        encoding = None
+        if asset.variants:
+            encoding = negotiate_encoding(
+                request.headers.get('Accept-Encoding'), [e for e in ENCODINGS if e in asset.variants]
+            )
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+
+        headers = {'Cache-Control': asset.cache_control, 'ETag': etag}
+        if asset.variants:
+            headers['Vary'] = 'Accept-Encoding'
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            return Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            body = asset.variants[encoding]
+        else:
+            body = asset.body
+        return Response(body, mimetype=asset.mimetype, headers=headers)
+
+
+def precompress(root: str) -> None:
+    """Skriv .gz (och .br om brotli finns) för komprimerbara filer i root."""
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            body = _read(path)
+            if len(body) < MIN_COMPRESS_SIZE:
+                continue
+            for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if encoding == 'br' and brotli is None:
+                    continue
+                with open(path + suffix, 'wb') as fh:
+                    fh.write(_compress(body, encoding, best=True))
+
+
+if __name__ == '__main__':
+    precompress(sys.argv[1] if len(sys.argv) > 1 else 'static')
@@ -0,0 +1,284 @@
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from uuid import uuid4, uuid5, UUID
+from typing import Callable, Optional, List, Dict, Iterator, Tuple
+from datetime import datetime
+
+MAX_DEPARTMENTS_PER_HOME = 20
+# Cosmos allows at most 100 operations per transactional batch
+VISIT_BATCH_LIMIT = 100
+# Upper bound for the in-process cache of recently recorded logins
+MAX_LOGIN_SEEN = 10000
+
+
+# Namespace for deterministic visit ids derived from client-supplied keys
+VISIT_ID_NAMESPACE = UUID('6f1c0a52-6b8e-4d8e-9a57-2f4b3c1d7e90')
+
+
+def visit_id_for_key(owner_oid: str, home_id: str, client_key: str) -> str:
+    """Map a client-generated key to a stable document id, scoped per user and home.
+
+    Cosmos only enforces id uniqueness within a partition (/home_id), so the
+    home is part of the name: a key replayed for another home gets another id.
+    """
+    return str(uuid5(VISIT_ID_NAMESPACE, f'{owner_oid}:{home_id}:{client_key}'))
+
+
+def _iso_now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _parse_iso(value) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _slugify(value: Optional[str]) -> str:
+    if not value:
+        return ''
+    slug = value.strip().lower()
+    slug = slug.replace('å', 'a').replace('ä', 'a').replace('ö', 'o')
+    slug = slug.replace(' ', '-')
+    slug = re.sub(r'[^a-z0-9-]', '', slug)
+    slug = re.sub(r'-+', '-', slug).strip('-')
+    return slug
+
+
+def _activity_id(name: str) -> str:
+    return re.sub(r'[^a-z0-9-]', '', (name or '').lower().replace(' ', '-'))
+
+
+class StorageError(Exception):
+    """Storage failure that is not specific to one backend."""
+
+
+class ConflictError(StorageError):
+    """A document with the same id already exists."""
+
+    status_code = 409
+
+
+class StorageBackend(ABC):
+    """Operations the app needs from its data store.
+
+    CosmosService is the production implementation; SqliteStorage
+    (sqlite_storage.py) keeps everything in a local database file. Both are
+    checked by storage_contract.py. Documents are plain dicts shaped like
+    the Cosmos documents, including legacy fields such as traffpunkt_id.
+    """
+
+    # Optional callable(kind, doc) that takes over audit writes (see audit_queue)
+    audit_sink: Optional[Callable[[str, Dict], None]] = None
+
+    @abstractmethod
+    def connect(self, ensure: bool = True) -> None:
+        """(Re)open connections; called again in each gunicorn worker after fork."""
+
+    # ---- Homes and departments ----
+    @abstractmethod
+    def get_all_homes(self) -> List[Dict]:
+        """Active homes sorted by name, departments sorted by name."""
+
+    @abstractmethod
+    def get_home(self, home_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def add_home(self, data: Dict) -> Optional[str]:
+        """Create a home with a slug id. Returns None if it already exists."""
+
+    @abstractmethod
+    def add_department(self, home_id: str, name: str) -> Optional[Dict]:
+        """Returns the new department, None if it exists, or raises
+        ValueError('home_not_found'|'max_departments'|'invalid_department')."""
+
+    @abstractmethod
+    def update_department(self, home_id: str, department_id: str, *, name: Optional[str] = None,
+                          active: Optional[bool] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def remove_department(self, home_id: str, department_id: str) -> bool:
+        ...
+
+    # ---- Activities and companions ----
+    @abstractmethod
+    def get_all_activities(self) -> List[Dict]:
+        """Active activities by sort_order, missing sort_order last."""
+
+    @abstractmethod
+    def get_activity(self, activity_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def find_activity_by_name(self, name: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def add_activity_if_not_exists(self, activity_name: Optional[str]) -> None:
+        ...
+
+    @abstractmethod
+    def add_activity(self, data: Dict) -> Optional[str]:
+        """Create an activity last in sort order. Returns None if it exists."""
+
+    @abstractmethod
+    def update_activity_name(self, activity_id: str, new_name: str, old_name: str) -> bool:
+        """Rename an activity and the activity field of visits with the old name."""
+
+    @abstractmethod
+    def deactivate_activity(self, activity_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def get_all_companions(self) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def get_companion(self, companion_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def add_companion(self, data: Dict) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def update_companion_name(self, companion_id: str, new_name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def deactivate_companion(self, companion_id: str) -> bool:
+        ...
+
+    # ---- Outdoor visits ----
+    @staticmethod
+    def _prepare_visit(data: Dict) -> Dict:
+        d = dict(data)
+        if not d.get('id'):
+            d['id'] = str(uuid4())
+        # ensure timestamps as ISO strings
+        ra = d.get('registered_at')
+        if not isinstance(ra, str):
+            d['registered_at'] = _iso_now()
+        lma = d.get('last_modified_at')
+        if not isinstance(lma, str):
+            d['last_modified_at'] = d['registered_at']
+        if 'edit_count' not in d:
+            d['edit_count'] = 0
+        return d
+
+    @abstractmethod
+    def add_visit(self, data: Dict) -> str:
+        """Store a new visit and return its id. Raises ConflictError if the id exists."""
+
+    @abstractmethod
+    def add_visits_batch(self, home_id: str, docs: List[Dict]) -> List[Tuple[str, str]]:
+        """Returns (id, status) per document: 'created', 'exists' or 'error'."""
+
+    def get_statistics(self, home_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       department_id: Optional[str] = None, activity_id: Optional[str] = None, companion_id: Optional[str] = None,
+                       offer_status: Optional[str] = None, visit_type: Optional[str] = None) -> List[Dict]:
+        return list(self.iter_statistics(
+            home_id=home_id, date_from=date_from, date_to=date_to, department_id=department_id,
+            activity_id=activity_id, companion_id=companion_id, offer_status=offer_status, visit_type=visit_type
+        ))
+
+    @abstractmethod
+    def iter_statistics(self, home_id: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        department_id: Optional[str] = None, activity_id: Optional[str] = None, companion_id: Optional[str] = None,
+                        offer_status: Optional[str] = None, visit_type: Optional[str] = None,
+                        page_size: Optional[int] = None) -> Iterator[Dict]:
+        """Lazily iterate visits matching all given filters (dates inclusive)."""
+
+    @abstractmethod
+    def list_my_visits(self, oid: str, email: Optional[str], date_from: Optional[str], date_to: Optional[str],
+                       limit: int = 500) -> List[Dict]:
+        """Visits registered by oid, or by email for records from before oids
+        were stored, newest first."""
+
+    @abstractmethod
+    def get_visit(self, doc_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def update_visit(self, doc_id: str, new_data: Dict) -> Optional[Dict]:
+        """Replace a visit, keeping its id and home (home_id or legacy traffpunkt_id)."""
+
+    @abstractmethod
+    def delete_visit(self, doc_id: str) -> bool:
+        ...
+
+    # ---- Audit ----
+    def write_visit_audit(self, action: str, actor_oid: str, actor_email: str, visit_id: str, changed_fields: Optional[List[str]] = None):
+        doc = {
+            'id': str(uuid4()),
+            'action': action,
+            'actor_oid': actor_oid,
+            'actor_email': (actor_email or '').lower(),
+            'visit_id': visit_id,
+            'changed_fields': changed_fields or [],
+            'ts': _iso_now(),
+        }
+        self._write_audit('visit', doc)
+
+    def _write_audit(self, kind: str, doc: Dict) -> None:
+        # Hand off to the async audit queue when one is attached
+        if self.audit_sink is not None:
+            self.audit_sink(kind, doc)
+        else:
+            self.write_audit_doc(kind, doc)
+
+    @abstractmethod
+    def write_audit_doc(self, kind: str, doc: Dict) -> None:
+        """Store an audit record ('visit' or 'admin'); an already stored id is ignored."""
+
+    # ---- Users & roles ----
+    @abstractmethod
+    def upsert_user(self, oid: str, email: str, display_name: str, min_interval_seconds: int = 0) -> bool:
+        """Record a login. Returns True if the user was written."""
+
+    @abstractmethod
+    def get_user(self, oid: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def list_users(self, q: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def set_admin_role(self, target_oid: str, admin: bool, actor_oid: str, actor_email: str) -> Dict:
+        """Set the admin flag and audit it. Raises KeyError('user_not_found')."""
+
+
+STORAGE_BACKENDS = ('cosmos', 'sqlite')
+
+_shared_storage = None
+_shared_lock = threading.Lock()
+
+
+def get_storage_service() -> StorageBackend:
+    """Return the process-wide storage backend chosen by STORAGE_BACKEND.
+
+    cosmos (default) uses Azure Cosmos DB; sqlite uses a local database
+    file at SQLITE_PATH.
+    """
+    global _shared_storage
+    if _shared_storage is None:
+        with _shared_lock:
+            if _shared_storage is None:
+                backend = (os.getenv('STORAGE_BACKEND') or 'cosmos').strip().lower()
+                if backend == 'sqlite':
+                    from sqlite_storage import SqliteStorage
+                    _shared_storage = SqliteStorage(os.getenv('SQLITE_PATH') or 'data/sabo.sqlite3')
+                elif backend == 'cosmos':
+                    from cosmos_service import get_cosmos_service
+                    _shared_storage = get_cosmos_service()
+                else:
+                    raise RuntimeError(f'Unknown STORAGE_BACKEND {backend!r}, use one of {", ".join(STORAGE_BACKENDS)}')
+    return _shared_storage
@@ -0,0 +1,353 @@
+"""
+Kontraktskontroll för lagringsbackends (storage.StorageBackend).
+
+Kör samma kontroller mot varje backend så att CosmosService och
+SqliteStorage beter sig likadant, även för legacy-poster (traffpunkt_id,
+besök utan registered_by_oid, aktiviteter utan sort_order).
+
+    python storage_contract.py                 # sqlite och Cosmos-stand-in i minnet
+    python storage_contract.py sqlite
+    python storage_contract.py cosmos          # riktig Cosmos enligt COSMOS_*-variablerna – skriver data!
+
+Returnerar 1 om någon kontroll misslyckas.
+"""
+import os
+import sys
+import uuid
+import tempfile
+import traceback
+from datetime import datetime
+
+from storage import ConflictError, StorageBackend, VISIT_BATCH_LIMIT, visit_id_for_key
+
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def _public(doc):
+    # Cosmos lägger till systemfält (_rid, _etag, _ts ...)
+    return {k: v for k, v in (doc or {}).items() if not k.startswith('_')}
+
+
+def _visit(home_id, **fields):
+    doc = {
+        'home_id': home_id, 'department_id': f'{home_id}__avd-a', 'date': '2024-05-02',
+        'visit_type': 'group', 'offer_status': 'accepted', 'activity': 'Promenad', 'activity_name': 'Promenad',
+        'activity_id': 'promenad', 'companion': 'Personal', 'companion_id': 'personal',
+        'duration_minutes': 30, 'gender_counts': {'men': 1, 'women': 1}, 'total_participants': 2,
+        'satisfaction_entries': [], 'registered_by': 'anna@skovde.se', 'registered_by_oid': 'oid-anna',
+    }
+    doc.update(fields)
+    return doc
+
+
+@check
+def homes_and_departments(db: StorageBackend, ns: str):
+    home_id = db.add_home({'name': f'Ö {ns} Solgården'})
+    assert home_id == f'o-{ns}-solgarden', home_id
+    assert db.add_home({'name': f'Ö {ns} Solgården'}) is None, 'duplicate home'
+    assert db.add_home({'name': '  '}) is None
+    inactive = db.add_home({'name': f'{ns} Vilan', 'active': False})
+
+    b = db.add_department(home_id, 'Björken')
+    a = db.add_department(home_id, 'Almen')
+    assert b['id'] == f'{home_id}__bjorken' and b['active'] is True
+    assert db.add_department(home_id, 'Björken') is None, 'duplicate department'
+    for name, error in ((home_id, '!!!'), ('saknas-' + ns, 'Almen')):
+        try:
+            db.add_department(name, error)
+            raise AssertionError('expected ValueError')
+        except ValueError as exc:
+            assert str(exc) in ('invalid_department', 'home_not_found'), exc
+
+    home = db.get_home(home_id)
+    assert [d['name'] for d in home['departments']] == ['Almen', 'Björken'], 'departments sorted by name'
+    assert db.update_department(home_id, a['id'], active=False)
+    assert not db.update_department(home_id, 'saknas')
+    assert db.remove_department(home_id, b['id'])
+    assert not db.remove_department(home_id, b['id'])
+    assert [(d['id'], d['active']) for d in db.get_home(home_id)['departments']] == [(a['id'], False)]
+
+    listed = [h['id'] for h in db.get_all_homes()]
+    assert home_id in listed and inactive not in listed, 'only active homes'
+    assert db.get_home('') is None and db.get_home('saknas-' + ns) is None
+
+
+@check
+def max_departments(db, ns):
+    home_id = db.add_home({'name': f'{ns} Max'})
+    for i in range(20):
+        db.add_department(home_id, f'Avd {i}')
+    try:
+        db.add_department(home_id, 'En till')
+        raise AssertionError('expected max_departments')
+    except ValueError as exc:
+        assert str(exc) == 'max_departments'
+
+
+@check
+def activities(db, ns):
+    first = db.add_activity({'name': f'Boule {ns}'})
+    assert first == f'boule-{ns}'
+    assert db.add_activity({'name': f'Boule {ns}'}) is None
+    db.add_activity_if_not_exists(f'Fika {ns}')
+    db.add_activity_if_not_exists(f'Fika {ns}')
+    fika = db.find_activity_by_name(f'Fika {ns}')
+    assert fika and fika['id'] == f'fika-{ns}' and fika['sort_order'] > db.get_activity(first)['sort_order']
+    assert db.find_activity_by_name('saknas ' + ns) is None
+
+    assert db.update_activity_name(first, f'Boccia {ns}', f'Boule {ns}')
+    assert db.get_activity(first)['name'] == f'Boccia {ns}'
+    assert not db.update_activity_name('saknas-' + ns, 'x', 'y')
+    assert db.deactivate_activity(fika['id'])
+    assert not db.deactivate_activity('saknas-' + ns)
+    ids = [a['id'] for a in db.get_all_activities()]
+    assert first in ids and fika['id'] not in ids
+
+    orders = [a.get('sort_order') for a in db.get_all_activities()]
+    assert orders == sorted(orders, key=lambda o: (o is None, o if isinstance(o, (int, float)) else 0))
+
+
+@check
+def companions(db, ns):
+    cid = db.add_companion({'name': f'Anhörig {ns}'})
+    assert cid == f'anhorig-{ns}'
+    assert db.add_companion({'name': f'Anhörig {ns}'}) is None
+    assert db.update_companion_name(cid, f'Anhöriga {ns}')
+    assert db.get_companion(cid)['name'] == f'Anhöriga {ns}'
+    assert not db.update_companion_name('saknas-' + ns, 'x')
+    assert db.deactivate_companion(cid)
+    assert cid not in [c['id'] for c in db.get_all_companions()]
+    assert db.get_companion('') is None
+
+
+@check
+def visits_crud(db, ns):
+    home = f'{ns}-h1'
+    doc_id = db.add_visit(_visit(home, registered_at=None))
+    stored = _public(db.get_visit(doc_id))
+    assert stored['home_id'] == home and stored['edit_count'] == 0
+    assert isinstance(stored['registered_at'], str) and stored['last_modified_at'] == stored['registered_at']
+
+    key = visit_id_for_key('oid-anna', home, f'klient-{ns}')
+    assert db.add_visit(_visit(home, id=key)) == key
+    try:
+        db.add_visit(_visit(home, id=key))
+        raise AssertionError('expected ConflictError')
+    except ConflictError:
+        pass
+
+    updated = db.update_visit(doc_id, {**stored, 'home_id': 'annat', 'activity': 'Fika'})
+    assert updated['home_id'] == home and updated['edit_count'] == 1, 'home and edit count kept'
+    again = _public(db.get_visit(doc_id))
+    assert again['activity'] == 'Fika' and again['edit_count'] == 1
+    assert db.update_visit('saknas-' + ns, {}) is None
+
+    assert db.delete_visit(doc_id)
+    assert db.get_visit(doc_id) is None
+    assert not db.delete_visit(doc_id)
+
+
+@check
+def visits_batch(db, ns):
+    home = f'{ns}-batch'
+    docs = [_visit(home, id=visit_id_for_key('oid-anna', home, f'{ns}-{i}')) for i in range(VISIT_BATCH_LIMIT + 5)]
+    results = db.add_visits_batch(home, docs[:3])
+    assert [s for _, s in results] == ['created'] * 3
+    results = db.add_visits_batch(home, docs)
+    statuses = [s for _, s in results]
+    assert statuses[:3] == ['exists'] * 3 and statuses[3:] == ['created'] * (len(docs) - 3), statuses
+    assert [i for i, _ in results] == [d['id'] for d in docs]
+    assert len(db.get_statistics(home_id=home)) == len(docs)
+
+
+@check
+def statistics_filters(db, ns):
+    home, other = f'{ns}-s1', f'{ns}-s2'
+    db.add_visit(_visit(home, date='2024-05-01'))
+    db.add_visit(_visit(home, date='2024-05-31', offer_status='declined', visit_type='individual'))
+    db.add_visit(_visit(home, date='2024-06-01', department_id=f'{home}__avd-b', activity_id='boule'))
+    db.add_visit(_visit(other, date='2024-05-15', companion_id='anhorig'))
+    # Legacy: äldre poster har traffpunkt_id i stället för home_id
+    legacy = _visit(None, date='2024-05-10', traffpunkt_id=home)
+    del legacy['home_id']
+    db.add_visit(legacy)
+
+    def count(**filters):
+        return len(db.get_statistics(**filters))
+
+    assert count(home_id=home) == 3, 'home filter does not match traffpunkt_id'
+    assert count(home_id=home, date_from='2024-05-01', date_to='2024-05-31') == 2, 'dates inclusive'
+    assert count(home_id=home, offer_status='declined') == 1
+    assert count(home_id=home, visit_type='individual') == 1
+    assert count(home_id=home, department_id=f'{home}__avd-b') == 1
+    assert count(home_id=home, activity_id='boule') == 1
+    assert count(companion_id='anhorig', date_from='2024-05-01') >= 1
+    assert count(home_id=other, companion_id='anhorig') == 1
+    page = list(db.iter_statistics(home_id=home, page_size=1))
+    assert len(page) == 3
+
+
+@check
+def my_visits_legacy_email(db, ns):
+    oid, email = f'oid-{ns}', f'{ns}@skovde.se'
+    home = f'{ns}-m1'
+    newest = db.add_visit(_visit(home, date='2024-05-03', registered_by=email, registered_by_oid=oid,
+                                 registered_at='2024-05-03T10:00:00'))
+    later_same_day = db.add_visit(_visit(home, date='2024-05-03', registered_by=email, registered_by_oid=oid,
+                                         registered_at='2024-05-03T12:00:00'))
+    # Legacy: registrerad innan oid sparades
+    legacy_doc = _visit(home, date='2024-05-02', registered_by=email)
+    del legacy_doc['registered_by_oid']
+    legacy = db.add_visit(legacy_doc)
+    db.add_visit(_visit(home, date='2024-04-01', registered_by=email, registered_by_oid=oid))
+    db.add_visit(_visit(home, date='2024-05-02', registered_by='annan@skovde.se', registered_by_oid='annan'))
+
+    ids = [v['id'] for v in db.list_my_visits(oid, email, '2024-05-01', '2024-05-31')]
+    assert ids == [later_same_day, newest, legacy], ids
+    ids = [v['id'] for v in db.list_my_visits(oid, None, '2024-05-01', '2024-05-31')]
+    assert ids == [later_same_day, newest], 'no email, no legacy fallback'
+    assert len(db.list_my_visits(oid, email, None, None)) == 4
+    assert len(db.list_my_visits(oid, email, None, None, limit=2)) == 2
+    assert len(db.list_my_visits(oid, email, None, None, limit=0)) == 1
+
+
+@check
+def legacy_visit_update(db, ns):
+    legacy = _visit(None, traffpunkt_id=f'{ns}-gammal')
+    del legacy['home_id']
+    doc_id = db.add_visit(legacy)
+    found = _public(db.get_visit(doc_id))
+    assert found['traffpunkt_id'] == f'{ns}-gammal' and 'home_id' not in found
+    updated = db.update_visit(doc_id, {**found, 'activity': 'Fika'})
+    assert updated and updated['home_id'] == f'{ns}-gammal', 'home_id taken from traffpunkt_id'
+
+    orphan = _visit(None)
+    del orphan['home_id']
+    orphan_id = db.add_visit(orphan)
+    assert db.update_visit(orphan_id, {'activity': 'x'}) is None, 'no home, no update'
+    assert not db.delete_visit(orphan_id)
+
+
+@check
+def activity_rename_updates_visits(db, ns):
+    home = f'{ns}-r1'
+    name = f'Grillning {ns}'
+    activity_id = db.add_activity({'name': name})
+    doc_id = db.add_visit(_visit(home, activity=name, activity_name=name))
+    assert db.update_activity_name(activity_id, f'Grill {ns}', name)
+    assert db.get_visit(doc_id)['activity'] == f'Grill {ns}'
+
+
+@check
+def users_and_roles(db, ns):
+    oid = f'oid-user-{ns}'
+    assert db.upsert_user(oid, f' {ns}@Skovde.se ', 'Anna')
+    user = db.get_user(oid)
+    assert user['email'] == f'{ns}@skovde.se' and user['roles'] == {'admin': False}
+    assert not db.upsert_user(oid, f'{ns}@skovde.se', 'Anna', min_interval_seconds=900), 'recent login skipped'
+    assert db.upsert_user(oid, f'{ns}@skovde.se', 'Anna A', min_interval_seconds=900), 'changed name written'
+    assert db.get_user(oid)['display_name'] == 'Anna A'
+    assert not db.upsert_user('', 'x', 'y')
+    assert db.get_user('saknas-' + ns) is None
+
+    audits = []
+    db.audit_sink = lambda kind, doc: audits.append((kind, doc))
+    try:
+        assert db.set_admin_role(oid, True, 'oid-admin', 'Admin@skovde.se') == {'id': oid, 'roles': {'admin': True}}
+        db.write_visit_audit('update', 'oid-admin', 'admin@skovde.se', 'v1', ['date'])
+    finally:
+        db.audit_sink = None
+    assert [(k, d['action']) for k, d in audits] == [('admin', 'grant_admin'), ('visit', 'update')]
+    assert audits[0][1]['actor_email'] == 'admin@skovde.se' and audits[0][1]['target_oid'] == oid
+    db.write_audit_doc('visit', audits[1][1])
+    db.write_audit_doc('visit', audits[1][1])  # omspelad post ignoreras
+    try:
+        db.set_admin_role('saknas-' + ns, True, 'a', 'b')
+        raise AssertionError('expected KeyError')
+    except KeyError:
+        pass
+    assert db.get_user(oid)['roles']['admin'] is True
+    assert oid in [u['id'] for u in db.list_users(q=ns)]
+    assert db.list_users(q='ingen-sadan-' + ns) == []
+
+
+def _app_client(db):
+    """Testklient för appen med db som lagring och en inloggad användare."""
+    import storage
+    if storage._shared_storage is None:
+        # Annars ansluter appen till STORAGE_BACKEND vid import
+        storage._shared_storage = db
+    import app as app_module
+    app_module.db_service = db
+    client = app_module.app.test_client()
+    with client.session_transaction(base_url='https://localhost') as sess:
+        sess['azure_user'] = {'oid': 'oid-import', 'email': 'import@skovde.se'}
+        sess['login_time'] = datetime.now().isoformat()
+    return client
+
+
+@check
+def import_partial_failure(db, ns):
+    home_id = db.add_home({'name': f'{ns} Importgården'})
+    department = db.add_department(home_id, 'Almen')
+    header = 'home_id,department_id,date,visit_type,offer_status,activity_name,companion_name,duration_minutes,men,women\n'
+    row = f'{home_id},{department["id"]},2024-05-02,group,accepted,Promenad,Personal,30,1,1\n'
+    # Fler giltiga rader än en batch, sedan en rad som inte är UTF-8
+    body = (header + row * (VISIT_BATCH_LIMIT + 50)).encode() + b'\xff\xfe,trasig\n'
+    client = _app_client(db)
+
+    def upload():
+        response = client.post('/api/visits/import?format=csv', data=body, content_type='text/csv',
+                               base_url='https://localhost')
+        return response.status_code, response.get_json()
+
+    status, result = upload()
+    assert status == 400 and result['error'], (status, result)
+    saved = len(db.get_statistics(home_id=home_id))
+    statuses = [r['status'] for r in result['results']]
+    assert statuses.count('created') == saved > 0, (saved, statuses.count('created'))
+    assert statuses[-1] == 'error', 'avbrottet rapporteras som en rad'
+    # Samma fil igen: redan sparade rader krockar på sina id:n i stället för att dubbleras
+    status, result = upload()
+    assert status == 400, status
+    assert len(db.get_statistics(home_id=home_id)) == saved, 'omuppladdning dubblerade rader'
+    assert [r['status'] for r in result['results']].count('exists') == saved
+
+
+def run(db: StorageBackend, label: str) -> int:
+    """Kör alla kontroller mot db. Returnerar antal misslyckade."""
+    failed = 0
+    ns = uuid.uuid4().hex[:8]
+    for fn in CHECKS:
+        try:
+            fn(db, ns)
+            print(f'ok    {label} {fn.__name__}')
+        except Exception:
+            failed += 1
+            print(f'FAIL  {label} {fn.__name__}')
+            traceback.print_exc()
+    return failed
+
+
+def _backend(name: str) -> StorageBackend:
+    if name == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(os.path.join(tempfile.mkdtemp(prefix='sabo-contract-'), 'sabo.sqlite3'))
+    if name == 'standin':
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+        from cosmos_standin import InMemoryCosmosService
+        return InMemoryCosmosService()
+    if name == 'cosmos':
+        from cosmos_service import CosmosService
+        return CosmosService()
+    raise SystemExit(f'Okänd backend {name!r} (sqlite, standin, cosmos)')
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or ['sqlite', 'standin']
+    sys.exit(1 if sum(run(_backend(name), name) for name in names) else 0)
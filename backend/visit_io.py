@@ -0,0 +1,187 @@
+"""
+Import och export av utevistelser i CSV- och NDJSON-format
+"""
+import io
+import csv
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from security import ALLOWED_GENDERS
+
+VISIT_FORMATS = ('csv', 'ndjson')
+
+_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+# Kolumner i CSV-exporten; könsfördelningen plattas ut till en kolumn per kön
+EXPORT_COLUMNS = [
+    'id', 'home_id', 'department_id', 'date', 'visit_type', 'offer_status',
+    'activity', 'activity_id', 'companion', 'companion_id', 'duration_minutes',
+    'total_participants', *sorted(ALLOWED_GENDERS), 'satisfaction',
+]
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Fält som läses som heltal från CSV (övriga lämnas som text)
+_CSV_INT_FIELDS = {'duration_minutes'}
+
+
+def detect_format(fmt: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """Bestäm format från ?format= eller Content-Type."""
+    fmt = (fmt or '').strip().lower()
+    if fmt:
+        return fmt if fmt in VISIT_FORMATS else None
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    return _CONTENT_TYPES.get(mimetype)
+
+
+def _to_int(value):
+    value = (value or '').strip()
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        # Lämna ogiltiga värden orörda så att valideringen ger rätt felmeddelande
+        return value
+
+
+def _parse_satisfaction(value: str):
+    """Tolka 'men:5;women:4' till nöjdhetsposter."""
+    value = (value or '').strip()
+    if not value:
+        return []
+    entries = []
+    for part in value.split(';'):
+        gender, _, rating = part.partition(':')
+        entries.append({'gender': gender.strip(), 'rating': _to_int(rating)})
+    return entries
+
+
+def _row_from_csv(row: Dict[str, str]) -> Dict:
+    data = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip()
+        if key in ALLOWED_GENDERS:
+            continue
+        if key == 'satisfaction':
+            data['satisfaction_entries'] = _parse_satisfaction(value)
+        elif key in _CSV_INT_FIELDS:
+            data[key] = _to_int(value)
+        else:
+            data[key] = (value or '').strip()
+    data['gender_counts'] = {
+        gender: _to_int(row.get(gender)) or 0 for gender in sorted(ALLOWED_GENDERS)
+    }
+    return data
+
+
+def iter_import_rows(stream, fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Läs rader från en binär ström utan att läsa in hela filen.
+
+    Ger (radnummer, data, parsningsfel) per rad. Radnummer räknas från 1
+    och exkluderar CSV-rubrikraden.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row_no, row in enumerate(reader, start=1):
+            yield row_no, _row_from_csv(row), None
+        return
+
+    row_no = 0
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        row_no += 1
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield row_no, None, 'Ogiltig JSON'
+            continue
+        if not isinstance(data, dict):
+            yield row_no, None, 'Raden måste vara ett JSON-objekt'
+            continue
+        yield row_no, data, None
+
+
+def _format_satisfaction(entries) -> str:
+    if not isinstance(entries, list):
+        return ''
+    return ';'.join(
+        f"{e.get('gender')}:{e.get('rating')}" for e in entries if isinstance(e, dict)
+    )
+
+
+def export_row(item: Dict) -> List:
+    """Platta ut ett besök till en CSV-rad enligt EXPORT_COLUMNS."""
+    gender_counts = item.get('gender_counts') if isinstance(item.get('gender_counts'), dict) else {}
+    row = []
+    for column in EXPORT_COLUMNS:
+        if column in ALLOWED_GENDERS:
+            value = gender_counts.get(column, 0)
+        elif column == 'satisfaction':
+            value = _format_satisfaction(item.get('satisfaction_entries'))
+        elif column == 'home_id':
+            value = item.get('home_id') or item.get('traffpunkt_id')
+        elif column == 'total_participants':
+            value = item.get('total_participants', item.get('participants'))
+        else:
+            value = item.get(column)
+        row.append('' if value is None else value)
+    return row
+
+
+def iter_csv(items: Iterable[Dict]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    # BOM så att Excel läser å, ä och ö korrekt
+    yield '\ufeff' + buf.getvalue()
+    for item in items:
+        buf.seek(0)
+        buf.truncate(0)
+        writer.writerow(export_row(item))
+        yield buf.getvalue()
+
+
+def iter_ndjson(items: Iterable[Dict], dumps=None) -> Iterator[str]:
+    """En JSON-rad per besök. dumps kan vara appens JSON-provider (app.json.dumps)."""
+    if dumps is None:
+        def dumps(item):
+            return json.dumps(item, ensure_ascii=False, default=str)
+    for item in items:
+        yield dumps(item) + '\n'
+
+
+def iter_chunks(lines: Iterable[str], compress: bool = False,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Samla rader till block om ca chunk_size byte, valfritt gzip-komprimerade."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            block = b''.join(pending)
+            pending, size = [], 0
+            if gz:
+                block = gz.compress(block) + gz.flush(zlib.Z_SYNC_FLUSH)
+            if block:
+                yield block
+    block = b''.join(pending)
+    if gz:
+        block = gz.compress(block) + gz.flush()
+    if block:
+        yield block
@@ -0,0 +1,222 @@
+"""
+Validering och normalisering av utevistelser i ett pass.
+
+Den enda uppsättningen regler för besök: security.validate_attendance_data
+är en wrapper runt validate_visit. Felmeddelandena och deras ordning är
+desamma som i den tidigare valideringen (referenskopia i
+bench/legacy_validation.py), men mönstren är förkompilerade, datum cachade
+och avdelningarna i ett äldreboende förberäknade. Resultatet är det
+färdiga dokumentet som sparas i Cosmos.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from security import (
+    ALLOWED_GENDERS, ALLOWED_OFFER_STATUS, ALLOWED_VISIT_TYPES,
+    MAX_DURATION_MINUTES, MAX_PARTICIPANTS_PER_ENTRY, MIN_DURATION_MINUTES,
+)
+
+_HOME_ID = re.compile(r'^[a-z0-9-]{1,50}$')
+_NAME = re.compile(r'^[a-zA-ZåäöÅÄÖ0-9\s\-\_]+$')
+_UNSAFE_CHARS = re.compile(r'[<>&\'"\\]')
+
+# Fast ordning så att felmeddelandet för kön inte beror på set-ordning
+_GENDERS = tuple(sorted(ALLOWED_GENDERS))
+
+_VISIT_TYPE_ERROR = f"Ogiltig typ. Måste vara en av: {', '.join(sorted(ALLOWED_VISIT_TYPES))}"
+_OFFER_STATUS_ERROR = f"Ogiltigt svar. Måste vara en av: {', '.join(sorted(ALLOWED_OFFER_STATUS))}"
+_GENDER_ERRORS = {g: f"Ogiltigt värde för {g} (0-{MAX_PARTICIPANTS_PER_ENTRY})" for g in _GENDERS}
+_DURATION_RANGE_ERROR = f"Varaktighet måste vara mellan {MIN_DURATION_MINUTES}-{MAX_DURATION_MINUTES} minuter"
+
+MAX_DEPARTMENT_ID_LENGTH = 160
+
+
+@lru_cache(maxsize=4096)
+def _valid_date(value: str) -> bool:
+    # Samma regler som strptime, men varje datum tolkas bara en gång
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+
+def _sanitize(value, max_length: int) -> str:
+    if not value:
+        return ''
+    return _UNSAFE_CHARS.sub('', str(value))[:max_length].strip()
+
+
+def _name_error(value, field: str, max_length: int = 100) -> Optional[str]:
+    if not value or not isinstance(value, str):
+        return f"{field} saknas"
+    value = value.strip()
+    if not value:
+        return f"{field} får inte vara tomt"
+    if len(value) > max_length:
+        return f"{field} får högst innehålla {max_length} tecken"
+    if not _NAME.match(value):
+        return f"{field} innehåller ogiltiga tecken"
+    return None
+
+
+class VisitValidator:
+    """Validator för besök på ett äldreboende.
+
+    Skapa en per äldreboende (home_doc kan vara None för legacy-poster) och
+    återanvänd den för alla rader i en import eller batch.
+    """
+
+    def __init__(self, home_doc: Optional[Dict] = None, existing_department_id: Optional[str] = None):
+        self.existing_department_id = existing_department_id
+        # avdelnings-id -> aktiv (första förekomsten gäller, som i validate_department)
+        self.departments: Dict[str, bool] = {}
+        for dept in (home_doc or {}).get('departments') or []:
+            self.departments.setdefault(dept.get('id'), bool(dept.get('active', True)))
+
+    def _department_error(self, department_id) -> Optional[str]:
+        existing = self.existing_department_id
+        if not department_id or not isinstance(department_id, str):
+            if existing and department_id == existing:
+                return None
+            return "Avdelning måste anges"
+        if self.departments.get(department_id) or (existing and department_id == existing):
+            return None
+        return "Ogiltig avdelning"
+
+    def validate(self, data: Dict) -> Tuple[Optional[Dict], List[str]]:
+        """Validera och normalisera ett besök.
+
+        Returnerar (dokument, []) eller (None, fel). Dokumentet är en kopia
+        av data med normaliserade fält; övriga fält lämnas orörda.
+        """
+        errors = []
+        get = data.get
+
+        home_id = get('home_id')
+        if not home_id or not isinstance(home_id, str):
+            errors.append("Äldreboende-ID saknas")
+        elif not _HOME_ID.match(home_id):
+            errors.append("Ogiltigt format för äldreboende-ID")
+
+        department_id = get('department_id')
+        error = self._department_error(department_id)
+        if error:
+            errors.append(error)
+
+        date = get('date')
+        if not date:
+            errors.append("Datum saknas")
+        elif not isinstance(date, str) or not _valid_date(date):
+            errors.append("Ogiltigt datumformat (använd YYYY-MM-DD)")
+
+        visit_type = get('visit_type')
+        if not isinstance(visit_type, str) or visit_type not in ALLOWED_VISIT_TYPES:
+            errors.append(_VISIT_TYPE_ERROR)
+        offer_status = get('offer_status')
+        if not isinstance(offer_status, str) or offer_status not in ALLOWED_OFFER_STATUS:
+            errors.append(_OFFER_STATUS_ERROR)
+        declined = offer_status == 'declined'
+
+        gender_counts = get('gender_counts', {})
+        counts = {}
+        total = 0
+        if not isinstance(gender_counts, dict):
+            errors.append("Deltagarantal måste vara ett objekt")
+        else:
+            for gender in _GENDERS:
+                value = gender_counts.get(gender, 0)
+                if not isinstance(value, int) or value < 0 or value > MAX_PARTICIPANTS_PER_ENTRY:
+                    errors.append(_GENDER_ERRORS[gender])
+                    counts = None
+                    break
+                counts[gender] = int(value)
+                total += value
+            if counts is not None:
+                if not declined and total <= 0:
+                    errors.append("Minst en deltagare måste anges")
+                    counts = None
+                elif visit_type == 'individual' and not declined and total != 1:
+                    errors.append("Enskild registrering måste avse exakt en person")
+                    counts = None
+            if counts is None:
+                total = 0
+
+        duration = get('duration_minutes')
+        if offer_status == 'accepted':
+            error = _name_error(get('activity_name'), 'Aktivitet')
+            if error:
+                errors.append(error)
+            error = _name_error(get('companion_name'), 'Med vem')
+            if error:
+                errors.append(error)
+            if duration is None:
+                errors.append("Varaktighet i minuter krävs")
+            elif not isinstance(duration, int):
+                errors.append("Varaktighet måste anges i heltal")
+            elif duration < MIN_DURATION_MINUTES or duration > MAX_DURATION_MINUTES:
+                errors.append(_DURATION_RANGE_ERROR)
+
+        entries = get('satisfaction_entries')
+        satisfaction = []
+        if entries is not None:
+            if not isinstance(entries, list):
+                errors.append("Nöjdhet måste vara en lista")
+            elif len(entries) > total:
+                errors.append("Antalet nöjdhetsnoteringar får inte överstiga antalet deltagare")
+            else:
+                for entry in entries:
+                    if not isinstance(entry, dict):
+                        errors.append("Nöjdhetsposter måste vara objekt")
+                        break
+                    gender = entry.get('gender')
+                    rating = entry.get('rating')
+                    if not isinstance(gender, str) or gender not in ALLOWED_GENDERS:
+                        errors.append("Nöjdhet måste kopplas till man eller kvinna")
+                        break
+                    if not isinstance(rating, int) or rating < 1 or rating > 6:
+                        errors.append("Nöjdhet måste vara ett heltal mellan 1-6")
+                        break
+                    satisfaction.append({'gender': gender, 'rating': int(rating)})
+
+        if errors:
+            return None, errors
+
+        if department_id is not None and not isinstance(department_id, str):
+            department_id = str(department_id)
+        department_id = department_id or ''
+        if len(department_id) > MAX_DEPARTMENT_ID_LENGTH:
+            return None, ['Ogiltigt avdelnings-ID']
+
+        doc = dict(data)
+        doc['gender_counts'] = {'men': counts.get('men', 0), 'women': counts.get('women', 0)}
+        doc['total_participants'] = total
+        doc['department_id'] = _sanitize(department_id, 200)
+        if declined:
+            activity = companion = activity_id = companion_id = ''
+            duration = None
+        else:
+            activity = _sanitize(get('activity_name', ''), 100)
+            companion = _sanitize(get('companion_name', ''), 100)
+            activity_id = _sanitize(get('activity_id', ''), 120)
+            companion_id = _sanitize(get('companion_id', ''), 120)
+            if duration is not None:
+                try:
+                    duration = int(duration)
+                except (TypeError, ValueError):
+                    duration = None
+        doc['activity'] = doc['activity_name'] = activity
+        doc['companion'] = doc['companion_name'] = companion
+        doc['activity_id'] = activity_id
+        doc['companion_id'] = companion_id
+        doc['duration_minutes'] = duration
+        doc['satisfaction_entries'] = satisfaction
+        return doc, []
+
+
+def validate_visit(data: Dict, home_doc: Optional[Dict] = None,
+                   existing_department_id: Optional[str] = None) -> Tuple[Optional[Dict], List[str]]:
+    """Validera ett enskilt besök, se VisitValidator.validate."""
+    return VisitValidator(home_doc, existing_department_id).validate(data)
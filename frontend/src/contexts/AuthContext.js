@@ -62,7 +62,8 @@ export const AuthProvider = ({ children }) => {
               });
               await handleLoginResponse(instance, { 
                 account: accounts[0], 
-                accessToken: silentResponse.accessToken 
+                accessToken: silentResponse.accessToken,
+                idToken: silentResponse.idToken
               });
             } catch (err) {
               if (err instanceof InteractionRequiredAuthError) {
@@ -101,7 +102,9 @@ export const AuthProvider = ({ children }) => {
     try {
       const userResponse = await axios.post(API_ENDPOINTS.AZURE_USER, null, {
         headers: {
-          'Authorization': `Bearer ${response.accessToken}`
+          'Authorization': `Bearer ${response.accessToken}`,
+          // ID-token verifieras lokalt i backend när AUTH_VALIDATION_MODE=jwks
+          ...(response.idToken ? { 'X-Id-Token': response.idToken } : {})
         }
       });
 